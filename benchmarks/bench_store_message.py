@@ -0,0 +1,61 @@
+"""Compare per-row and batched upserts into gmail_messages.
+
+Runs against an in-memory database:
+
+    python benchmarks/bench_store_message.py [row_count]
+"""
+import os
+import sys
+import time
+from pathlib import Path
+
+os.environ["DUCKDB_PATH"] = ":memory:"
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from db import conn  # noqa: E402
+from service.gmailService import (  # noqa: E402
+    _MESSAGE_VALUE_COLUMNS,
+    _store_message,
+    _store_message_batch,
+    refresh_pending_lead_stats,
+)
+
+
+def _make_rows(prefix: str, count: int) -> list[tuple[str, list[str]]]:
+    return [
+        (f"{prefix}-{idx}", [f"{col}-{idx}" for col in _MESSAGE_VALUE_COLUMNS])
+        for idx in range(count)
+    ]
+
+
+def _timed(label: str, func, count: int) -> None:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  {count / elapsed:10.0f} rows/s")
+
+
+def _store_per_row(rows: list[tuple[str, list[str]]]) -> None:
+    for gmail_id, values in rows:
+        _store_message(gmail_id, values)
+    # The rollup refresh a sync makes once after its per-row stores.
+    refresh_pending_lead_stats()
+
+
+def main(count: int) -> None:
+    conn.execute("DELETE FROM gmail_messages")
+    per_row = _make_rows("row", count)
+    batched = _make_rows("batch", count)
+
+    _timed("per-row insert", lambda: _store_per_row(per_row), count)
+    _timed("batched insert", lambda: _store_message_batch(batched), count)
+    _timed("per-row update", lambda: _store_per_row(per_row), count)
+    _timed("batched update", lambda: _store_message_batch(batched), count)
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
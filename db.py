@@ -1,12 +1,64 @@
+import os
+import threading
+
 import duckdb
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "db" / "database.duckdb"
+DB_PATH = os.getenv("DUCKDB_PATH") or BASE_DIR / "db" / "database.duckdb"
+
+if DB_PATH != ":memory:":
+    Path(DB_PATH).parent.mkdir(parents=True, exist_ok=True)
+
+conn = duckdb.connect(str(DB_PATH))
+# TIMESTAMPTZ values are stored as instants; render and bucket them in UTC.
+conn.execute("SET TimeZone = 'UTC'")
+
+# The connection is shared by request handlers and sync workers and is not
+# safe for concurrent use: hold this lock around every conn.execute, reads
+# included, and for the whole of any explicit transaction.
+db_lock = threading.RLock()
+
+# Text formats received_at was stored in before it became a TIMESTAMPTZ.
+LEGACY_DATE_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%d.%m.%Y %H:%M:%S",
+    "%d.%m.%Y",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y",
+]
+
+# How received_at is shown in the sheet and the API.
+RECEIVED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
 
-DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
-conn = duckdb.connect(DB_PATH)
+# JSON columns of gmail_messages and the json_transform shape they are
+# written and read with; values outside the shape come back as NULL.
+_INSIGHTS_SCHEMA = '[{"title": "VARCHAR", "snippet": "VARCHAR", "url": "VARCHAR"}]'
+MESSAGE_JSON_SCHEMAS = {
+    "person_links": '["VARCHAR"]',
+    "person_insights": _INSIGHTS_SCHEMA,
+    "company_insights": _INSIGHTS_SCHEMA,
+}
+
+
+def select_message_columns(columns: list[str], *, decode_json: bool = False) -> str:
+    """SELECT list for gmail_messages with received_at rendered as text.
+
+    With `decode_json`, JSON columns are decoded by DuckDB and fetched as
+    Python lists/dicts; otherwise they are fetched as (minified) JSON text.
+    """
+    expressions = []
+    for column in columns:
+        if column == "received_at":
+            expressions.append(f"strftime(received_at, '{RECEIVED_AT_FORMAT}') AS received_at")
+        elif decode_json and column in MESSAGE_JSON_SCHEMAS:
+            expressions.append(f"json_transform({column}, '{MESSAGE_JSON_SCHEMAS[column]}') AS {column}")
+        else:
+            expressions.append(column)
+    return ", ".join(expressions)
+
 
 def init_db():
     conn.execute("""
@@ -34,7 +86,7 @@ def init_db():
         full_name TEXT,
         email TEXT,
         subject TEXT,
-        received_at TEXT,
+        received_at TIMESTAMPTZ,
         company TEXT,
         body TEXT,
         phone TEXT,
@@ -42,17 +94,58 @@ def init_db():
         company_name TEXT,
         company_info TEXT,
         person_role TEXT,
-        person_links TEXT,
+        person_links JSON,
         person_location TEXT,
         person_experience TEXT,
         person_summary TEXT,
-        person_insights TEXT,
-        company_insights TEXT,
+        person_insights JSON,
+        company_insights JSON,
         synced_at TIMESTAMP,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     """)
 
+    # Per-day rollup of gmail_messages for the dashboard (see service/leadStatsService.py).
+    # day is NULL for leads whose received_at could not be parsed.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS lead_stats_daily (
+        day DATE,
+        total INTEGER NOT NULL,
+        qualified INTEGER NOT NULL,
+        waiting INTEGER NOT NULL
+    )
+    """)
+
+    # Lead status changes waiting to be written to the sheet; one row per sheet
+    # row, so repeated changes coalesce (see service/sheetWriterService.py).
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sheet_status_outbox (
+        sheet_row INTEGER PRIMARY KEY,
+        status TEXT NOT NULL,
+        queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        namespace TEXT NOT NULL,
+        key TEXT NOT NULL,
+        value TEXT NOT NULL,
+        is_negative BOOLEAN DEFAULT FALSE,
+        expires_at DOUBLE NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (namespace, key)
+    )
+    """)
+
     conn.execute("""
     CREATE TABLE IF NOT EXISTS app_settings (
         key TEXT PRIMARY KEY,
@@ -77,4 +170,80 @@ def init_db():
         ],
     )
 
+    _migrate_db()
+
+
+def _migrate_db():
+    """Additive, idempotent schema changes for databases created by older versions."""
+    # Sheet row each message was appended to, so leads can be served from DuckDB.
+    conn.execute("ALTER TABLE gmail_messages ADD COLUMN IF NOT EXISTS sheet_row INTEGER")
+
+    _migrate_received_at()
+    _migrate_json_columns()
+
+
+def _migrate_received_at():
+    """Convert the legacy TEXT received_at column to TIMESTAMPTZ in place.
+
+    Legacy values carry no offset and are taken as UTC; values matching none
+    of LEGACY_DATE_FORMATS (nor ISO 8601) become NULL.
+    """
+    data_type = conn.execute(
+        """
+        SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'gmail_messages' AND column_name = 'received_at'
+        """
+    ).fetchone()[0]
+    if data_type != "VARCHAR":
+        return
+
+    formats = ", ".join(f"'{fmt}'" for fmt in LEGACY_DATE_FORMATS)
+    with db_lock:
+        conn.execute(
+            f"""
+            ALTER TABLE gmail_messages ALTER received_at SET DATA TYPE TIMESTAMPTZ USING COALESCE(
+                CAST(try_strptime(received_at, [{formats}]) AS TIMESTAMPTZ),
+                TRY_CAST(received_at AS TIMESTAMPTZ)
+            )
+            """
+        )
+        # Rebuilt from the typed column by leadStatsService.ensure_lead_stats at startup.
+        conn.execute("DELETE FROM lead_stats_daily")
+    print("[DB] Migrated gmail_messages.received_at to TIMESTAMPTZ")
+
+
+def _migrate_json_columns():
+    """Convert the legacy TEXT JSON columns to the JSON type in place.
+
+    Invalid JSON becomes NULL, except person_links, which older rows may hold
+    as a ";"-separated list.
+    """
+    legacy = {
+        row[0] for row in conn.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'gmail_messages' AND data_type = 'VARCHAR'
+            """
+        ).fetchall()
+    } & set(MESSAGE_JSON_SCHEMAS)
+    if not legacy:
+        return
+
+    with db_lock:
+        for column in sorted(legacy):
+            fallback = "NULL"
+            if column == "person_links":
+                fallback = (
+                    "CASE WHEN trim(person_links) <> '' THEN to_json(list_filter("
+                    "list_transform(string_split(person_links, ';'), link -> trim(link)), link -> link <> '')) END"
+                )
+            conn.execute(
+                f"""
+                ALTER TABLE gmail_messages ALTER {column} SET DATA TYPE JSON USING
+                    CASE WHEN json_valid({column}) THEN json({column}) ELSE {fallback} END
+                """
+            )
+    print(f"[DB] Migrated gmail_messages {', '.join(sorted(legacy))} to JSON")
+
+
 init_db()
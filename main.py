@@ -4,6 +4,9 @@ from routes.userRoutes import router as user_router
 from routes.gmailRoutes import router as gmail_router
 from routes.settingsRoutes import router as settings_router
 from service.autosyncService import auto_sync_loop
+from service.gmailService import warm_processed_ids_cache
+from service.leadStatsService import ensure_lead_stats
+from service.sheetWriterService import start_sheet_writer
 import asyncio
 
 app = FastAPI()
@@ -22,4 +25,7 @@ app.include_router(settings_router)
 
 @app.on_event("startup")
 async def startup():
+    warm_processed_ids_cache()
+    ensure_lead_stats()
+    start_sheet_writer()
     asyncio.create_task(auto_sync_loop())
@@ -1,21 +1,36 @@
+import json
+from typing import Any
+
 from fastapi import APIRouter, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, EmailStr, Field
 
-from service.syncService import sync_gmail_to_sheets
-from service.sheetService import build_leads_payload, update_lead_status
-from service.aiService import analyze_email
+from service.autosyncService import run_sync
+from service.syncService import SyncInProgressError
+from service.leadService import build_leads_payload
+from service.sheetService import update_lead_status, update_lead_status_by_gmail_id, update_lead_statuses
+from service.aiService import analyze_email_async, stream_email_replies
 
 router = APIRouter(prefix="/gmail", tags=["Gmail"])
 
 @router.post("/sync")
-def manual_sync():
-    count = sync_gmail_to_sheets()
+async def manual_sync():
+    try:
+        count = await run_sync()
+    except SyncInProgressError as exc:
+        raise HTTPException(status_code=409, detail=str(exc)) from exc
     return {"saved": count}
 
 
 @router.get("/leads")
-def get_leads(limit: int | None = Query(default=120, ge=1, le=500)):
-    payload = build_leads_payload(limit)
+def get_leads(
+    limit: int | None = Query(default=120, ge=1, le=500),
+    cursor: str | None = Query(default=None),
+):
+    try:
+        payload = build_leads_payload(limit, cursor)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
     return payload
 
 
@@ -23,32 +38,101 @@ class LeadInsightRequest(BaseModel):
     sender: EmailStr
     subject: str | None = ""
     body: str | None = ""
+    # Skip the cached analysis of identical content and recompute it.
+    refresh: bool = False
 
 
 @router.post("/lead-insights")
-def generate_lead_insights(payload: LeadInsightRequest):
+async def generate_lead_insights(payload: LeadInsightRequest):
     if not payload.body and not payload.subject:
         raise HTTPException(status_code=400, detail="Потрібно передати тему або текст листа")
 
-    result = analyze_email(
+    result = await analyze_email_async(
         subject=payload.subject or "",
         body=payload.body or "",
         sender=payload.sender,
+        use_cache=not payload.refresh,
     )
 
     return result
 
 
+class ReplyStreamRequest(BaseModel):
+    lead: dict[str, Any] | None = None
+    email: dict[str, Any] | None = None
+    placeholders: dict[str, Any] | None = None
+    prompt_overrides: dict[str, str] | None = None
+
+
+def _sse_event(event: str, data: dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/replies/stream")
+async def stream_replies(payload: ReplyStreamRequest):
+    """follow_up and recap replies as Server-Sent Events, generated concurrently.
+
+    Events: "delta" ({variant, text} chunks), "done" ({variant, text} final
+    reply), "error" ({variant, message}) and a closing "end".
+    """
+
+    async def _events():
+        async for event in stream_email_replies(
+            lead=payload.lead,
+            email=payload.email,
+            placeholders=payload.placeholders,
+            prompt_overrides=payload.prompt_overrides,
+        ):
+            yield _sse_event(event["event"], {key: value for key, value in event.items() if key != "event"})
+        yield _sse_event("end", {})
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 class LeadStatusUpdateRequest(BaseModel):
-    row_number: int = Field(gt=0)
+    # gmail_id is preferred; row_number is kept for older clients and can
+    # point at the wrong lead once the sheet changes.
+    gmail_id: str | None = None
+    row_number: int | None = Field(default=None, gt=0)
     status: str
 
 
 @router.post("/lead-status")
 def set_lead_status(payload: LeadStatusUpdateRequest):
     try:
-        update_lead_status(payload.row_number, payload.status)
+        if payload.gmail_id:
+            row_number = update_lead_status_by_gmail_id(payload.gmail_id, payload.status)
+        elif payload.row_number is not None:
+            row_number = payload.row_number
+            update_lead_status(row_number, payload.status)
+        else:
+            raise ValueError("gmail_id or row_number is required")
+    except LookupError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
     except ValueError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
 
-    return {"row_number": payload.row_number, "status": payload.status}
+    return {"gmail_id": payload.gmail_id, "row_number": row_number, "status": payload.status}
+
+
+class LeadStatusBulkItem(BaseModel):
+    gmail_id: str | None = None
+    row_number: int | None = None
+    status: str
+
+
+class LeadStatusBulkRequest(BaseModel):
+    items: list[LeadStatusBulkItem] = Field(min_length=1, max_length=1000)
+
+
+@router.post("/lead-status/bulk")
+def set_lead_statuses(payload: LeadStatusBulkRequest):
+    results = update_lead_statuses([item.model_dump() for item in payload.items])
+    return {
+        "updated": sum(1 for result in results if result["ok"]),
+        "results": results,
+    }
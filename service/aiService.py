@@ -1,21 +1,35 @@
 import os
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict
 from urllib.parse import urlparse
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from ddgs import DDGS
+import asyncio
+import hashlib
 import json
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+from functools import lru_cache
 import re
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import tiktoken
+except ImportError:  # listed in requirements.txt; without it token counts are estimated
+    tiktoken = None
 
 load_dotenv()
-from service.settingsService import get_reply_prompts
+from service.cacheService import PersistentTTLCache
+from service.settingsService import REPLY_PROMPT_KEY_PREFIX, get_reply_prompts, on_setting_updated
 
 
 client = OpenAI()
+# Used by the *_async API so FastAPI routes can await completions directly.
+async_client = AsyncOpenAI()
 
 
 AI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4.1-mini")
@@ -30,11 +44,136 @@ COMPANY_SEARCH_MAX_RESULTS = int(os.getenv("COMPANY_SEARCH_MAX_RESULTS", "6"))
 COMPANY_SEARCH_TIMEOUT_SECONDS = float(os.getenv("COMPANY_SEARCH_TIMEOUT_SECONDS", "6"))
 COMPANY_SEARCH_MAX_TOOL_CALLS = int(os.getenv("COMPANY_SEARCH_MAX_TOOL_CALLS", "2"))
 PERSON_SEARCH_MAX_RESULTS = int(os.getenv("PERSON_SEARCH_MAX_RESULTS", "4"))
+# Overall budget for the website/company/person lookups in analyze_email;
+# whatever finished by then is used.
+ENRICHMENT_DEADLINE_SECONDS = float(
+    os.getenv("ENRICHMENT_DEADLINE_SECONDS", str(COMPANY_SEARCH_TIMEOUT_SECONDS + 2))
+)
 AI_DEBUG = os.getenv("AI_DEBUG", "false").strip().lower() in {"1", "true", "yes", "y", "on"}
+# analyze_emails_batch packs up to this many emails into one completion.
+AI_BATCH_MAX_EMAILS = max(1, int(os.getenv("AI_BATCH_MAX_EMAILS", "10")))
+# "auto" makes the final completion only when enrichment found something,
+# "merge" never makes it and folds enrichment into the Step-1 JSON in Python,
+# "always" keeps the unconditional second call.
+AI_FINAL_PASS_MODE = os.getenv("AI_FINAL_PASS_MODE", "auto").strip().lower()
+
+# Email bodies lose quoted history and extra whitespace before analysis and
+# are cut to this many tokens (0 = no cut), keeping the signature block.
+AI_BODY_TRIM_ENABLED = os.getenv("AI_BODY_TRIM_ENABLED", "true").strip().lower() in {
+    "1",
+    "true",
+    "yes",
+    "y",
+    "on",
+}
+AI_BODY_TOKEN_BUDGET = int(os.getenv("AI_BODY_TOKEN_BUDGET", "1500"))
+# Lines kept from the end of the body when no "-- " signature delimiter is found.
+AI_SIGNATURE_LINES = int(os.getenv("AI_SIGNATURE_LINES", "8"))
+
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Errors and timeouts are retried much sooner than real results.
+SEARCH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_NEGATIVE_TTL_SECONDS", "900"))
+
+# company_search values: {"context": str, "results": list[dict]}
+_company_search_cache = PersistentTTLCache(
+    "company_search", SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_NEGATIVE_TTL_SECONDS
+)
+_person_search_cache = PersistentTTLCache(
+    "person_search", SEARCH_CACHE_TTL_SECONDS, SEARCH_CACHE_NEGATIVE_TTL_SECONDS
+)
+
+# fetch_website_tool stops reading once </head> is seen or this many bytes arrived.
+WEBSITE_FETCH_MAX_BYTES = int(os.getenv("WEBSITE_FETCH_MAX_BYTES", "65536"))
+WEBSITE_CACHE_TTL_SECONDS = float(os.getenv("WEBSITE_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+
+_website_session = requests.Session()
+_website_session.headers["User-Agent"] = "Mozilla/5.0 (compatible; GradientBot/1.0; +https://example.com)"
+_website_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32)
+_website_session.mount("http://", _website_adapter)
+_website_session.mount("https://", _website_adapter)
+
+# website_meta values: {"summary": str, "etag": str | None, "last_modified": str | None}.
+# Entries are always revalidated with a conditional GET; the TTL only bounds
+# how long validators are kept.
+_website_meta_cache = PersistentTTLCache(
+    "website_meta", WEBSITE_CACHE_TTL_SECONDS, SEARCH_CACHE_NEGATIVE_TTL_SECONDS
+)
+
+# Whole analyze_email results, keyed by a hash of the email and of the
+# pipeline that produced them, so duplicates skip all LLM and search work.
+ANALYSIS_CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "true").strip().lower() in {
+    "1",
+    "true",
+    "yes",
+    "y",
+    "on",
+}
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Analyses where a lookup timed out or failed are redone after this long.
+ANALYSIS_CACHE_INCOMPLETE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_INCOMPLETE_TTL_SECONDS", "600"))
+
+# Unparseable completions are never cached; incomplete enrichment is stored
+# as a negative entry (see _cache_analysis).
+_analysis_cache = PersistentTTLCache(
+    "email_analysis", ANALYSIS_CACHE_TTL_SECONDS, ANALYSIS_CACHE_INCOMPLETE_TTL_SECONDS
+)
+
+# Shared pools so a lookup that overruns its deadline keeps running in the
+# background (and fills the cache) instead of blocking the caller. Company
+# query variants use their own pool because they are submitted from
+# enrichment tasks; it has room for every variant of every running
+# enrichment task, so variants never queue behind each other.
+_ENRICHMENT_WORKERS = 12
+_COMPANY_QUERY_VARIANTS = 4  # query_variants in search_company_tool
+_enrichment_executor = ThreadPoolExecutor(max_workers=_ENRICHMENT_WORKERS, thread_name_prefix="ai-enrich")
+_search_executor = ThreadPoolExecutor(
+    max_workers=_ENRICHMENT_WORKERS * _COMPANY_QUERY_VARIANTS, thread_name_prefix="ai-search"
+)
+# Runs _run_enrichment for every email of a batch at once.
+_batch_executor = ThreadPoolExecutor(max_workers=AI_BATCH_MAX_EMAILS, thread_name_prefix="ai-batch")
+
+# How often _wait_from_start checks whether queued lookups have started.
+_LOOKUP_START_POLL_SECONDS = 0.05
+
+
+def _submit_timed(executor: ThreadPoolExecutor, fn, *args) -> tuple[Future, list[float]]:
+    """Submit fn(*args); the returned list receives its monotonic start time once it runs."""
+    started: list[float] = []
+
+    def _run():
+        started.append(time.monotonic())
+        return fn(*args)
+
+    return executor.submit(_run), started
+
+
+def _wait_from_start(tasks: dict[str, tuple[Future, list[float]]], timeout: float) -> tuple[set, set]:
+    """Like wait(), but each task's timeout counts from when it started running.
+
+    Batch analysis can queue many lookups at once, and time spent waiting for
+    a worker must not count against a lookup's budget.
+    """
+    started = {future: start for future, start in tasks.values()}
+    pending = set(started)
+
+    while pending:
+        now = time.monotonic()
+        waiting = {future for future in pending if not started[future] or now - started[future][0] < timeout}
+        if not waiting:
+            break
+        deadlines = [started[future][0] + timeout for future in waiting if started[future]]
+        if len(deadlines) < len(waiting):
+            deadlines.append(now + _LOOKUP_START_POLL_SECONDS)
+        done, _ = wait(waiting, timeout=max(0.0, min(deadlines) - now), return_when=FIRST_COMPLETED)
+        pending -= done
+
+    return set(started) - pending, pending
+
 
-_company_search_cache: Dict[str, str] = {}
-_company_search_struct_cache: Dict[str, list[dict[str, str]]] = {}
-_person_search_cache: Dict[str, list[dict[str, str]]] = {}
+# How often each analysis path ran: "fast" (Step-1 JSON as is), "merged"
+# (enrichment merged in Python) and "final_llm" (second completion).
+_analysis_path_counts = {"fast": 0, "merged": 0, "final_llm": 0}
+_analysis_path_lock = threading.Lock()
 
 MAX_REPLY_WORDS = 140
 REPLY_VARIANTS = ("follow_up", "recap")
@@ -150,19 +289,38 @@ def _collect_placeholder_mapping(
     return mapping
 
 
+_PLACEHOLDER_RE = re.compile(r"\[([^\[\]]+)\]")
+
+
+@lru_cache(maxsize=128)
+def _compile_template(template: str) -> tuple[tuple[tuple[str, str, str], ...], str]:
+    """Split a reply template into (literal, "[placeholder]", normalized key) segments and a trailing literal."""
+    segments = []
+    pos = 0
+    for match in _PLACEHOLDER_RE.finditer(template):
+        segments.append((template[pos:match.start()], match.group(0), _normalize_placeholder_key(match.group(1))))
+        pos = match.end()
+    return tuple(segments), template[pos:]
+
+
+# Templates are keyed by their text, so a changed prompt compiles anew; the
+# clear just drops the superseded entries.
+on_setting_updated(lambda key: _compile_template.cache_clear())
+
+
 def _render_prompt(template: str, mapping: dict[str, str]) -> str:
     if not template:
         return ""
 
-    pattern = re.compile(r"\[([^\[\]]+)\]")
-
-    def replacer(match: re.Match[str]) -> str:
-        raw_key = match.group(1)
-        norm_key = _normalize_placeholder_key(raw_key)
-        replacement = mapping.get(norm_key)
-        return replacement if replacement is not None else match.group(0)
+    segments, tail = _compile_template(template)
+    parts: list[str] = []
+    for literal, placeholder, key in segments:
+        parts.append(literal)
+        replacement = mapping.get(key)
+        parts.append(replacement if replacement is not None else placeholder)
+    parts.append(tail)
 
-    return pattern.sub(replacer, template).strip()
+    return "".join(parts).strip()
 
 
 def _compose_reply_context(
@@ -200,18 +358,17 @@ def _build_reply_messages(rendered_prompt: str, context: str) -> list[dict[str,
     ]
 
 
-def generate_email_replies(
-    *,
+def _prepare_reply_messages(
     lead: dict[str, Any] | None,
     email: dict[str, Any] | None,
-    placeholders: dict[str, Any] | None = None,
-    prompt_overrides: dict[str, str] | None = None,
-) -> dict[str, str]:
-    """Generate two reply variants (follow_up, recap) using configurable prompts."""
+    placeholders: dict[str, Any] | None,
+    prompt_overrides: dict[str, str] | None,
+) -> dict[str, list[dict[str, str]] | None]:
+    """Build chat messages per reply variant; None means the rendered prompt is empty."""
 
     stored_prompts = get_reply_prompts()
     prompts: dict[str, str] = {
-        variant: (stored_prompts.get(variant) or "")
+        variant: (stored_prompts.get(REPLY_PROMPT_KEY_PREFIX + variant) or "")
         for variant in REPLY_VARIANTS
     }
 
@@ -223,25 +380,44 @@ def generate_email_replies(
     mapping = _collect_placeholder_mapping(lead, email, placeholders)
     context = _compose_reply_context(lead, email, placeholders)
 
-    replies: dict[str, str] = {}
+    variant_messages: dict[str, list[dict[str, str]] | None] = {}
     for variant in REPLY_VARIANTS:
         template = prompts.get(variant, "")
         rendered_prompt = _render_prompt(template, mapping)
+        variant_messages[variant] = _build_reply_messages(rendered_prompt, context) if rendered_prompt else None
+
+    return variant_messages
+
 
-        if not rendered_prompt:
+def _completion_text(completion: Any) -> str:
+    choice = completion.choices[0] if completion.choices else None
+    return choice.message.content if choice and choice.message else ""
+
+
+def generate_email_replies(
+    *,
+    lead: dict[str, Any] | None,
+    email: dict[str, Any] | None,
+    placeholders: dict[str, Any] | None = None,
+    prompt_overrides: dict[str, str] | None = None,
+) -> dict[str, str]:
+    """Generate two reply variants (follow_up, recap) using configurable prompts."""
+
+    variant_messages = _prepare_reply_messages(lead, email, placeholders, prompt_overrides)
+
+    replies: dict[str, str] = {}
+    for variant, messages in variant_messages.items():
+        if not messages:
             replies[variant] = ""
             continue
 
-        messages = _build_reply_messages(rendered_prompt, context)
-
         try:
             completion = client.chat.completions.create(
                 model=AI_MODEL,
                 messages=messages,
                 temperature=0.35,
             )
-            choice = completion.choices[0] if completion.choices else None
-            content = choice.message.content if choice and choice.message else ""
+            content = _completion_text(completion)
         except Exception as exc:  # pragma: no cover - guardrail in case OpenAI errors
             if AI_DEBUG:
                 print(f"[AI] generate_email_replies error for {variant}: {exc}")
@@ -252,6 +428,96 @@ def generate_email_replies(
     return replies
 
 
+async def generate_email_replies_async(
+    *,
+    lead: dict[str, Any] | None,
+    email: dict[str, Any] | None,
+    placeholders: dict[str, Any] | None = None,
+    prompt_overrides: dict[str, str] | None = None,
+) -> dict[str, str]:
+    """Async variant of generate_email_replies; all variants are requested concurrently."""
+
+    variant_messages = _prepare_reply_messages(lead, email, placeholders, prompt_overrides)
+
+    async def _generate(variant: str, messages: list[dict[str, str]] | None) -> str:
+        if not messages:
+            return ""
+        try:
+            completion = await async_client.chat.completions.create(
+                model=AI_MODEL,
+                messages=messages,
+                temperature=0.35,
+            )
+            content = _completion_text(completion)
+        except Exception as exc:  # pragma: no cover - guardrail in case OpenAI errors
+            if AI_DEBUG:
+                print(f"[AI] generate_email_replies_async error for {variant}: {exc}")
+            content = ""
+        return _enforce_word_limit(content or "")
+
+    variants = list(variant_messages)
+    contents = await asyncio.gather(*(_generate(variant, variant_messages[variant]) for variant in variants))
+    return dict(zip(variants, contents))
+
+
+async def stream_email_replies(
+    *,
+    lead: dict[str, Any] | None,
+    email: dict[str, Any] | None,
+    placeholders: dict[str, Any] | None = None,
+    prompt_overrides: dict[str, str] | None = None,
+) -> AsyncIterator[dict[str, str]]:
+    """Streaming variant of generate_email_replies_async; all variants stream concurrently.
+
+    Yields {"event": "delta", "variant", "text"} per received chunk, then per
+    variant either {"event": "done", "variant", "text"} with the word-limited
+    reply or {"event": "error", "variant", "message"}.
+    """
+
+    variant_messages = _prepare_reply_messages(lead, email, placeholders, prompt_overrides)
+    queue: asyncio.Queue[dict[str, str]] = asyncio.Queue()
+
+    async def _stream(variant: str, messages: list[dict[str, str]] | None) -> None:
+        text = ""
+        try:
+            if messages:
+                stream = await async_client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=messages,
+                    temperature=0.35,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
+                        continue
+                    text += delta
+                    await queue.put({"event": "delta", "variant": variant, "text": delta})
+                    if len(text.split()) > MAX_REPLY_WORDS:
+                        # The rest would be cut by the word limit anyway.
+                        await stream.close()
+                        break
+        except Exception as exc:
+            if AI_DEBUG:
+                print(f"[AI] stream_email_replies error for {variant}: {exc}")
+            await queue.put({"event": "error", "variant": variant, "message": "Reply generation failed"})
+            return
+        await queue.put({"event": "done", "variant": variant, "text": _enforce_word_limit(text)})
+
+    tasks = [asyncio.create_task(_stream(variant, messages)) for variant, messages in variant_messages.items()]
+    try:
+        remaining = len(tasks)
+        while remaining:
+            event = await queue.get()
+            if event["event"] != "delta":
+                remaining -= 1
+            yield event
+    finally:
+        # The client may disconnect mid-stream; don't leave completions running.
+        for task in tasks:
+            task.cancel()
+
+
 _PERSONAL_EMAIL_DOMAINS = {
     "gmail.com",
     "yahoo.com",
@@ -294,13 +560,40 @@ def _company_candidate_from_sender_email(sender_email: str) -> str | None:
     return " ".join([w[:1].upper() + w[1:] for w in candidate.split() if w]) or None
 
 
+# What the lookup tools return instead of data. They are readable tool output,
+# but never enrichment context.
+_NO_COMPANY_TEXT = "No company provided."
+_NO_SEARCH_RESULTS_TEXT = "No info found online."
+_SEARCH_TIMEOUT_TEXT = "Search timeout."
+_SEARCH_ERROR_PREFIX = "Error during search:"
+_NO_WEBSITE_TEXT = "No website provided."
+_NO_WEBSITE_METADATA_TEXT = "No usable metadata found on website."
+_WEBSITE_STATUS_PREFIX = "Website request failed with status"
+_WEBSITE_ERROR_PREFIX = "Error fetching website:"
+
+_EMPTY_RESULT_TEXTS = {_NO_COMPANY_TEXT, _NO_SEARCH_RESULTS_TEXT, _NO_WEBSITE_TEXT, _NO_WEBSITE_METADATA_TEXT}
+_FAILED_RESULT_PREFIXES = (_SEARCH_TIMEOUT_TEXT, _SEARCH_ERROR_PREFIX, _WEBSITE_STATUS_PREFIX, _WEBSITE_ERROR_PREFIX)
+
+
+def _is_failed_result(text: str) -> bool:
+    return text.strip().startswith(_FAILED_RESULT_PREFIXES)
+
+
+def _has_payload(text: Any) -> bool:
+    """True for tool output that carries data, not an empty-result or error sentinel."""
+    if not isinstance(text, str):
+        return False
+    text = text.strip()
+    return bool(text) and text not in _EMPTY_RESULT_TEXTS and not _is_failed_result(text)
+
+
 def search_company_tool(company_name: str) -> str:
     if not company_name:
-        return "No company provided."
+        return _NO_COMPANY_TEXT
 
     cached = _company_search_cache.get(company_name)
     if cached is not None:
-        return cached
+        return cached["context"]
 
     query_variants = [
         f'"{company_name}" company overview',
@@ -329,40 +622,52 @@ def search_company_tool(company_name: str) -> str:
             with DDGS() as ddgs:
                 return list(ddgs.text(query, max_results=COMPANY_SEARCH_MAX_RESULTS))
 
-        with ThreadPoolExecutor(max_workers=1) as ex:
-            for query in query_variants:
-                fut = ex.submit(_search_once, query)
-                results = fut.result(timeout=COMPANY_SEARCH_TIMEOUT_SECONDS)
-
-                for result in results:
-                    title = (result.get("title") or "").strip()
-                    snippet = (result.get("body") or "").strip()
-                    url = (result.get("href") or result.get("url") or "").strip()
-
-                    if not title and not snippet and not url:
-                        continue
-
-                    dedupe_key = url or f"{title}|{snippet}"
-                    if dedupe_key in seen_keys:
-                        continue
-                    seen_keys.add(dedupe_key)
-
-                    aggregated.append({
-                        "title": title,
-                        "snippet": snippet,
-                        "url": url,
-                    })
-
-                    if len(aggregated) >= COMPANY_SEARCH_MAX_RESULTS:
-                        break
+        # All variants run at once; the timeout bounds the whole search and
+        # results are merged in variant order from the ones that finished.
+        futures = [_search_executor.submit(_search_once, query) for query in query_variants]
+        done, pending = wait(futures, timeout=COMPANY_SEARCH_TIMEOUT_SECONDS)
+        for fut in pending:
+            fut.cancel()
+
+        completed = [fut.result() for fut in futures if fut in done and fut.exception() is None]
+        if not completed:
+            if pending:
+                raise TimeoutError()
+            raise next(fut.exception() for fut in futures)
+
+        for results in completed:
+            for result in results:
+                title = (result.get("title") or "").strip()
+                snippet = (result.get("body") or "").strip()
+                url = (result.get("href") or result.get("url") or "").strip()
+
+                if not title and not snippet and not url:
+                    continue
+
+                dedupe_key = url or f"{title}|{snippet}"
+                if dedupe_key in seen_keys:
+                    continue
+                seen_keys.add(dedupe_key)
+
+                aggregated.append({
+                    "title": title,
+                    "snippet": snippet,
+                    "url": url,
+                })
 
                 if len(aggregated) >= COMPANY_SEARCH_MAX_RESULTS:
                     break
 
+            if len(aggregated) >= COMPANY_SEARCH_MAX_RESULTS:
+                break
+
+        # Results from a search where some variants timed out are only
+        # kept for the short negative TTL.
+        partial = bool(pending)
+
         if not aggregated:
-            out = "No info found online."
-            _company_search_cache[company_name] = out
-            _company_search_struct_cache[company_name] = []
+            out = _NO_SEARCH_RESULTS_TEXT
+            _company_search_cache.set(company_name, {"context": out, "results": []}, negative=partial)
             return out
 
         context_lines = [
@@ -370,19 +675,23 @@ def search_company_tool(company_name: str) -> str:
             for idx, entry in enumerate(aggregated, start=1)
         ]
         context = "\n".join(context_lines)
-        _company_search_cache[company_name] = context
-        _company_search_struct_cache[company_name] = aggregated
+        _company_search_cache.set(company_name, {"context": context, "results": aggregated}, negative=partial)
         return context
     except TimeoutError:
-        out = "Search timeout."
-        _company_search_cache[company_name] = out
+        out = _SEARCH_TIMEOUT_TEXT
+        _company_search_cache.set(company_name, {"context": out, "results": []}, negative=True)
         return out
     except Exception as e:
-        out = f"Error during search: {e}"
-        _company_search_cache[company_name] = out
+        out = f"{_SEARCH_ERROR_PREFIX} {e}"
+        _company_search_cache.set(company_name, {"context": out, "results": []}, negative=True)
         return out
 
 
+def _company_search_results(company_name: str) -> list[dict[str, str]]:
+    cached = _company_search_cache.get(company_name) if company_name else None
+    return cached["results"] if cached else []
+
+
 def search_person_insights(full_name: str, company_hint: str | None = None) -> list[dict[str, str]]:
     """Search for person insights using DuckDuckGo to infer role and social links."""
 
@@ -390,14 +699,16 @@ def search_person_insights(full_name: str, company_hint: str | None = None) -> l
         return []
 
     cache_key = f"{full_name}|{company_hint or ''}"
-    if cache_key in _person_search_cache:
-        return _person_search_cache[cache_key]
+    cached = _person_search_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     query = full_name
     if company_hint:
         query = f"{full_name} {company_hint}"
 
     results: list[dict[str, str]] = []
+    failed = False
 
     try:
         with DDGS() as ddgs:
@@ -420,55 +731,99 @@ def search_person_insights(full_name: str, company_hint: str | None = None) -> l
             if len(results) >= PERSON_SEARCH_MAX_RESULTS:
                 break
     except Exception as exc:  # pragma: no cover - network errors tolerated
+        failed = True
         if AI_DEBUG:
             print(f"[AI] person search failed: {exc}")
 
-    _person_search_cache[cache_key] = results
+    _person_search_cache.set(cache_key, results, negative=failed)
     return results
 
 
-def fetch_website_tool(url: str) -> str:
-    if not url:
-        return "No website provided."
-
+def _read_html_head(resp: requests.Response, max_bytes: int) -> str:
+    """Read a streamed response until </head> is seen or max_bytes arrived."""
+    buffer = bytearray()
+    for chunk in resp.iter_content(chunk_size=8192):
+        if not chunk:
+            continue
+        # Re-scan a small overlap so a tag split across chunks is still found.
+        scan_from = max(0, len(buffer) - len(b"</head>"))
+        buffer.extend(chunk)
+        if b"</head>" in buffer[scan_from:].lower() or len(buffer) >= max_bytes:
+            break
+
+    content_type = resp.headers.get("Content-Type", "")
+    charset_match = re.search(r"charset=([\w-]+)", content_type, flags=re.IGNORECASE)
+    encoding = charset_match.group(1) if charset_match else "utf-8"
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (compatible; GradientBot/1.0; +https://example.com)"
-        }
-        resp = requests.get(url, headers=headers, timeout=COMPANY_SEARCH_TIMEOUT_SECONDS)
-        if resp.status_code >= 400:
-            return f"Website request failed with status {resp.status_code}."
-
-        html = resp.text or ""
-
-        title_match = re.search(r"<title[^>]*>(.*?)</title>", html, flags=re.IGNORECASE | re.DOTALL)
-        title = re.sub(r"\s+", " ", title_match.group(1)).strip() if title_match else ""
-
-        desc_match = re.search(
-            r'<meta[^>]+name=["\']description["\'][^>]+content=["\']([^"\']+)["\']',
-            html,
-            flags=re.IGNORECASE,
-        )
-        desc = re.sub(r"\s+", " ", desc_match.group(1)).strip() if desc_match else ""
+        return bytes(buffer[:max_bytes]).decode(encoding, errors="replace")
+    except LookupError:
+        return bytes(buffer[:max_bytes]).decode("utf-8", errors="replace")
 
-        og_desc_match = re.search(
-            r'<meta[^>]+property=["\']og:description["\'][^>]+content=["\']([^"\']+)["\']',
-            html,
-            flags=re.IGNORECASE,
-        )
-        og_desc = re.sub(r"\s+", " ", og_desc_match.group(1)).strip() if og_desc_match else ""
 
-        summary_parts = []
-        if title:
-            summary_parts.append(f"Title: {title}")
-        if desc:
-            summary_parts.append(f"Meta description: {desc}")
-        if og_desc and og_desc != desc:
-            summary_parts.append(f"OG description: {og_desc}")
+def _summarize_html_metadata(html: str) -> str:
+    title_match = re.search(r"<title[^>]*>(.*?)</title>", html, flags=re.IGNORECASE | re.DOTALL)
+    title = re.sub(r"\s+", " ", title_match.group(1)).strip() if title_match else ""
+
+    desc_match = re.search(
+        r'<meta[^>]+name=["\']description["\'][^>]+content=["\']([^"\']+)["\']',
+        html,
+        flags=re.IGNORECASE,
+    )
+    desc = re.sub(r"\s+", " ", desc_match.group(1)).strip() if desc_match else ""
+
+    og_desc_match = re.search(
+        r'<meta[^>]+property=["\']og:description["\'][^>]+content=["\']([^"\']+)["\']',
+        html,
+        flags=re.IGNORECASE,
+    )
+    og_desc = re.sub(r"\s+", " ", og_desc_match.group(1)).strip() if og_desc_match else ""
 
-        return "\n".join(summary_parts) or "No usable metadata found on website."
+    summary_parts = []
+    if title:
+        summary_parts.append(f"Title: {title}")
+    if desc:
+        summary_parts.append(f"Meta description: {desc}")
+    if og_desc and og_desc != desc:
+        summary_parts.append(f"OG description: {og_desc}")
+
+    return "\n".join(summary_parts) or _NO_WEBSITE_METADATA_TEXT
+
+
+def fetch_website_tool(url: str) -> str:
+    if not url:
+        return _NO_WEBSITE_TEXT
+
+    try:
+        cached = _website_meta_cache.get(url)
+        headers = {}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        with _website_session.get(
+            url,
+            headers=headers,
+            timeout=COMPANY_SEARCH_TIMEOUT_SECONDS,
+            stream=True,
+        ) as resp:
+            if resp.status_code == 304 and cached:
+                _website_meta_cache.set(url, cached)
+                return cached["summary"]
+
+            if resp.status_code >= 400:
+                return f"{_WEBSITE_STATUS_PREFIX} {resp.status_code}."
+
+            html = _read_html_head(resp, WEBSITE_FETCH_MAX_BYTES)
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+
+        summary = _summarize_html_metadata(html)
+        _website_meta_cache.set(url, {"summary": summary, "etag": etag, "last_modified": last_modified})
+        return summary
     except Exception as e:
-        return f"Error fetching website: {e}"
+        return f"{_WEBSITE_ERROR_PREFIX} {e}"
 
 
 tools_schema = [
@@ -529,41 +884,200 @@ def _normalize_website(url: str | None) -> str | None:
     return "https://" + u
 
 
-def analyze_email(subject: str, body: str, sender: str) -> Dict[str, Any]:
-    """Call OpenAI to extract structured fields from an email.
+# "On Mon, 3 Mar 2025 ... <x@y.com> wrote:" (Gmail may wrap it onto two
+# lines), Outlook's "-----Original Message-----" and "... пише:" headers.
+_QUOTE_HEADER_RE = re.compile(
+    r"^(?:On\b[^\n]{0,200}(?:\n[^\n]{0,200})?\bwrote:|-{2,}\s*Original Message\s*-{2,}|[^\n]{0,200}\bпише:)[ \t]*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+_SIGNATURE_DELIMITER_RE = re.compile(r"^--\s*$")
+_CHARS_PER_TOKEN = 4
+_TRIM_MARKER = "\n[...]\n"
+
+# Token counts before and after body preprocessing, over all analyzed emails.
+_body_trim_counts = {"emails": 0, "tokens_in": 0, "tokens_out": 0}
+_body_trim_lock = threading.Lock()
+_token_encoding = None
+_token_encoding_loaded = False
+# Loading can download and build the BPE file, so only one thread does it;
+# lru_cache would not stop concurrent first calls from each loading it.
+_token_encoding_lock = threading.Lock()
+
+
+def _get_token_encoding():
+    global _token_encoding, _token_encoding_loaded
+    if _token_encoding_loaded:
+        return _token_encoding
+
+    with _token_encoding_lock:
+        if not _token_encoding_loaded:
+            if tiktoken is not None:
+                try:
+                    try:
+                        _token_encoding = tiktoken.encoding_for_model(AI_MODEL)
+                    except KeyError:
+                        _token_encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as exc:
+                    # Encodings are downloaded on first use; stay on the estimate when offline.
+                    print(f"[AI] tiktoken unavailable, estimating tokens: {exc}")
+            _token_encoding_loaded = True
+    return _token_encoding
+
+
+def _count_tokens(text: str) -> int:
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return -(-len(text) // _CHARS_PER_TOKEN)
+
+
+def _truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_token_encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text)[:max_tokens])
+    return text[:max_tokens * _CHARS_PER_TOKEN]
+
+
+def _strip_quoted_history(text: str) -> str:
+    header = _QUOTE_HEADER_RE.search(text)
+    if header is not None and text[:header.start()].strip():
+        text = text[:header.start()]
+    return "\n".join(line for line in text.split("\n") if not line.lstrip().startswith(">"))
+
+
+def _collapse_whitespace(text: str) -> str:
+    text = re.sub(r"[ \t\u00a0]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _fit_token_budget(text: str, budget: int) -> str:
+    """Cut `text` to `budget` tokens from the top, keeping the signature block at the end."""
+    if budget <= 0 or _count_tokens(text) <= budget:
+        return text
+
+    lines = text.split("\n")
+    split_at = max(0, len(lines) - AI_SIGNATURE_LINES)
+    for idx in range(len(lines) - 1, split_at - 1, -1):
+        if _SIGNATURE_DELIMITER_RE.match(lines[idx]):
+            split_at = idx
+            break
+
+    # The signature may take at most half of the budget.
+    signature = _truncate_tokens("\n".join(lines[split_at:]), budget // 2)
+    head_budget = budget - _count_tokens(signature) - _count_tokens(_TRIM_MARKER)
+    head = _truncate_tokens("\n".join(lines[:split_at]), head_budget)
+    return head.rstrip() + _TRIM_MARKER + signature
+
+
+def _prepare_body(body: str) -> str:
+    """Body text as sent to the model: quoted history stripped, whitespace collapsed, cut to AI_BODY_TOKEN_BUDGET."""
+    if not AI_BODY_TRIM_ENABLED or not body:
+        return body
+
+    text = _collapse_whitespace(_strip_quoted_history(body)) or _collapse_whitespace(body)
+    text = _fit_token_budget(text, AI_BODY_TOKEN_BUDGET)
+
+    tokens_in = _count_tokens(body)
+    tokens_out = _count_tokens(text)
+    with _body_trim_lock:
+        _body_trim_counts["emails"] += 1
+        _body_trim_counts["tokens_in"] += tokens_in
+        _body_trim_counts["tokens_out"] += tokens_out
+    if AI_DEBUG:
+        print(f"[AI] body {tokens_in} -> {tokens_out} tokens")
 
-    Expected JSON schema in the response:
-    {
-        "email": string | null,
-        "first_name": string | null,
-        "last_name": string | null,
-        "full_name": string | null,
-        "company": string | null,
-        "order_number": string | null,
-        "order_description": string | null,
-        
+    return text
+
+
+def get_body_trim_stats() -> dict[str, float]:
+    with _body_trim_lock:
+        counts = dict(_body_trim_counts)
+    saved = counts["tokens_in"] - counts["tokens_out"]
+    return {
+        **counts,
+        "tokens_saved": saved,
+        "avg_tokens_saved": saved / counts["emails"] if counts["emails"] else 0.0,
+        "tokenizer": "tiktoken" if _get_token_encoding() is not None else "estimate",
     }
-    """
 
-    system_prompt = (
-        "You are an intelligent email parsing assistant. "
-        "Your goal involves two steps: "
-        "1) Extract structured data from the email. "
-        "2) If you identify a company name, call the tool 'search_company_tool' to get extra company details. "
-        "If no company name is explicitly present in the email text, you may infer a company from the sender email domain "
-        "(but do not infer companies for personal email providers like gmail.com). "
-        "Finally, return ONLY a valid JSON object with the exact keys: "
-        "email, first_name, last_name, full_name, company, company_summary, "
-        "order_number, order_description, amount, currency, "
-        "phone_number, website, person_role, person_location, person_experience, person_links, person_summary. "
-        "If some field is not present, set it to null. "
-        "If amount is present, use a number (dot as decimal separator)."
+
+_ANALYSIS_FIELDS = (
+    "email, first_name, last_name, full_name, company, company_summary, "
+    "order_number, order_description, amount, currency, "
+    "phone_number, website, person_role, person_location, person_experience, person_links, person_summary"
+)
+
+_ANALYSIS_SYSTEM_PROMPT = (
+    "You are an intelligent email parsing assistant. "
+    "Your goal involves two steps: "
+    "1) Extract structured data from the email. "
+    "2) If you identify a company name, call the tool 'search_company_tool' to get extra company details. "
+    "If no company name is explicitly present in the email text, you may infer a company from the sender email domain "
+    "(but do not infer companies for personal email providers like gmail.com). "
+    "Finally, return ONLY a valid JSON object with the exact keys: "
+    + _ANALYSIS_FIELDS + ". "
+    "If some field is not present, set it to null. "
+    "If amount is present, use a number (dot as decimal separator)."
+)
+
+_FINAL_SYSTEM_PROMPT = (
+    _ANALYSIS_SYSTEM_PROMPT
+    + " Use the enrichment context (if provided) to populate company_summary and website accurately."
+    + " If person search results are provided, populate role, experience level, social links when possible."
+)
+
+_BATCH_INSTRUCTIONS = (
+    " You will receive several emails, each starting with a line 'EMAIL <id>'."
+    " Handle every email independently and return ONLY one JSON object that maps each email id"
+    " to that email's JSON object with the keys above."
+)
+_BATCH_ANALYSIS_SYSTEM_PROMPT = _ANALYSIS_SYSTEM_PROMPT + _BATCH_INSTRUCTIONS
+_BATCH_FINAL_SYSTEM_PROMPT = _FINAL_SYSTEM_PROMPT + _BATCH_INSTRUCTIONS
+
+# Changes whenever the model, the prompts or the settings that shape the
+# result change, so stale cached analyses are never served.
+_ANALYSIS_PIPELINE_VERSION = hashlib.sha256("\n".join([
+    AI_MODEL,
+    _ANALYSIS_SYSTEM_PROMPT,
+    _FINAL_SYSTEM_PROMPT,
+    AI_FINAL_PASS_MODE,
+    str(COMPANY_SEARCH_ENABLED),
+    str(AI_BODY_TRIM_ENABLED),
+    str(AI_BODY_TOKEN_BUDGET),
+]).encode("utf-8")).hexdigest()
+
+
+def _analysis_cache_key(subject: str, body: str, sender: str) -> str:
+    material = json.dumps(
+        [(sender or "").strip().lower(), (subject or "").strip(), " ".join((body or "").split()), _ANALYSIS_PIPELINE_VERSION],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _email_prompt(
+    subject: str,
+    body: str,
+    sender: str,
+    company_candidate: str | None,
+    website_candidate: str | None,
+) -> str:
+    return (
+        f"Sender email: {sender}\n"
+        f"Sender domain company candidate (may be null): {company_candidate}\n"
+        f"Website URL found in body (may be null): {website_candidate}\n"
+        f"Subject: {subject}\n\n"
+        "Body:\n" + body
     )
 
+
+def _build_base_messages(subject: str, body: str, sender: str) -> tuple[list[dict[str, str]], str | None, str | None]:
+    """Step 1 prompt plus the sender-domain company and body website candidates."""
     company_candidate = _company_candidate_from_sender_email(sender)
     website_candidate = _website_candidate_from_body(body)
-    company_for_search: str | None = None
-    company_insights_struct: list[dict[str, str]] = []
 
     if AI_DEBUG:
         # Avoid logging full PII content (body, full sender). Keep only high-level signal.
@@ -575,87 +1089,198 @@ def analyze_email(subject: str, body: str, sender: str) -> Dict[str, Any]:
 
     user_prompt = (
         "Extract data from the following email.\n\n"
-        f"Sender email: {sender}\n"
-        f"Sender domain company candidate (may be null): {company_candidate}\n"
-        f"Website URL found in body (may be null): {website_candidate}\n"
-        f"Subject: {subject}\n\n"
-        "Body:\n" + body
+        + _email_prompt(subject, body, sender, company_candidate, website_candidate)
     )
 
-    # Step 1: Always do deterministic extraction to JSON first.
-    base_messages = [
-        {"role": "system", "content": system_prompt},
+    messages = [
+        {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
+    return messages, company_candidate, website_candidate
 
-    base_response = client.chat.completions.create(
-        model=AI_MODEL,
-        messages=base_messages,
-        response_format={"type": "json_object"},
-    )
 
-    base_content = base_response.choices[0].message.content
+def _parse_json_completion(completion: Any) -> dict[str, Any]:
+    content = completion.choices[0].message.content
     try:
-        base_data = json.loads(base_content)
+        return json.loads(content)
     except json.JSONDecodeError:
-        base_data = {}
+        return {}
 
-    # Step 2: Always enrich ("search always") if enabled.
+
+def _run_enrichment(
+    base_data: dict[str, Any],
+    company_candidate: str | None,
+    website_candidate: str | None,
+) -> tuple[str, list[dict[str, str]], list[dict[str, str]], bool]:
+    """Step 2: website/company/person lookups, run concurrently.
+
+    Each lookup gets ENRICHMENT_DEADLINE_SECONDS from when it starts running
+    (not from when it was queued); the ones still running at their deadline
+    are left out.
+
+    Returns (enrichment context for the final prompt, person insights, company
+    insights, whether every lookup finished without a timeout or error).
+    """
     enrichment_parts: list[str] = []
     person_enrichment: list[dict[str, str]] = []
-    if COMPANY_SEARCH_ENABLED:
-        company_for_search = base_data.get("company") or company_candidate
-        website_for_fetch = _normalize_website(base_data.get("website") or website_candidate)
-
-        if website_for_fetch:
-            enrichment_parts.append("[WEBSITE]\n" + fetch_website_tool(website_for_fetch))
-
-        if company_for_search and len(enrichment_parts) < max(COMPANY_SEARCH_MAX_TOOL_CALLS, 0):
-            enrichment_parts.append("[DDG_SEARCH]\n" + search_company_tool(company_for_search))
-            company_insights_struct = _company_search_struct_cache.get(company_for_search, [])
-
-        person_name = base_data.get("full_name") or base_data.get("first_name")
-        if person_name:
-            person_enrichment = search_person_insights(person_name, company_for_search)
-            if person_enrichment:
-                formatted = "\n".join(
-                    f"{idx}. {item.get('title', 'Без заголовку')}\n   {item.get('snippet', '')}\n   {item.get('url', '')}"
-                    for idx, item in enumerate(person_enrichment, start=1)
-                )
-                enrichment_parts.append("[PERSON_SEARCH]\n" + formatted)
+    company_insights_struct: list[dict[str, str]] = []
+
+    if not COMPANY_SEARCH_ENABLED:
+        return "", person_enrichment, company_insights_struct, True
+
+    company_for_search = base_data.get("company") or company_candidate
+    website_for_fetch = _normalize_website(base_data.get("website") or website_candidate)
+    person_name = base_data.get("full_name") or base_data.get("first_name")
+
+    timed_tasks = {}
+    if website_for_fetch:
+        timed_tasks["website"] = _submit_timed(_enrichment_executor, fetch_website_tool, website_for_fetch)
+
+    if company_for_search and len(timed_tasks) < max(COMPANY_SEARCH_MAX_TOOL_CALLS, 0):
+        timed_tasks["company"] = _submit_timed(_enrichment_executor, search_company_tool, company_for_search)
+
+    if person_name:
+        timed_tasks["person"] = _submit_timed(
+            _enrichment_executor, search_person_insights, person_name, company_for_search
+        )
+
+    done, pending = _wait_from_start(timed_tasks, ENRICHMENT_DEADLINE_SECONDS)
+    complete = not pending
+
+    def _finished(key: str):
+        nonlocal complete
+        fut = timed_tasks[key][0] if key in timed_tasks else None
+        if fut is None or fut not in done:
+            if fut is not None and AI_DEBUG:
+                print(f"[AI] enrichment {key} missed the deadline")
+            return None
+        if fut.exception() is not None:
+            complete = False
+            if AI_DEBUG:
+                print(f"[AI] enrichment {key} failed: {fut.exception()}")
+            return None
+        result = fut.result()
+        if isinstance(result, str) and _is_failed_result(result):
+            complete = False
+        return result
+
+    # Empty-result and error sentinels stay out of the context, so "nothing
+    # to enrich with" leaves it empty and the final completion is skipped.
+    website_info = _finished("website")
+    if _has_payload(website_info):
+        enrichment_parts.append("[WEBSITE]\n" + website_info)
+
+    company_info = _finished("company")
+    if _has_payload(company_info):
+        enrichment_parts.append("[DDG_SEARCH]\n" + company_info)
+        company_insights_struct = _company_search_results(company_for_search)
+
+    if person_name:
+        person_enrichment = _finished("person") or []
+        if person_enrichment:
+            formatted = "\n".join(
+                f"{idx}. {item.get('title', 'Без заголовку')}\n   {item.get('snippet', '')}\n   {item.get('url', '')}"
+                for idx, item in enumerate(person_enrichment, start=1)
+            )
+            enrichment_parts.append("[PERSON_SEARCH]\n" + formatted)
 
     enrichment_context = "\n\n".join(enrichment_parts) if enrichment_parts else ""
+    return enrichment_context, person_enrichment, company_insights_struct, complete
 
-    # Step 3: Final JSON generation using extracted + enriched context.
-    final_system_prompt = (
-        system_prompt
-        + " Use the enrichment context (if provided) to populate company_summary and website accurately."
-        + " If person search results are provided, populate role, experience level, social links when possible."
-    )
 
-    final_user_prompt = (
+def _analysis_quality(base_data: Any, data: Any, enrichment_complete: bool) -> str:
+    # _parse_json_completion returns {} for output that is not JSON.
+    if not isinstance(base_data, dict) or not base_data or not isinstance(data, dict) or not data:
+        return "unparsed"
+    return "complete" if enrichment_complete else "incomplete"
+
+
+def _cache_analysis(cache_key: str, result: Dict[str, Any], quality: str) -> None:
+    """Store a finished analysis; unparsed ones are skipped, incomplete ones get the short TTL."""
+    if not ANALYSIS_CACHE_ENABLED or quality == "unparsed":
+        return
+    _analysis_cache.set(cache_key, result, negative=quality == "incomplete")
+
+
+def _final_prompt(base_data: dict[str, Any], enrichment_context: str) -> str:
+    return (
         "Here is the extracted JSON (may contain nulls):\n"
         + json.dumps(base_data, ensure_ascii=False)
         + "\n\nEnrichment context (may be empty):\n"
         + (enrichment_context or "<empty>")
-        + "\n\nNow output only the final JSON object with the required keys."
     )
 
-    final_response = client.chat.completions.create(
-        model=AI_MODEL,
-        messages=[
-            {"role": "system", "content": final_system_prompt},
-            {"role": "user", "content": final_user_prompt},
-        ],
-        response_format={"type": "json_object"},
+
+def _build_final_messages(base_data: dict[str, Any], enrichment_context: str) -> list[dict[str, str]]:
+    final_user_prompt = (
+        _final_prompt(base_data, enrichment_context)
+        + "\n\nNow output only the final JSON object with the required keys."
     )
 
-    final_content = final_response.choices[0].message.content
-    try:
-        data = json.loads(final_content)
-    except json.JSONDecodeError:
-        data = {}
+    return [
+        {"role": "system", "content": _FINAL_SYSTEM_PROMPT},
+        {"role": "user", "content": final_user_prompt},
+    ]
+
+
+def _choose_final_path(enrichment_context: str) -> str:
+    if AI_FINAL_PASS_MODE == "always":
+        path = "final_llm"
+    elif not enrichment_context:
+        path = "fast"
+    elif AI_FINAL_PASS_MODE == "merge":
+        path = "merged"
+    else:
+        path = "final_llm"
+
+    with _analysis_path_lock:
+        _analysis_path_counts[path] += 1
+    return path
+
+
+def get_analysis_path_stats() -> dict[str, int]:
+    with _analysis_path_lock:
+        return dict(_analysis_path_counts)
+
+
+_PROFILE_HOSTS = ("linkedin.com", "github.com", "x.com", "twitter.com", "facebook.com")
+
+
+def _merge_enrichment(
+    base_data: dict[str, Any],
+    website_candidate: str | None,
+    person_enrichment: list[dict[str, str]],
+    company_insights_struct: list[dict[str, str]],
+) -> dict[str, Any]:
+    """Fill the Step-1 JSON from enrichment results without another completion."""
+    data = dict(base_data)
+    data["website"] = _normalize_website(data.get("website") or website_candidate)
+
+    if not data.get("company_summary"):
+        data["company_summary"] = next(
+            (item.get("snippet") for item in company_insights_struct if item.get("snippet")), None
+        )
 
+    person_links = data.get("person_links") or []
+    if isinstance(person_links, str):
+        person_links = [person_links]
+    if isinstance(person_links, list):
+        for item in person_enrichment:
+            url = item.get("url") or ""
+            host = (urlparse(url).hostname or "").lower()
+            if any(host == h or host.endswith("." + h) for h in _PROFILE_HOSTS) and url not in person_links:
+                person_links = [*person_links, url]
+        data["person_links"] = person_links
+
+    return data
+
+
+def _build_analysis_result(
+    data: dict[str, Any],
+    sender: str,
+    person_enrichment: list[dict[str, str]],
+    company_insights_struct: list[dict[str, str]],
+) -> Dict[str, Any]:
     person_links = data.get("person_links") or []
     if isinstance(person_links, str):
         person_links = [person_links]
@@ -681,7 +1306,7 @@ def analyze_email(subject: str, body: str, sender: str) -> Dict[str, Any]:
                 summary_parts.append(first_snippet)
         person_summary = " | ".join(summary_parts) if summary_parts else None
 
-    result = {
+    return {
         "email": data.get("email") or sender,
         "first_name": data.get("first_name"),
         "last_name": data.get("last_name"),
@@ -703,4 +1328,279 @@ def analyze_email(subject: str, body: str, sender: str) -> Dict[str, Any]:
         "person_summary": person_summary,
     }
 
+
+def _final_data_without_completion(
+    path: str,
+    base_data: dict[str, Any],
+    website_candidate: str | None,
+    person_enrichment: list[dict[str, str]],
+    company_insights_struct: list[dict[str, str]],
+) -> dict[str, Any] | None:
+    """Step 3 for the "merged" and "fast" paths; None when it needs the final completion."""
+    if path == "merged":
+        return _merge_enrichment(base_data, website_candidate, person_enrichment, company_insights_struct)
+    if path == "fast":
+        return base_data
+    return None
+
+
+def _finish_analysis(
+    base_data: dict[str, Any],
+    data: dict[str, Any],
+    sender: str,
+    enrichment: tuple[str, list[dict[str, str]], list[dict[str, str]], bool],
+) -> tuple[Dict[str, Any], str]:
+    """(analysis result, _analysis_quality) from the Step-1 and final JSON."""
+    _, person_enrichment, company_insights_struct, enrichment_complete = enrichment
+    return (
+        _build_analysis_result(data, sender, person_enrichment, company_insights_struct),
+        _analysis_quality(base_data, data, enrichment_complete),
+    )
+
+
+# Steps _analysis_pipeline asks its driver to perform.
+_COMPLETE_STEP = "complete"
+_CALL_STEP = "call"
+
+
+def _analysis_pipeline(subject: str, body: str, sender: str, use_cache: bool):
+    """The analyze_email pipeline, shared by the sync and async APIs.
+
+    A generator that does no I/O itself: it yields (_COMPLETE_STEP, messages)
+    for a JSON-mode completion and (_CALL_STEP, (fn, args)) for a blocking
+    call, is sent back the parsed JSON or the call's return value, and
+    returns the analysis result.
+    """
+    cache_key = _analysis_cache_key(subject, body, sender)
+    if use_cache and ANALYSIS_CACHE_ENABLED:
+        cached = yield _CALL_STEP, (_analysis_cache.get, (cache_key,))
+        if cached is not None:
+            return cached
+
+    base_messages, company_candidate, website_candidate = _build_base_messages(subject, _prepare_body(body), sender)
+
+    # Step 1: Always do deterministic extraction to JSON first.
+    base_data = yield _COMPLETE_STEP, base_messages
+
+    # Step 2: Always enrich ("search always") if enabled.
+    enrichment = yield _CALL_STEP, (_run_enrichment, (base_data, company_candidate, website_candidate))
+    enrichment_context, person_enrichment, company_insights_struct, _ = enrichment
+
+    # Step 3: Final JSON generation using extracted + enriched context, skipped
+    # when there is no context or enrichment is merged in Python.
+    path = _choose_final_path(enrichment_context)
+    data = _final_data_without_completion(
+        path, base_data, website_candidate, person_enrichment, company_insights_struct
+    )
+    if data is None:
+        data = yield _COMPLETE_STEP, _build_final_messages(base_data, enrichment_context)
+
+    result, quality = _finish_analysis(base_data, data, sender, enrichment)
+    yield _CALL_STEP, (_cache_analysis, (cache_key, result, quality))
     return result
+
+
+def analyze_email(subject: str, body: str, sender: str, *, use_cache: bool = True) -> Dict[str, Any]:
+    """Call OpenAI to extract structured fields from an email.
+
+    Results are cached by email content; `use_cache=False` skips the lookup
+    and replaces the cached result with a fresh one.
+
+    Expected JSON schema in the response:
+    {
+        "email": string | null,
+        "first_name": string | null,
+        "last_name": string | null,
+        "full_name": string | null,
+        "company": string | null,
+        "order_number": string | null,
+        "order_description": string | null,
+        
+    }
+    """
+    pipeline = _analysis_pipeline(subject, body, sender, use_cache)
+    reply = None
+    try:
+        while True:
+            step, payload = pipeline.send(reply)
+            if step == _COMPLETE_STEP:
+                reply = _parse_json_completion(client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=payload,
+                    response_format={"type": "json_object"},
+                ))
+            else:
+                fn, args = payload
+                reply = fn(*args)
+    except StopIteration as finished:
+        return finished.value
+
+
+async def analyze_email_async(subject: str, body: str, sender: str, *, use_cache: bool = True) -> Dict[str, Any]:
+    """Async variant of analyze_email built on AsyncOpenAI.
+
+    The blocking enrichment lookups and cache reads run in a worker thread so
+    the event loop stays free while they wait.
+    """
+    pipeline = _analysis_pipeline(subject, body, sender, use_cache)
+    reply = None
+    try:
+        while True:
+            step, payload = pipeline.send(reply)
+            if step == _COMPLETE_STEP:
+                reply = _parse_json_completion(await async_client.chat.completions.create(
+                    model=AI_MODEL,
+                    messages=payload,
+                    response_format={"type": "json_object"},
+                ))
+            else:
+                fn, args = payload
+                reply = await asyncio.to_thread(fn, *args)
+    except StopIteration as finished:
+        return finished.value
+
+
+def _complete_batch(system_prompt: str, instruction: str, sections: dict[str, str]) -> dict[str, dict[str, Any]]:
+    """One JSON-mode completion over several emails; returns the per-id objects that came back intact."""
+    user_prompt = "\n\n".join(
+        [instruction, *(f"EMAIL {email_id}\n{section}" for email_id, section in sections.items())]
+    )
+
+    try:
+        data = _parse_json_completion(client.chat.completions.create(
+            model=AI_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            response_format={"type": "json_object"},
+        ))
+    except Exception as exc:
+        print(f"[AI] batch completion failed, retrying emails one by one: {exc}")
+        return {}
+
+    # Tolerate the mapping being wrapped, e.g. {"results": {...}}.
+    if isinstance(data, dict) and len(data) == 1 and not set(data) & set(sections):
+        nested = next(iter(data.values()))
+        if isinstance(nested, dict):
+            data = nested
+    if not isinstance(data, dict):
+        return {}
+
+    return {email_id: data[email_id] for email_id in sections if isinstance(data.get(email_id), dict)}
+
+
+def _complete_single(email_id: str, messages: list[dict[str, str]]) -> dict[str, Any] | None:
+    try:
+        return _parse_json_completion(client.chat.completions.create(
+            model=AI_MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+        ))
+    except Exception as exc:
+        print(f"[AI] analysis failed for email {email_id}: {exc}")
+        return None
+
+
+def _analyze_email_chunk(emails: list[dict[str, str]]) -> dict[str, tuple[Dict[str, Any], str]]:
+    """{email id: (analysis, _analysis_quality)} for the emails that could be analyzed."""
+    prepared = {}
+    for email in emails:
+        email = {**email, "body": _prepare_body(email["body"])}
+        base_messages, company_candidate, website_candidate = _build_base_messages(
+            email["subject"], email["body"], email["sender"]
+        )
+        prepared[email["id"]] = (email, base_messages, company_candidate, website_candidate)
+
+    # Step 1: one extraction request for the whole chunk.
+    base = _complete_batch(
+        _BATCH_ANALYSIS_SYSTEM_PROMPT,
+        "Extract data from each of the following emails.",
+        {
+            email_id: _email_prompt(email["subject"], email["body"], email["sender"], company, website)
+            for email_id, (email, _, company, website) in prepared.items()
+        },
+    )
+    for email_id, (_, base_messages, _, _) in prepared.items():
+        if email_id not in base:
+            single = _complete_single(email_id, base_messages)
+            if single is not None:
+                base[email_id] = single
+
+    # Step 2: enrichment for every email concurrently.
+    enrichment_futures = {
+        email_id: _batch_executor.submit(_run_enrichment, base[email_id], company, website)
+        for email_id, (_, _, company, website) in prepared.items()
+        if email_id in base
+    }
+    enrichment = {}
+    for email_id, future in enrichment_futures.items():
+        try:
+            enrichment[email_id] = future.result()
+        except Exception as exc:
+            if AI_DEBUG:
+                print(f"[AI] enrichment failed for email {email_id}: {exc}")
+            enrichment[email_id] = ("", [], [], False)
+
+    # Step 3: one final request for the emails that still need it.
+    paths = {email_id: _choose_final_path(context) for email_id, (context, *_) in enrichment.items()}
+    final_sections = {
+        email_id: _final_prompt(base[email_id], context)
+        for email_id, (context, *_) in enrichment.items()
+        if paths[email_id] == "final_llm"
+    }
+    final = _complete_batch(
+        _BATCH_FINAL_SYSTEM_PROMPT,
+        "For each of the following emails, produce the final JSON object with the required keys.",
+        final_sections,
+    ) if final_sections else {}
+
+    results: dict[str, tuple[Dict[str, Any], str]] = {}
+    for email_id, email_enrichment in enrichment.items():
+        context, person_enrichment, company_insights_struct, _ = email_enrichment
+        email, _, _, website_candidate = prepared[email_id]
+        data = _final_data_without_completion(
+            paths[email_id], base[email_id], website_candidate, person_enrichment, company_insights_struct
+        )
+        if data is None:
+            data = final.get(email_id)
+        if data is None:
+            data = _complete_single(email_id, _build_final_messages(base[email_id], context))
+            if data is None:
+                continue
+        results[email_id] = _finish_analysis(base[email_id], data, email["sender"], email_enrichment)
+
+    return results
+
+
+def analyze_emails_batch(emails: list[dict[str, str]], *, use_cache: bool = True) -> dict[str, Dict[str, Any]]:
+    """analyze_email for many emails, with at most two completions per AI_BATCH_MAX_EMAILS emails.
+
+    Each email is {"id", "subject", "body", "sender"}. Both the extraction and
+    the final step pack the chunk into one JSON-mode request keyed by id; an
+    email whose part is missing or malformed is retried on its own with the
+    single-email prompt. Emails that still fail are left out of the result.
+    Cached results are reused the same way as in analyze_email.
+    """
+    results: dict[str, Dict[str, Any]] = {}
+    cache_keys = {
+        email["id"]: _analysis_cache_key(email["subject"], email["body"], email["sender"])
+        for email in emails
+    }
+
+    pending = emails
+    if use_cache and ANALYSIS_CACHE_ENABLED:
+        pending = []
+        for email in emails:
+            cached = _analysis_cache.get(cache_keys[email["id"]])
+            if cached is not None:
+                results[email["id"]] = cached
+            else:
+                pending.append(email)
+
+    for start in range(0, len(pending), AI_BATCH_MAX_EMAILS):
+        for email_id, (result, quality) in _analyze_email_chunk(pending[start:start + AI_BATCH_MAX_EMAILS]).items():
+            _cache_analysis(cache_keys[email_id], result, quality)
+            results[email_id] = result
+
+    return results
@@ -1,12 +1,61 @@
 import asyncio
-from service.syncService import sync_gmail_to_sheets
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from service.syncService import SyncInProgressError, claim_sync, release_sync, run_claimed_sync
+
+AUTO_SYNC_INTERVAL_SECONDS = float(os.getenv("AUTO_SYNC_INTERVAL_SECONDS", "60"))
+AUTO_SYNC_MIN_INTERVAL_SECONDS = float(os.getenv("AUTO_SYNC_MIN_INTERVAL_SECONDS", "15"))
+AUTO_SYNC_MAX_INTERVAL_SECONDS = float(os.getenv("AUTO_SYNC_MAX_INTERVAL_SECONDS", "300"))
+# Fraction of the interval added/removed at random so instances don't sync in lockstep.
+AUTO_SYNC_JITTER = float(os.getenv("AUTO_SYNC_JITTER", "0.1"))
+
+# Syncs are fully blocking (Gmail, OpenAI, DDG, Sheets), so they run on a
+# dedicated thread instead of the event loop or FastAPI's shared threadpool.
+_sync_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gmail-sync-loop")
+
+
+async def run_sync(limit: int | None = None) -> int:
+    """Run sync_gmail_to_sheets off the event loop.
+
+    Raises SyncInProgressError right away if a sync is already running. The
+    claim is taken here, before queueing, so concurrent callers cannot both
+    get in; the worker releases it when the sync ends.
+    """
+    loop = asyncio.get_running_loop()
+    claim_sync()
+    try:
+        future = loop.run_in_executor(_sync_executor, run_claimed_sync, limit)
+    except BaseException:
+        release_sync()
+        raise
+    return await future
+
+
+def next_sync_interval(current: float, saved: int) -> float:
+    """Speed up while new mail keeps arriving, back off while the inbox is idle."""
+    if saved > 0:
+        return max(AUTO_SYNC_MIN_INTERVAL_SECONDS, current / 2)
+    return min(AUTO_SYNC_MAX_INTERVAL_SECONDS, current * 1.5)
+
+
+def _with_jitter(interval: float) -> float:
+    return interval * random.uniform(1 - AUTO_SYNC_JITTER, 1 + AUTO_SYNC_JITTER)
+
 
 async def auto_sync_loop():
+    interval = AUTO_SYNC_INTERVAL_SECONDS
+
     while True:
         try:
-            count = sync_gmail_to_sheets()
+            count = await run_sync()
             print(f"[AUTO SYNC] saved {count} new emails")
+            interval = next_sync_interval(interval, count)
+        except SyncInProgressError:
+            print("[AUTO SYNC] skipped, another sync is running")
         except Exception as e:
             print(f"[AUTO SYNC ERROR] {e}")
+            interval = next_sync_interval(interval, 0)
 
-        await asyncio.sleep(60)
+        await asyncio.sleep(_with_jitter(interval))
@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+
+from db import conn, db_lock
+
+CACHE_MEMORY_MAX_ENTRIES = int(os.getenv("CACHE_MEMORY_MAX_ENTRIES", "1024"))
+CACHE_DB_MAX_ENTRIES = int(os.getenv("CACHE_DB_MAX_ENTRIES", "20000"))
+# Expired rows and overflow are purged from DuckDB once per this many writes.
+CACHE_PRUNE_EVERY_WRITES = 100
+
+_registry: dict[str, "PersistentTTLCache"] = {}
+
+
+class PersistentTTLCache:
+    """TTL cache stored in the DuckDB `cache_entries` table with an in-memory LRU front.
+
+    Values must be JSON-serializable. Entries written with `negative=True`
+    (errors, timeouts) expire after `negative_ttl_seconds` instead of
+    `ttl_seconds`. `get` returns None on a miss, so None itself is never cached.
+    The LRU keeps the serialized JSON, so every hit returns a fresh copy that
+    callers may mutate.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        ttl_seconds: float,
+        negative_ttl_seconds: float,
+        memory_max_entries: int = CACHE_MEMORY_MAX_ENTRIES,
+        db_max_entries: int = CACHE_DB_MAX_ENTRIES,
+    ):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.memory_max_entries = memory_max_entries
+        self.db_max_entries = db_max_entries
+
+        # key -> (JSON text, is_negative, expires_at)
+        self._memory: OrderedDict[str, tuple[str, bool, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self._stats = {
+            "hits": 0,
+            "db_hits": 0,
+            "misses": 0,
+            "negative_hits": 0,
+            "expired": 0,
+            "evictions": 0,
+            "writes": 0,
+        }
+
+        _registry[namespace] = self
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                text, is_negative, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["hits"] += 1
+                    if is_negative:
+                        self._stats["negative_hits"] += 1
+                    return json.loads(text)
+                del self._memory[key]
+                self._stats["expired"] += 1
+
+        with db_lock:
+            row = conn.execute(
+                "SELECT value, is_negative, expires_at FROM cache_entries WHERE namespace = ? AND key = ?",
+                [self.namespace, key]
+            ).fetchone()
+
+        if row is None or row[2] <= now:
+            with self._lock:
+                self._stats["misses"] += 1
+                if row is not None:
+                    self._stats["expired"] += 1
+            return None
+
+        with self._lock:
+            self._stats["db_hits"] += 1
+            if row[1]:
+                self._stats["negative_hits"] += 1
+            self._remember(key, row[0], bool(row[1]), row[2])
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, *, negative: bool = False) -> None:
+        if value is None:
+            return
+
+        ttl = self.negative_ttl_seconds if negative else self.ttl_seconds
+        expires_at = time.time() + ttl
+        text = json.dumps(value, ensure_ascii=False)
+
+        with db_lock:
+            conn.execute(
+                """
+                INSERT INTO cache_entries (namespace, key, value, is_negative, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (namespace, key) DO UPDATE SET
+                    value = excluded.value,
+                    is_negative = excluded.is_negative,
+                    expires_at = excluded.expires_at,
+                    created_at = now()
+                """,
+                [self.namespace, key, text, negative, expires_at]
+            )
+
+        with self._lock:
+            self._stats["writes"] += 1
+            self._remember(key, text, negative, expires_at)
+            self._writes_since_prune += 1
+            should_prune = self._writes_since_prune >= CACHE_PRUNE_EVERY_WRITES
+            if should_prune:
+                self._writes_since_prune = 0
+
+        if should_prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """Drop expired rows and keep at most `db_max_entries` newest rows in DuckDB."""
+        with db_lock:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+                [self.namespace, time.time()]
+            )
+            conn.execute(
+                """
+                DELETE FROM cache_entries
+                WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache_entries
+                    WHERE namespace = ?
+                    ORDER BY created_at DESC
+                    OFFSET ?
+                )
+                """,
+                [self.namespace, self.namespace, self.db_max_entries]
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        with db_lock:
+            conn.execute("DELETE FROM cache_entries WHERE namespace = ?", [self.namespace])
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {**self._stats, "memory_entries": len(self._memory)}
+
+    def _remember(self, key: str, text: str, is_negative: bool, expires_at: float) -> None:
+        # Caller holds self._lock.
+        self._memory[key] = (text, is_negative, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {namespace: cache.stats() for namespace, cache in _registry.items()}
@@ -1,17 +1,63 @@
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
-from pathlib import Path
+from googleapiclient.errors import HttpError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+from email.utils import parsedate_to_datetime
 import base64
 import json
-
-from db import conn
-from service.aiService import analyze_email
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-CREDENTIALS_DIR = BASE_DIR / "credentials"
-TOKEN_FILE = CREDENTIALS_DIR / "token.json"
-
-SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
+import os
+import random
+import threading
+import time
+
+from db import MESSAGE_JSON_SCHEMAS, conn, db_lock, select_message_columns
+from service.aiService import AI_BATCH_MAX_EMAILS, analyze_email, analyze_emails_batch
+from service.googleClientService import get_google_service
+from service.leadStatsService import lead_days_for_messages, refresh_lead_stats_days
+
+# Number of messages fetched/enriched concurrently during a sync.
+GMAIL_SYNC_WORKERS = max(1, int(os.getenv("GMAIL_SYNC_WORKERS", "4")))
+
+# "batch" groups message gets into Gmail batch HTTP requests, "single" issues
+# one messages().get per message from the worker threads.
+GMAIL_FETCH_MODE = os.getenv("GMAIL_FETCH_MODE", "batch").strip().lower()
+# Gmail accepts at most 100 calls per batch request, but batches above 50
+# trip per-user rate limiting (429s on sub-requests).
+GMAIL_BATCH_SIZE = min(100, max(1, int(os.getenv("GMAIL_BATCH_SIZE", "50"))))
+# Sub-requests that fail with 429/5xx are re-batched this many times, waiting
+# GMAIL_BATCH_RETRY_BASE_SECONDS * 2**attempt (plus jitter) before each.
+GMAIL_BATCH_MAX_RETRIES = max(0, int(os.getenv("GMAIL_BATCH_MAX_RETRIES", "3")))
+GMAIL_BATCH_RETRY_BASE_SECONDS = float(os.getenv("GMAIL_BATCH_RETRY_BASE_SECONDS", "1"))
+
+# "history" lists only messages added since the last stored historyId,
+# "full" always pages through the INBOX listing.
+GMAIL_SYNC_MODE = os.getenv("GMAIL_SYNC_MODE", "history").strip().lower()
+# Upper bound on pages walked by a full scan (page size is the `limit` argument).
+GMAIL_FULL_SCAN_MAX_PAGES = max(1, int(os.getenv("GMAIL_FULL_SCAN_MAX_PAGES", "10")))
+# Syncs a failing message is tried in before it is dropped from the retry list.
+GMAIL_RETRY_MAX_ATTEMPTS = max(1, int(os.getenv("GMAIL_RETRY_MAX_ATTEMPTS", "5")))
+
+# "single" runs analyze_email per message, "batch" sends groups of up to
+# AI_BATCH_MAX_EMAILS messages through analyze_emails_batch (fewer LLM calls).
+GMAIL_ANALYSIS_MODE = os.getenv("GMAIL_ANALYSIS_MODE", "single").strip().lower()
+
+# Keep processed message IDs in memory so most "already seen" checks skip DuckDB.
+PROCESSED_ID_CACHE_ENABLED = os.getenv("PROCESSED_ID_CACHE_ENABLED", "true").strip().lower() in {
+    "1",
+    "true",
+    "yes",
+    "y",
+    "on",
+}
+
+# Per-row upserts leave their lead_stats_daily days stale until
+# refresh_pending_lead_stats(): the days the messages counted towards before
+# the upsert, and the ids whose current day is looked up at refresh time.
+# Guarded by db_lock.
+_pending_stats_days: set = set()
+_pending_stats_ids: set[str] = set()
+
+_HISTORY_ID_KEY = "gmail_history_id"
+_RETRY_IDS_KEY = "gmail_retry_ids"
 
 _MESSAGE_VALUE_COLUMNS = [
     "status",
@@ -36,34 +82,248 @@ _MESSAGE_VALUE_COLUMNS = [
     "company_insights",
 ]
 
+# Built once at import. The whole batch is bound as a single JSON array
+# parameter: binding one value is far cheaper in DuckDB than binding
+# columns x rows individual placeholders.
+_MESSAGE_COLUMNS_SQL = ", ".join(_MESSAGE_VALUE_COLUMNS)
+# Non-text columns; json_transform parses them (JSON columns are shaped by
+# their schema) and yields NULL on bad input.
+_MESSAGE_COLUMN_TYPES = {"received_at": '"TIMESTAMPTZ"', **MESSAGE_JSON_SCHEMAS}
+_TEXT_COLUMN_TYPE = '"VARCHAR"'
+_MESSAGE_ROW_STRUCT = "{" + ", ".join(
+    f'"{col}": {_MESSAGE_COLUMN_TYPES.get(col, _TEXT_COLUMN_TYPE)}'
+    for col in ["gmail_id", *_MESSAGE_VALUE_COLUMNS]
+) + "}"
+_MESSAGE_ASSIGNMENTS_SQL = ", ".join(f"{col} = excluded.{col}" for col in _MESSAGE_VALUE_COLUMNS)
+
+_UPSERT_MESSAGE_SQL = f"""
+    INSERT INTO gmail_messages (gmail_id, {_MESSAGE_COLUMNS_SQL})
+    SELECT unnest(json_transform(?::JSON, '[{_MESSAGE_ROW_STRUCT}]'), recursive := true)
+    ON CONFLICT (gmail_id) DO UPDATE SET {_MESSAGE_ASSIGNMENTS_SQL}
+"""
+
 
 def get_gmail_service():
-    if not TOKEN_FILE.exists():
-        raise FileNotFoundError(
-            f"token.json not found at {TOKEN_FILE}. "
-            "Authorize Gmail first."
-        )
+    """Gmail client for the current thread (see service/googleClientService.py)."""
+    return get_google_service("gmail", "v1")
 
-    creds = Credentials.from_authorized_user_file(
-        TOKEN_FILE,
-        SCOPES
-    )
-    return build("gmail", "v1", credentials=creds)
+
+# Only ever holds IDs known to be in processed_emails, so a hit is
+# authoritative and a miss falls through to DuckDB.
+_processed_ids: set[str] = set()
+_processed_ids_lock = threading.Lock()
+
+
+def warm_processed_ids_cache() -> int:
+    """Load every processed message ID into memory. Called once at startup."""
+    if not PROCESSED_ID_CACHE_ENABLED:
+        return 0
+
+    with db_lock:
+        rows = conn.execute("SELECT gmail_id FROM processed_emails").fetchall()
+    with _processed_ids_lock:
+        _processed_ids.update(row[0] for row in rows)
+        return len(_processed_ids)
+
+
+def _remember_processed(msg_ids) -> None:
+    if PROCESSED_ID_CACHE_ENABLED:
+        with _processed_ids_lock:
+            _processed_ids.update(msg_ids)
+
+
+def filter_unprocessed(msg_ids: list[str]) -> list[str]:
+    """Return the IDs not yet in processed_emails, preserving order, with one query."""
+    if not msg_ids:
+        return []
+
+    with _processed_ids_lock:
+        candidates = [msg_id for msg_id in dict.fromkeys(msg_ids) if msg_id not in _processed_ids]
+    if not candidates:
+        return []
+
+    placeholders = ", ".join(["?"] * len(candidates))
+    with db_lock:
+        rows = conn.execute(
+            f"SELECT gmail_id FROM processed_emails WHERE gmail_id IN ({placeholders})",
+            candidates
+        ).fetchall()
+    seen = {row[0] for row in rows}
+    _remember_processed(seen)
+
+    return [msg_id for msg_id in candidates if msg_id not in seen]
+
+
+def mark_many_as_processed(msg_ids: list[str]) -> None:
+    """Mark a batch of message IDs processed in a single INSERT."""
+    msg_ids = list(dict.fromkeys(msg_ids))
+    if not msg_ids:
+        return
+
+    values_sql = ", ".join(["(?)"] * len(msg_ids))
+    with db_lock:
+        conn.execute(
+            f"INSERT OR IGNORE INTO processed_emails (gmail_id) VALUES {values_sql}",
+            msg_ids
+        )
+    _remember_processed(msg_ids)
 
 
 def is_processed(msg_id: str) -> bool:
-    result = conn.execute(
-        "SELECT 1 FROM processed_emails WHERE gmail_id = ?",
-        [msg_id]
-    ).fetchone()
-    return result is not None
+    return not filter_unprocessed([msg_id])
 
 
 def mark_as_processed(msg_id: str):
-    conn.execute(
-        "INSERT OR IGNORE INTO processed_emails (gmail_id) VALUES (?)",
-        [msg_id]
-    )
+    mark_many_as_processed([msg_id])
+
+
+def get_sync_state(key: str) -> str | None:
+    with db_lock:
+        row = conn.execute(
+            "SELECT value FROM sync_state WHERE key = ?",
+            [key]
+        ).fetchone()
+    return row[0] if row else None
+
+
+def set_sync_state(key: str, value: str) -> None:
+    with db_lock:
+        conn.execute(
+            """
+            INSERT INTO sync_state (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = now()
+            """,
+            [key, value]
+        )
+
+
+def _current_history_id(service) -> str | None:
+    profile = service.users().getProfile(userId="me").execute()
+    history_id = profile.get("historyId")
+    return str(history_id) if history_id else None
+
+
+def _list_history_message_ids(service, start_history_id: str) -> tuple[list[str], str]:
+    """Return INBOX message IDs added since `start_history_id` and the newest historyId.
+
+    Raises HttpError 404 when the start ID is too old for Gmail to serve.
+    """
+    message_ids: list[str] = []
+    seen: set[str] = set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        response = service.users().history().list(
+            userId="me",
+            startHistoryId=start_history_id,
+            historyTypes=["messageAdded"],
+            labelId="INBOX",
+            pageToken=page_token,
+        ).execute()
+
+        for record in response.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = (added.get("message") or {}).get("id")
+                if msg_id and msg_id not in seen:
+                    seen.add(msg_id)
+                    message_ids.append(msg_id)
+
+        latest_history_id = str(response.get("historyId") or latest_history_id)
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+
+    return message_ids, latest_history_id
+
+
+def _scan_inbox_message_ids(service, page_size: int, max_pages: int) -> list[str]:
+    """Page through the INBOX listing (newest first) and return unprocessed IDs.
+
+    Stops at the first page whose messages were all processed already, since
+    everything older was seen by an earlier sync.
+    """
+    pending_ids: list[str] = []
+    page_token = None
+
+    for _ in range(max_pages):
+        response = service.users().messages().list(
+            userId="me",
+            labelIds=["INBOX"],
+            maxResults=page_size,
+            pageToken=page_token,
+        ).execute()
+
+        page_ids = [msg["id"] for msg in response.get("messages", [])]
+        new_ids = filter_unprocessed(page_ids)
+        pending_ids.extend(new_ids)
+
+        page_token = response.get("nextPageToken")
+        if not page_token or not new_ids:
+            break
+
+    return pending_ids
+
+
+def _list_pending_message_ids(service, limit: int, sync_mode: str) -> tuple[list[str], str | None]:
+    """Return (unprocessed message IDs, historyId to store after the sync)."""
+    start_history_id = get_sync_state(_HISTORY_ID_KEY) if sync_mode == "history" else None
+
+    if start_history_id:
+        try:
+            added_ids, latest_history_id = _list_history_message_ids(service, start_history_id)
+        except HttpError as exc:
+            if exc.resp.status != 404:
+                raise
+            print(f"[GMAIL SYNC] historyId {start_history_id} expired, falling back to full scan")
+        else:
+            candidates = list(dict.fromkeys([*_load_retry_attempts(), *added_ids]))
+            return filter_unprocessed(candidates), latest_history_id
+
+    # Take the history checkpoint before listing so nothing that arrives
+    # during the scan is skipped by the next incremental sync.
+    latest_history_id = _current_history_id(service) if sync_mode == "history" else None
+    pending_ids = _scan_inbox_message_ids(service, limit, GMAIL_FULL_SCAN_MAX_PAGES)
+    return pending_ids, latest_history_id
+
+
+def _load_retry_attempts() -> dict[str, int]:
+    """Return {message ID: failed attempts so far} for the IDs awaiting a retry."""
+    stored = json.loads(get_sync_state(_RETRY_IDS_KEY) or "{}")
+    # Older checkpoints stored a plain list of IDs.
+    if isinstance(stored, list):
+        return {msg_id: 1 for msg_id in stored}
+    return stored
+
+
+def _save_history_checkpoint(history_id: str | None, failed_ids: list[str]) -> None:
+    if not history_id:
+        return
+
+    # History reports each message only once, so failures are remembered
+    # and retried by the next incremental sync, up to GMAIL_RETRY_MAX_ATTEMPTS.
+    previous_attempts = _load_retry_attempts()
+    retry_attempts = {}
+    for msg_id in failed_ids:
+        attempts = previous_attempts.get(msg_id, 0) + 1
+        if attempts >= GMAIL_RETRY_MAX_ATTEMPTS:
+            print(f"[GMAIL SYNC WARNING] message {msg_id} failed {attempts} syncs in a row, giving up")
+            continue
+        retry_attempts[msg_id] = attempts
+
+    set_sync_state(_RETRY_IDS_KEY, json.dumps(retry_attempts))
+    set_sync_state(_HISTORY_ID_KEY, history_id)
+
+
+def _is_missing_message(exc: Exception) -> bool:
+    """True for a messages().get 404: the message was deleted or trashed after listing."""
+    return isinstance(exc, HttpError) and exc.resp.status == 404
+
+
+def _skip_missing_message(msg_id: str) -> None:
+    # Retrying a deleted message can never succeed, so it is marked processed.
+    print(f"[GMAIL SYNC] message {msg_id} no longer exists, skipping")
+    mark_as_processed(msg_id)
 
 
 def extract_email(from_header: str) -> str:
@@ -113,39 +373,79 @@ def _extract_body(payload: dict) -> str:
     return _decode_body(body)
 
 
-def _store_message(gmail_id: str, values: list[str]) -> None:
-    existing = conn.execute(
-        "SELECT synced_at FROM gmail_messages WHERE gmail_id = ?",
-        [gmail_id]
-    ).fetchone()
+def _message_payload(rows: list[tuple[str, list]]) -> str:
+    # ON CONFLICT cannot touch the same key twice in one statement.
+    return json.dumps(
+        [
+            dict(zip(["gmail_id", *_MESSAGE_VALUE_COLUMNS], [gmail_id, *values]))
+            for gmail_id, values in dict(rows).items()
+        ],
+        ensure_ascii=False,
+        default=str,
+    )
 
-    columns_sql = ", ".join(_MESSAGE_VALUE_COLUMNS)
-    placeholders = ", ".join(["?"] * len(_MESSAGE_VALUE_COLUMNS))
 
-    if existing is None:
-        conn.execute(
-            f"""
-            INSERT INTO gmail_messages (gmail_id, {columns_sql})
-            VALUES (?, {placeholders})
-            """,
-            [gmail_id, *values]
-        )
-    else:
-        assignments = ", ".join(f"{col} = ?" for col in _MESSAGE_VALUE_COLUMNS)
-        conn.execute(
-            f"""
-            UPDATE gmail_messages
-            SET {assignments}
-            WHERE gmail_id = ?
-            """,
-            [*values, gmail_id]
-        )
+def _store_message_batch(rows: list[tuple[str, list]]) -> None:
+    """Upsert many (gmail_id, values) rows in one transaction.
+
+    Existing rows keep their synced_at/created_at; only the value columns are
+    replaced. When a gmail_id repeats, the last row wins.
+    """
+    if not rows:
+        return
+
+    payload = _message_payload(rows)
+    gmail_ids = [gmail_id for gmail_id, _ in rows]
+
+    with db_lock:
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            # A re-upsert can move a lead to another day; refresh both.
+            stale_days = lead_days_for_messages(gmail_ids)
+            conn.execute(_UPSERT_MESSAGE_SQL, [payload])
+            refresh_lead_stats_days(stale_days | lead_days_for_messages(gmail_ids))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _store_message(gmail_id: str, values: list[str]) -> None:
+    """Upsert one message without refreshing the rollup.
+
+    Its stats days are refreshed together with the rest of the batch by
+    refresh_pending_lead_stats().
+    """
+    payload = _message_payload([(gmail_id, values)])
+    with db_lock:
+        # A re-upsert can move a lead to another day; remember the old one.
+        _pending_stats_days.update(lead_days_for_messages([gmail_id]))
+        conn.execute(_UPSERT_MESSAGE_SQL, [payload])
+        _pending_stats_ids.add(gmail_id)
+
+
+def refresh_pending_lead_stats() -> None:
+    """Refresh the lead_stats_daily days touched by _store_message since the last call, in one transaction."""
+    with db_lock:
+        if not _pending_stats_ids:
+            return
+
+        stale_days = set(_pending_stats_days)
+        gmail_ids = list(_pending_stats_ids)
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            refresh_lead_stats_days(stale_days | lead_days_for_messages(gmail_ids))
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        _pending_stats_days.clear()
+        _pending_stats_ids.clear()
 
 
 def get_unsynced_message_rows(limit: int | None = None) -> list[tuple[str, list[str]]]:
-    columns_sql = ", ".join(_MESSAGE_VALUE_COLUMNS)
     query = (
-        f"SELECT gmail_id, {columns_sql} "
+        f"SELECT gmail_id, {select_message_columns(_MESSAGE_VALUE_COLUMNS)} "
         "FROM gmail_messages "
         "WHERE synced_at IS NULL "
         "ORDER BY created_at"
@@ -154,7 +454,8 @@ def get_unsynced_message_rows(limit: int | None = None) -> list[tuple[str, list[
     if limit is not None:
         query += f" LIMIT {int(limit)}"
 
-    rows = conn.execute(query).fetchall()
+    with db_lock:
+        rows = conn.execute(query).fetchall()
 
     result: list[tuple[str, list[str]]] = []
     for row in rows:
@@ -165,19 +466,34 @@ def get_unsynced_message_rows(limit: int | None = None) -> list[tuple[str, list[
     return result
 
 
-def mark_messages_synced(gmail_ids: list[str]) -> None:
+def mark_messages_synced(gmail_ids: list[str], first_sheet_row: int | None = None) -> None:
+    """Mark messages synced; with `first_sheet_row`, also record their consecutive sheet rows."""
     if not gmail_ids:
         return
 
     placeholders = ", ".join(["?"] * len(gmail_ids))
-    conn.execute(
-        f"""
-        UPDATE gmail_messages
-        SET synced_at = CURRENT_TIMESTAMP
-        WHERE gmail_id IN ({placeholders})
-        """,
-        gmail_ids
-    )
+    with db_lock:
+        conn.execute(
+            f"""
+            UPDATE gmail_messages
+            SET synced_at = CURRENT_TIMESTAMP
+            WHERE gmail_id IN ({placeholders})
+            """,
+            gmail_ids
+        )
+
+        if first_sheet_row is not None:
+            conn.execute(
+                """
+                UPDATE gmail_messages
+                SET sheet_row = rows.sheet_row
+                FROM (
+                    SELECT unnest(?::VARCHAR[]) AS gmail_id, unnest(?::INTEGER[]) AS sheet_row
+                ) AS rows
+                WHERE gmail_messages.gmail_id = rows.gmail_id
+                """,
+                [gmail_ids, list(range(first_sheet_row, first_sheet_row + len(gmail_ids)))]
+            )
 
 
 def _normalize_cell(value):
@@ -195,103 +511,287 @@ def _normalize_text(text: str | None) -> str:
     return text.replace("\r\n", "\n").replace("\r", "\n")
 
 
-def fetch_new_gmail_data(limit: int = 20):
-    service = get_gmail_service()
-
-    messages = service.users().messages().list(
+def _message_get_request(service, msg_id: str):
+    return service.users().messages().get(
         userId="me",
-        labelIds=["INBOX"],
-        maxResults=limit
-    ).execute().get("messages", [])
+        id=msg_id,
+        format="full",
+        metadataHeaders=["From", "Subject", "Date", "To"]
+    )
 
-    rows = []
 
-    for msg in messages:
-        msg_id = msg["id"]
+def _fetch_message(msg_id: str) -> dict:
+    # get_gmail_service is cached per thread, so worker threads never share httplib2.
+    return _message_get_request(get_gmail_service(), msg_id).execute()
 
-        if is_processed(msg_id):
-            continue
 
-        data = service.users().messages().get(
-            userId="me",
-            id=msg_id,
-            format="full",
-            metadataHeaders=["From", "Subject", "Date", "To"]
-        ).execute()
+def _is_retryable_batch_error(exc: Exception) -> bool:
+    return isinstance(exc, HttpError) and (exc.resp.status == 429 or exc.resp.status >= 500)
 
-        payload = data.get("payload", {})
-        headers = {
-            h["name"]: h["value"]
-            for h in payload.get("headers", [])
-        }
-
-        from_header = headers.get("From", "")
-        sender_email = extract_email(from_header)
-        sender_name = from_header.split("<")[0].strip() if "<" in from_header else ""
-        
-        subject = headers.get("Subject", "")
-        
-        # Parse and format date
-        date_str = headers.get("Date", "")
-        formatted_date = date_str
-        try:
-            from email.utils import parsedate_to_datetime
-            if date_str:
-                dt = parsedate_to_datetime(date_str)
-                formatted_date = dt.strftime("%Y-%m-%d %H:%M:%S")
-        except Exception:
-            pass
-
-        recipient = headers.get("To", "")
-        
-        body_original = _extract_body(payload)
-        body = _normalize_text(body_original)
-
-        parsed = analyze_email(subject=subject, body=body, sender=sender_email)
-
-        # Prioritize name from signature/body if available
-        final_sender_name = parsed.get("full_name") if parsed.get("full_name") else sender_name
-        
-        # Get company info if company name is available
-        company_info = parsed.get("company_summary") or "No company info"
-        person_summary = parsed.get("person_summary")
-        first_name = parsed.get("first_name")
-        last_name = parsed.get("last_name")
-
-        person_links = parsed.get("person_links") or []
-        if not isinstance(person_links, list):
-            person_links = [person_links] if person_links else []
-        person_links_value = json.dumps(person_links, ensure_ascii=False)
-
-        person_insights_value = json.dumps(parsed.get("person_insights") or [], ensure_ascii=False)
-        company_insights_value = json.dumps(parsed.get("company_insights") or [], ensure_ascii=False)
-
-        row = [
-            "waiting",  # status
-            first_name,
-            last_name,
-            final_sender_name,
-            sender_email,
-            subject,
-            formatted_date,
-            parsed.get("company"),
-            body,
-            parsed.get("phone_number"),
-            parsed.get("website"),
-            parsed.get("company"),
-            company_info,
-            parsed.get("person_role"),
-            person_links_value,
-            parsed.get("person_location"),
-            parsed.get("person_experience"),
-            person_summary,
-            person_insights_value,
-            company_insights_value,
-        ]
-
-        rows.append(row)
+
+def _fetch_messages_batch(service, msg_ids: list[str]) -> dict[str, dict]:
+    """Fetch many messages in one Gmail batch HTTP request.
+
+    Items rejected with 429/5xx are re-batched with exponential backoff, up
+    to GMAIL_BATCH_MAX_RETRIES times. Items that still fail are left out of
+    the result; callers fall back to a single get for them.
+    """
+    fetched: dict[str, dict] = {}
+    throttled: list[str] = []
+
+    def _on_response(request_id, response, exception):
+        if exception is None:
+            fetched[request_id] = response
+        elif _is_retryable_batch_error(exception):
+            throttled.append(request_id)
+        else:
+            print(f"[GMAIL BATCH ERROR] message {request_id}: {exception}")
+
+    pending = msg_ids
+    for attempt in range(GMAIL_BATCH_MAX_RETRIES + 1):
+        if attempt:
+            time.sleep(GMAIL_BATCH_RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(1, 1.5))
+        throttled.clear()
+        batch = service.new_batch_http_request(callback=_on_response)
+        for msg_id in pending:
+            batch.add(_message_get_request(service, msg_id), request_id=msg_id)
+        batch.execute()
+
+        if not throttled:
+            break
+        pending = list(throttled)
+    else:
+        print(f"[GMAIL BATCH ERROR] {len(pending)} messages still throttled after {GMAIL_BATCH_MAX_RETRIES} retries")
+
+    return fetched
+
+
+def _parse_message(data: dict) -> dict:
+    payload = data.get("payload", {})
+    headers = {
+        h["name"]: h["value"]
+        for h in payload.get("headers", [])
+    }
+
+    from_header = headers.get("From", "")
+    sender_email = extract_email(from_header)
+    sender_name = from_header.split("<")[0].strip() if "<" in from_header else ""
+
+    subject = headers.get("Subject", "")
+
+    received_at = _parse_received_at(headers.get("Date", ""))
+
+    body_original = _extract_body(payload)
+    body = _normalize_text(body_original)
+
+    return {
+        "sender_email": sender_email,
+        "sender_name": sender_name,
+        "subject": subject,
+        "received_at": received_at,
+        "body": body,
+    }
+
+
+def _message_row(message: dict, parsed: dict) -> list:
+    sender_name = message["sender_name"]
+
+    # Prioritize name from signature/body if available
+    final_sender_name = parsed.get("full_name") if parsed.get("full_name") else sender_name
+
+    # Get company info if company name is available
+    company_info = parsed.get("company_summary") or "No company info"
+    person_summary = parsed.get("person_summary")
+    first_name = parsed.get("first_name")
+    last_name = parsed.get("last_name")
+
+    person_links = parsed.get("person_links") or []
+    if not isinstance(person_links, list):
+        person_links = [person_links] if person_links else []
+
+    # JSON columns are passed as structures and shaped by json_transform on write.
+    person_insights = parsed.get("person_insights") or []
+    company_insights = parsed.get("company_insights") or []
+
+    return [
+        "waiting",  # status
+        first_name,
+        last_name,
+        final_sender_name,
+        message["sender_email"],
+        message["subject"],
+        message["received_at"],
+        parsed.get("company"),
+        message["body"],
+        parsed.get("phone_number"),
+        parsed.get("website"),
+        parsed.get("company"),
+        company_info,
+        parsed.get("person_role"),
+        person_links,
+        parsed.get("person_location"),
+        parsed.get("person_experience"),
+        person_summary,
+        person_insights,
+        company_insights,
+    ]
+
+
+def _build_message_row(data: dict) -> list:
+    message = _parse_message(data)
+    parsed = analyze_email(subject=message["subject"], body=message["body"], sender=message["sender_email"])
+    return _message_row(message, parsed)
+
+
+def _parse_received_at(date_str: str) -> str | None:
+    """ISO 8601 timestamp with offset for a Date header, or None if it can't be parsed.
+
+    Stored into the TIMESTAMPTZ received_at column; naive dates are taken as UTC.
+    """
+    if not date_str:
+        return None
+    try:
+        dt = parsedate_to_datetime(date_str)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.isoformat()
+
+
+def _process_message(msg_id: str, data: dict | None = None) -> list:
+    """Fetch (unless prefetched), enrich and store a single message. Runs on a worker thread."""
+    if data is None:
+        data = _fetch_message(msg_id)
+    row = _build_message_row(data)
+
+    with db_lock:
         _store_message(msg_id, row)
         mark_as_processed(msg_id)
 
+    return row
+
+
+def _process_message_group(items: list[tuple[str, dict | None]]) -> dict[str, list]:
+    """Batch-analysis counterpart of _process_message. Runs on a worker thread.
+
+    Returns {msg_id: row} for the stored messages; messages that could not be
+    fetched or analyzed are missing from it and stay unprocessed.
+    """
+    messages = {}
+    for msg_id, data in items:
+        try:
+            messages[msg_id] = _parse_message(data if data is not None else _fetch_message(msg_id))
+        except Exception as exc:
+            if _is_missing_message(exc):
+                _skip_missing_message(msg_id)
+            else:
+                print(f"[GMAIL SYNC ERROR] message {msg_id}: {exc}")
+
+    analyses = analyze_emails_batch([
+        {"id": msg_id, "subject": message["subject"], "body": message["body"], "sender": message["sender_email"]}
+        for msg_id, message in messages.items()
+    ]) if messages else {}
+
+    rows = {msg_id: _message_row(messages[msg_id], parsed) for msg_id, parsed in analyses.items()}
+    with db_lock:
+        _store_message_batch(list(rows.items()))
+        mark_many_as_processed(list(rows))
+
     return rows
 
+
+# Sync pools live for the whole process so their threads, and the Google
+# service each thread has built, are reused from one sync to the next. Keyed
+# by worker count so a `workers` override gets its own pool.
+_sync_executors: dict[int, ThreadPoolExecutor] = {}
+_sync_executors_lock = threading.Lock()
+
+
+def _get_sync_executor(workers: int) -> ThreadPoolExecutor:
+    with _sync_executors_lock:
+        executor = _sync_executors.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gmail-sync")
+            _sync_executors[workers] = executor
+        return executor
+
+
+def _process_messages(items: list[tuple[str, dict | None]], batch_analysis: bool) -> dict[str, list]:
+    if batch_analysis:
+        return _process_message_group(items)
+    msg_id, data = items[0]
+    return {msg_id: _process_message(msg_id, data)}
+
+
+def fetch_new_gmail_data(
+    limit: int = 20,
+    workers: int | None = None,
+    fetch_mode: str | None = None,
+    batch_size: int | None = None,
+    sync_mode: str | None = None,
+    analysis_mode: str | None = None,
+):
+    service = get_gmail_service()
+    mode = sync_mode or GMAIL_SYNC_MODE
+
+    pending_ids, latest_history_id = _list_pending_message_ids(service, limit, mode)
+    if not pending_ids:
+        _save_history_checkpoint(latest_history_id, [])
+        return []
+
+    executor = _get_sync_executor(max(1, workers or GMAIL_SYNC_WORKERS))
+    use_batch = (fetch_mode or GMAIL_FETCH_MODE) == "batch"
+    chunk_size = min(100, max(1, batch_size or GMAIL_BATCH_SIZE))
+    batch_analysis = (analysis_mode or GMAIL_ANALYSIS_MODE) == "batch"
+    group_size = AI_BATCH_MAX_EMAILS if batch_analysis else 1
+
+    rows = []
+    failed_ids = []
+    futures = []
+    if use_batch:
+        # Batches are fetched on this thread while workers enrich the
+        # previous chunk.
+        for start in range(0, len(pending_ids), chunk_size):
+            chunk = pending_ids[start:start + chunk_size]
+            try:
+                fetched = _fetch_messages_batch(service, chunk)
+            except Exception as exc:
+                print(f"[GMAIL BATCH ERROR] {exc}")
+                fetched = {}
+
+            for group_start in range(0, len(chunk), group_size):
+                group = [(msg_id, fetched.get(msg_id)) for msg_id in chunk[group_start:group_start + group_size]]
+                futures.append((group, executor.submit(_process_messages, group, batch_analysis)))
+    else:
+        for start in range(0, len(pending_ids), group_size):
+            group = [(msg_id, None) for msg_id in pending_ids[start:start + group_size]]
+            futures.append((group, executor.submit(_process_messages, group, batch_analysis)))
+
+    # Collect in listing order; a failing message is logged and left
+    # unprocessed so the next sync retries it.
+    for group, future in futures:
+        try:
+            group_rows = future.result()
+        except Exception as exc:
+            group_rows = {}
+            if _is_missing_message(exc) and len(group) == 1:
+                _skip_missing_message(group[0][0])
+            else:
+                print(f"[GMAIL SYNC ERROR] message {', '.join(msg_id for msg_id, _ in group)}: {exc}")
+
+        for msg_id, _ in group:
+            if msg_id in group_rows:
+                rows.append(group_rows[msg_id])
+            else:
+                failed_ids.append(msg_id)
+
+    # Messages found deleted were marked processed and need no retry.
+    failed_ids = filter_unprocessed(failed_ids)
+
+    # Per-message stores leave the rollup to one refresh for the whole sync.
+    refresh_pending_lead_stats()
+
+    _save_history_checkpoint(latest_history_id, failed_ids)
+
+    return rows
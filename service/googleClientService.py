@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CREDENTIALS_DIR = BASE_DIR / "credentials"
+TOKEN_FILE = CREDENTIALS_DIR / "token.json"
+
+# token.json is created by service/auth_init.py with both scopes.
+SCOPES = [
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/spreadsheets",
+]
+
+# Refresh the access token this long before it expires, not on the first 401.
+GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+
+# One Credentials object per process, shared by every service; reloaded when
+# token.json changes on disk (e.g. after re-running auth_init.py).
+_credentials: Credentials | None = None
+_credentials_mtime: float | None = None
+_credentials_generation = 0
+_credentials_lock = threading.Lock()
+
+_discovery_documents: dict[tuple[str, str], dict] = {}
+_discovery_lock = threading.Lock()
+
+# httplib2 (used by googleapiclient) is not thread-safe, so service objects
+# are cached per thread.
+_thread_state = threading.local()
+
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.refresh_token:
+        return False
+    if not creds.token:
+        return True
+    if creds.expiry is None:
+        return False
+    # google-auth keeps expiry as naive UTC.
+    return creds.expiry - datetime.utcnow() <= timedelta(seconds=GOOGLE_TOKEN_REFRESH_MARGIN_SECONDS)
+
+
+def _load_credentials() -> tuple[Credentials, int]:
+    global _credentials, _credentials_mtime, _credentials_generation
+
+    if not TOKEN_FILE.exists():
+        raise FileNotFoundError(
+            f"token.json not found at {TOKEN_FILE}. "
+            "Run auth_init.py first."
+        )
+
+    with _credentials_lock:
+        mtime = TOKEN_FILE.stat().st_mtime
+        if _credentials is None or mtime != _credentials_mtime:
+            _credentials = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+            _credentials_mtime = mtime
+            _credentials_generation += 1
+
+        if _needs_refresh(_credentials):
+            _credentials.refresh(Request())
+            TOKEN_FILE.write_text(_credentials.to_json(), encoding="utf-8")
+            _credentials_mtime = TOKEN_FILE.stat().st_mtime
+            print("[GOOGLE] access token refreshed")
+
+        return _credentials, _credentials_generation
+
+
+def get_credentials() -> Credentials:
+    """Shared credentials from token.json, refreshed shortly before they expire."""
+    return _load_credentials()[0]
+
+
+def _discovery_document(api: str, version: str) -> dict | None:
+    key = (api, version)
+    with _discovery_lock:
+        if key not in _discovery_documents:
+            document = get_static_doc(api, version)
+            _discovery_documents[key] = json.loads(document) if document else None
+        return _discovery_documents[key]
+
+
+def get_google_service(api: str, version: str):
+    """Service object for `api`/`version`, built once per thread and credentials generation."""
+    creds, generation = _load_credentials()
+
+    if getattr(_thread_state, "generation", None) != generation:
+        _thread_state.generation = generation
+        _thread_state.services = {}
+
+    service = _thread_state.services.get((api, version))
+    if service is None:
+        document = _discovery_document(api, version)
+        if document is not None:
+            service = build_from_document(document, credentials=creds)
+        else:
+            service = build(api, version, credentials=creds, cache_discovery=False)
+        _thread_state.services[(api, version)] = service
+
+    return service
@@ -0,0 +1,230 @@
+import base64
+from datetime import datetime
+from typing import Any
+
+from db import conn, db_lock, select_message_columns
+from service.leadStatsService import LEAD_FACTS_SQL
+from service.sheetService import DEFAULT_HEADERS, normalize_lead_entry
+
+MONTH_LABELS = [
+    "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
+    "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
+]
+
+WEEK_LABELS = ["W1", "W2", "W3", "W4"]
+
+
+def _encode_cursor(created_at: datetime, gmail_id: str) -> str:
+    raw = f"{created_at.isoformat()}|{gmail_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, gmail_id = raw.split("|", 1)
+        return datetime.fromisoformat(created_at), gmail_id
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def fetch_lead_rows(limit: int | None = 120, cursor: str | None = None) -> tuple[list[dict[str, Any]], str | None]:
+    """Return (leads newest first, cursor for the next page) from gmail_messages.
+
+    Pagination is keyset-based on (created_at, gmail_id), so pages stay stable
+    while new messages are ingested.
+    """
+    query = (
+        f"SELECT gmail_id, sheet_row, created_at, {select_message_columns(DEFAULT_HEADERS, decode_json=True)} "
+        "FROM gmail_messages "
+    )
+    params: list[Any] = []
+
+    if cursor:
+        cursor_created_at, cursor_gmail_id = _decode_cursor(cursor)
+        query += "WHERE (created_at, gmail_id) < (?, ?) "
+        params.extend([cursor_created_at, cursor_gmail_id])
+
+    query += "ORDER BY created_at DESC, gmail_id DESC"
+    if limit is not None and limit > 0:
+        query += " LIMIT ?"
+        params.append(int(limit))
+
+    with db_lock:
+        rows = conn.execute(query, params).fetchall()
+
+    leads = []
+    for gmail_id, sheet_row, created_at, *values in rows:
+        entry = {key: ("" if value is None else value) for key, value in zip(DEFAULT_HEADERS, values)}
+        entry = normalize_lead_entry(entry)
+        entry["gmail_id"] = gmail_id
+        entry["sheet_row"] = sheet_row
+        leads.append(entry)
+
+    next_cursor = None
+    if limit is not None and limit > 0 and len(rows) == limit:
+        last = rows[-1]
+        next_cursor = _encode_cursor(last[2], last[0])
+
+    return leads, next_cursor
+
+
+def _generate_month_buckets(now: datetime) -> list[datetime]:
+    buckets: list[datetime] = []
+    current = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(12):
+        buckets.append(current)
+        month = current.month - 1
+        year = current.year
+        if month == 0:
+            month = 12
+            year -= 1
+        current = datetime(year, month, 1)
+    return list(reversed(buckets))
+
+
+def _series_columns_sql(total: str, qualified: str) -> str:
+    """Month and week FILTER columns; `total`/`qualified` are aggregate templates."""
+    columns = []
+    for idx in range(12):
+        condition = f"lead_month = $month_{idx}"
+        columns.append(f"{total.format(condition)} AS month_{idx}_total")
+        columns.append(f"{qualified.format(condition)} AS month_{idx}_qualified")
+    for slot in range(4):
+        condition = f"week_index = {3 - slot}"
+        columns.append(f"{total.format(condition)} AS week_{slot}_total")
+        columns.append(f"{qualified.format(condition)} AS week_{slot}_qualified")
+    return ",\n".join(columns)
+
+
+_LIVE_SERIES_COLUMNS_SQL = _series_columns_sql(
+    "count(*) FILTER (WHERE {})",
+    "count(*) FILTER (WHERE {} AND qualified)",
+)
+_ROLLUP_SERIES_COLUMNS_SQL = _series_columns_sql(
+    "COALESCE(sum(total) FILTER (WHERE {}), 0)",
+    "COALESCE(sum(qualified) FILTER (WHERE {}), 0)",
+)
+
+# One pass over gmail_messages for every dashboard series. Week index counts
+# whole days back from $now (future dates fall into the current week).
+_LEAD_STATS_SQL = f"""
+    WITH leads AS (
+        SELECT
+            lead_ts,
+            date_trunc('month', lead_ts) AS lead_month,
+            CAST(floor(greatest(epoch($now) - epoch(lead_ts), 0) / 86400) AS BIGINT) // 7 AS week_index,
+            qualified,
+            status
+        FROM ({LEAD_FACTS_SQL})
+    )
+    SELECT
+        count(*) AS total,
+        count(*) FILTER (WHERE qualified) AS qualified,
+        count(*) FILTER (WHERE status = 'waiting' AND NOT qualified) AS waiting,
+        count(*) FILTER (WHERE lead_ts >= $now - INTERVAL 30 DAY) AS active,
+        {_LIVE_SERIES_COLUMNS_SQL}
+    FROM leads
+"""
+
+# The same series summed from the lead_stats_daily rollup, so the cost is
+# bounded by the number of days rather than leads. Day granularity: "active"
+# and the week buckets count whole calendar days back from $now's date.
+_ROLLUP_STATS_SQL = f"""
+    WITH days AS (
+        SELECT
+            day,
+            total,
+            qualified,
+            waiting,
+            date_trunc('month', day) AS lead_month,
+            greatest(CAST($now AS DATE) - day, 0) // 7 AS week_index
+        FROM lead_stats_daily
+    )
+    SELECT
+        COALESCE(sum(total), 0) AS total,
+        COALESCE(sum(qualified), 0) AS qualified,
+        COALESCE(sum(waiting), 0) AS waiting,
+        COALESCE(sum(total) FILTER (WHERE day >= CAST($now - INTERVAL 30 DAY AS DATE)), 0) AS active,
+        {_ROLLUP_SERIES_COLUMNS_SQL}
+    FROM days
+"""
+
+
+def _run_stats_query(sql: str, now: datetime) -> tuple[dict[str, Any], list[datetime]]:
+    month_buckets = _generate_month_buckets(now)
+    params = {"now": now, **{f"month_{idx}": bucket for idx, bucket in enumerate(month_buckets)}}
+
+    with db_lock:
+        cursor = conn.execute(sql, params)
+        columns = [description[0] for description in cursor.description]
+        row = cursor.fetchone()
+    return dict(zip(columns, row)), month_buckets
+
+
+def _stats_payload(row: dict[str, Any], month_buckets: list[datetime]) -> dict[str, Any]:
+    total = int(row["total"])
+    qualified_total = int(row["qualified"])
+
+    line_chart = [
+        {
+            "name": MONTH_LABELS[bucket.month - 1],
+            "pv": int(row[f"month_{idx}_total"]),
+            "uv": int(row[f"month_{idx}_qualified"]),
+        }
+        for idx, bucket in enumerate(month_buckets)
+    ]
+
+    quarter_chart = line_chart[-3:] if line_chart else []
+
+    month_chart = [
+        {"name": label, "pv": int(row[f"week_{idx}_total"]), "uv": int(row[f"week_{idx}_qualified"])}
+        for idx, label in enumerate(WEEK_LABELS)
+    ]
+
+    percentage = 0
+    if total:
+        percentage = int(round((qualified_total / total) * 100))
+
+    pie_chart = [
+        {"value": percentage},
+        {"value": max(0, 100 - percentage)},
+    ] if total else [{"value": 0}, {"value": 100}]
+
+    stats = {
+        "active": int(row["active"]),
+        "completed": total,
+        "percentage": percentage,
+        "qualified": qualified_total,
+        "waiting": int(row["waiting"]),
+    }
+
+    return {
+        "stats": stats,
+        "line": line_chart,
+        "quarter": quarter_chart,
+        "month": month_chart,
+        "pie": pie_chart,
+    }
+
+
+def compute_lead_stats(now: datetime) -> dict[str, Any]:
+    """Dashboard stats and chart series over all leads, computed live in DuckDB."""
+    return _stats_payload(*_run_stats_query(_LEAD_STATS_SQL, now))
+
+
+def compute_rollup_lead_stats(now: datetime) -> dict[str, Any]:
+    """Same payload as compute_lead_stats, read from the lead_stats_daily rollup."""
+    return _stats_payload(*_run_stats_query(_ROLLUP_STATS_SQL, now))
+
+
+def build_leads_payload(limit: int | None = 120, cursor: str | None = None) -> dict[str, Any]:
+    leads, next_cursor = fetch_lead_rows(limit, cursor)
+    now = datetime.utcnow()
+
+    return {
+        "leads": leads,
+        "next_cursor": next_cursor,
+        **compute_rollup_lead_stats(now),
+        "generated_at": now.isoformat(),
+    }
@@ -0,0 +1,138 @@
+import json
+import sys
+from datetime import date
+from typing import Iterable
+
+from db import conn, db_lock
+
+# Per-lead facts every dashboard aggregate is built from.
+LEAD_FACTS_SQL = """
+    SELECT
+        gmail_id,
+        received_at AS lead_ts,
+        (COALESCE(phone, '') <> '' OR COALESCE(website, '') <> '' OR COALESCE(company, '') <> '') AS qualified,
+        lower(COALESCE(NULLIF(status, ''), 'waiting')) AS status
+    FROM gmail_messages
+"""
+
+# Leads without a received_at are kept under day = NULL so the totals still
+# include them.
+_DAILY_AGGREGATE_SQL = f"""
+    SELECT
+        CAST(lead_ts AS DATE) AS day,
+        count(*) AS total,
+        count(*) FILTER (WHERE qualified) AS qualified,
+        count(*) FILTER (WHERE status = 'waiting' AND NOT qualified) AS waiting
+    FROM ({LEAD_FACTS_SQL})
+"""
+
+_DAY_MATCH_SQL = "(day IN (SELECT unnest(?::DATE[])) OR (? AND day IS NULL))"
+
+
+def _day_params(days: set[date | None]) -> list:
+    return [sorted(day for day in days if day is not None), None in days]
+
+
+def lead_days_for_messages(gmail_ids: Iterable[str]) -> set[date | None]:
+    """Days (by received_at) the given messages currently count towards."""
+    gmail_ids = list(gmail_ids)
+    if not gmail_ids:
+        return set()
+
+    with db_lock:
+        rows = conn.execute(
+            f"""
+            SELECT DISTINCT CAST(lead_ts AS DATE)
+            FROM ({LEAD_FACTS_SQL})
+            WHERE gmail_id IN (SELECT unnest(?::JSON::VARCHAR[]))
+            """,
+            # One JSON parameter binds far faster than a Python list in DuckDB.
+            [json.dumps(gmail_ids)]
+        ).fetchall()
+    return {row[0] for row in rows}
+
+
+def refresh_lead_stats_days(days: set[date | None]) -> None:
+    """Recompute the rollup rows for `days` from gmail_messages.
+
+    Callers hold db_lock and, when combined with other writes, an open
+    transaction.
+    """
+    if not days:
+        return
+
+    params = _day_params(days)
+    with db_lock:
+        conn.execute(f"DELETE FROM lead_stats_daily WHERE {_DAY_MATCH_SQL}", params)
+        conn.execute(
+            f"""
+            INSERT INTO lead_stats_daily (day, total, qualified, waiting)
+            SELECT * FROM ({_DAILY_AGGREGATE_SQL} GROUP BY day)
+            WHERE {_DAY_MATCH_SQL}
+            """,
+            params
+        )
+
+
+def rebuild_lead_stats() -> int:
+    """Recompute the whole rollup from scratch. Returns the number of day rows."""
+    with db_lock:
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            conn.execute("DELETE FROM lead_stats_daily")
+            conn.execute(
+                f"INSERT INTO lead_stats_daily (day, total, qualified, waiting) {_DAILY_AGGREGATE_SQL} GROUP BY day"
+            )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+        return conn.execute("SELECT count(*) FROM lead_stats_daily").fetchone()[0]
+
+
+def ensure_lead_stats() -> None:
+    """Build the rollup once for databases that predate it."""
+    with db_lock:
+        has_rollup = conn.execute("SELECT count(*) FROM lead_stats_daily").fetchone()[0] > 0
+        has_messages = conn.execute("SELECT count(*) FROM gmail_messages").fetchone()[0] > 0
+        if has_messages and not has_rollup:
+            print(f"[LEAD STATS] Built rollup: {rebuild_lead_stats()} day rows")
+
+
+def verify_lead_stats() -> list[tuple]:
+    """Compare the rollup with the live per-day aggregate.
+
+    Returns (day, rollup (total, qualified, waiting), live (...)) for every
+    day that differs; an empty list means the rollup is consistent.
+    """
+    with db_lock:
+        rows = conn.execute(
+            f"""
+            WITH live AS ({_DAILY_AGGREGATE_SQL} GROUP BY day)
+            SELECT
+                COALESCE(r.day, l.day) AS day,
+                r.total, r.qualified, r.waiting,
+                l.total, l.qualified, l.waiting
+            FROM lead_stats_daily r
+            FULL OUTER JOIN live l ON r.day IS NOT DISTINCT FROM l.day
+            WHERE r.total IS DISTINCT FROM l.total
+                OR r.qualified IS DISTINCT FROM l.qualified
+                OR r.waiting IS DISTINCT FROM l.waiting
+            ORDER BY day
+            """
+        ).fetchall()
+    return [(row[0], tuple(row[1:4]), tuple(row[4:7])) for row in rows]
+
+
+if __name__ == "__main__":
+    # python -m service.leadStatsService [rebuild|verify]
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command == "rebuild":
+        print(f"lead_stats_daily rebuilt: {rebuild_lead_stats()} day rows")
+
+    mismatches = verify_lead_stats()
+    for day, rollup, live in mismatches:
+        print(f"  {day}: rollup={rollup} live={live}")
+    print("lead_stats_daily matches live aggregates" if not mismatches else f"{len(mismatches)} mismatched days")
+    sys.exit(1 if mismatches else 0)
@@ -1,14 +1,61 @@
-from db import conn
+import threading
+from typing import Callable
+
+from db import conn, db_lock
+
+# Stored reply prompts are keyed "reply_prompt_<variant>".
+REPLY_PROMPT_KEY_PREFIX = "reply_prompt_"
+
+# app_settings is tiny and only changes through update_reply_prompt, so it is
+# read from DuckDB once and then served from memory; writes go through to
+# DuckDB first. The dict is replaced, never mutated, so readers need no lock.
+_settings: dict[str, str] | None = None
+_settings_lock = threading.Lock()
+_update_listeners: list[Callable[[str], None]] = []
+
+
+def _load_settings() -> dict[str, str]:
+    global _settings
+    settings = _settings
+    if settings is None:
+        with _settings_lock:
+            if _settings is None:
+                with db_lock:
+                    rows = conn.execute("SELECT key, value FROM app_settings").fetchall()
+                _settings = {row[0]: row[1] for row in rows}
+            settings = _settings
+    return settings
+
 
 def get_reply_prompts() -> dict[str, str]:
-    rows = conn.execute("SELECT key, value FROM app_settings").fetchall()
-    return {row[0]: row[1] for row in rows}
+    return dict(_load_settings())
+
 
 def update_reply_prompt(key: str, value: str) -> None:
-    conn.execute(
-        """
-        INSERT INTO app_settings (key, value) VALUES (?, ?)
-        ON CONFLICT(key) DO UPDATE SET value = excluded.value
-        """,
-        [key, value]
-    )
+    global _settings
+    with _settings_lock:
+        with db_lock:
+            conn.execute(
+                """
+                INSERT INTO app_settings (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+                """,
+                [key, value]
+            )
+        if _settings is not None:
+            _settings = {**_settings, key: value}
+
+    for listener in _update_listeners:
+        listener(key)
+
+
+def on_setting_updated(listener: Callable[[str], None]) -> None:
+    """Call `listener(key)` after every update_reply_prompt write."""
+    _update_listeners.append(listener)
+
+
+def reload_settings() -> None:
+    """Drop the in-memory copy; the next read goes to DuckDB."""
+    global _settings
+    with _settings_lock:
+        _settings = None
@@ -1,47 +1,38 @@
 import os
 import json
-from collections import defaultdict
-from datetime import datetime, timedelta
-from pathlib import Path
+import re
+import threading
 from typing import Any
 
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
 from dotenv import load_dotenv
 
-load_dotenv()
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-CREDENTIALS_DIR = BASE_DIR / "credentials"
-TOKEN_FILE = CREDENTIALS_DIR / "token.json"
+from db import conn, db_lock, select_message_columns
+from service.googleClientService import get_google_service
+from service.leadStatsService import lead_days_for_messages, refresh_lead_stats_days
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+load_dotenv()
 
 
 def _get_sheet_service():
-    if not TOKEN_FILE.exists():
-        raise FileNotFoundError(
-            f"token.json not found at {TOKEN_FILE}. "
-            "Run auth_init.py first."
-        )
+    return get_google_service("sheets", "v4")
 
-    creds = Credentials.from_authorized_user_file(
-        TOKEN_FILE,
-        SCOPES
-    )
 
-    return build("sheets", "v4", credentials=creds)
+def _first_row_of_range(a1_range: str | None) -> int | None:
+    """'Sheet1!A12:T14' -> 12"""
+    match = re.search(r"[A-Z]+(\d+)", (a1_range or "").rsplit("!", 1)[-1])
+    return int(match.group(1)) if match else None
 
 
-def append_to_sheet(rows: list[list[str]]):
+def append_to_sheet(rows: list[list[str]], service=None) -> int | None:
+    """Append rows and return the sheet row number of the first appended row."""
     if not rows:
-        return
+        return None
 
-    service = _get_sheet_service()
+    service = service or _get_sheet_service()
 
     body = {"values": rows}
 
-    service.spreadsheets().values().append(
+    response = service.spreadsheets().values().append(
         spreadsheetId=os.getenv("SPREADSHEET_ID"),
         range="A:T",
         valueInputOption="RAW",
@@ -49,6 +40,8 @@ def append_to_sheet(rows: list[list[str]]):
         body=body
     ).execute()
 
+    return _first_row_of_range((response or {}).get("updates", {}).get("updatedRange"))
+
 
 DEFAULT_HEADERS = [
     "status",
@@ -74,21 +67,37 @@ DEFAULT_HEADERS = [
 ]
 
 
-MONTH_LABELS = [
-    "JAN", "FEB", "MAR", "APR", "MAY", "JUN",
-    "JUL", "AUG", "SEP", "OCT", "NOV", "DEC",
-]
+def normalize_lead_entry(entry: dict[str, Any]) -> dict[str, Any]:
+    """Decode JSON-encoded fields and fill defaults for optional lead fields in place.
+
+    Values already decoded by DuckDB (lists) are kept as they are.
+    """
+    person_links_raw = entry.get("person_links")
+    if person_links_raw and isinstance(person_links_raw, str):
+        try:
+            entry["person_links"] = json.loads(person_links_raw)
+        except json.JSONDecodeError:
+            entry["person_links"] = [item.strip() for item in person_links_raw.split(";") if item.strip()]
+    elif not isinstance(person_links_raw, list):
+        entry["person_links"] = []
+
+    for complex_key in ("person_insights", "company_insights"):
+        raw_value = entry.get(complex_key)
+        if raw_value and isinstance(raw_value, str):
+            try:
+                entry[complex_key] = json.loads(raw_value)
+            except json.JSONDecodeError:
+                entry[complex_key] = []
+        elif not isinstance(raw_value, list):
+            entry[complex_key] = []
 
-WEEK_LABELS = ["W1", "W2", "W3", "W4"]
+    # Normalize optional fields
+    entry["status"] = entry.get("status") or "waiting"
+    entry["person_summary"] = entry.get("person_summary") or ""
+    entry["first_name"] = entry.get("first_name") or ""
+    entry["last_name"] = entry.get("last_name") or ""
 
-DATE_FORMATS = [
-    "%Y-%m-%d %H:%M:%S",
-    "%Y-%m-%d",
-    "%d.%m.%Y %H:%M:%S",
-    "%d.%m.%Y",
-    "%m/%d/%Y %H:%M:%S",
-    "%m/%d/%Y",
-]
+    return entry
 
 
 def fetch_sheet_rows(limit: int | None = 120) -> list[dict[str, str]]:
@@ -136,31 +145,7 @@ def fetch_sheet_rows(limit: int | None = 120) -> list[dict[str, str]]:
                 key = DEFAULT_HEADERS[idx]
             entry[key] = row[idx] if idx < len(row) else ""
 
-        # Post-process JSON encoded fields
-        person_links_raw = entry.get("person_links")
-        if person_links_raw:
-            try:
-                entry["person_links"] = json.loads(person_links_raw)
-            except json.JSONDecodeError:
-                entry["person_links"] = [item.strip() for item in person_links_raw.split(";") if item.strip()]
-        else:
-            entry["person_links"] = []
-
-        for complex_key in ("person_insights", "company_insights"):
-            raw_value = entry.get(complex_key)
-            if raw_value:
-                try:
-                    entry[complex_key] = json.loads(raw_value)
-                except json.JSONDecodeError:
-                    entry[complex_key] = []
-            else:
-                entry[complex_key] = []
-
-        # Normalize optional fields
-        entry["status"] = entry.get("status") or "waiting"
-        entry["person_summary"] = entry.get("person_summary") or ""
-        entry["first_name"] = entry.get("first_name") or ""
-        entry["last_name"] = entry.get("last_name") or ""
+        entry = normalize_lead_entry(entry)
         entry["sheet_row"] = row_number
 
         leads.append(entry)
@@ -171,148 +156,296 @@ def fetch_sheet_rows(limit: int | None = 120) -> list[dict[str, str]]:
 ALLOWED_STATUS_VALUES = {"confirmed", "rejected", "snoozed", "waiting", "new"}
 
 
-def update_lead_status(row_number: int, status: str) -> None:
-    if row_number is None or row_number < 1:
-        raise ValueError("row_number must be a positive integer")
+# Set whenever a sheet write is queued; the write-behind writer waits on it.
+sheet_writes_pending = threading.Event()
 
+
+def _normalize_status(status: str) -> str:
     normalized_status = (status or "").strip().lower()
     if normalized_status not in ALLOWED_STATUS_VALUES:
         raise ValueError("Unsupported status value")
+    return normalized_status
 
-    service = _get_sheet_service()
-
-    body = {"values": [[normalized_status]]}
 
-    service.spreadsheets().values().update(
-        spreadsheetId=os.getenv("SPREADSHEET_ID"),
-        range=f"A{row_number}",
-        valueInputOption="RAW",
-        body=body,
-    ).execute()
+def _apply_status_changes(
+    by_gmail_id: dict[str, str],
+    by_sheet_row: dict[int, str],
+) -> tuple[dict[str, int | None], dict[int, list[str]]]:
+    """Set statuses in DuckDB and queue the sheet writes, in one transaction.
 
+    Returns ({found gmail_id: sheet_row}, {sheet_row: gmail_ids on that row}).
+    A message addressed both ways gets its by-gmail_id status. Rows are
+    written to the sheet even when no message is recorded on them.
+    """
+    ids_json = json.dumps(list(by_gmail_id))
+    rows_json = json.dumps(list(by_sheet_row))
 
-def _parse_datetime(value: str | None) -> datetime | None:
-    if not value:
-        return None
+    with db_lock:
+        conn.execute("BEGIN TRANSACTION")
+        try:
+            # UPDATE ... RETURNING trips DuckDB's primary-key check, so look the rows up first.
+            found = dict(conn.execute(
+                "SELECT gmail_id, sheet_row FROM gmail_messages WHERE gmail_id IN (SELECT unnest(?::JSON::VARCHAR[]))",
+                [ids_json]
+            ).fetchall())
+            row_matches: dict[int, list[str]] = {}
+            for gmail_id, sheet_row in conn.execute(
+                "SELECT gmail_id, sheet_row FROM gmail_messages WHERE sheet_row IN (SELECT unnest(?::JSON::INTEGER[]))",
+                [rows_json]
+            ).fetchall():
+                row_matches.setdefault(sheet_row, []).append(gmail_id)
+
+            message_statuses = {
+                gmail_id: status
+                for sheet_row, status in by_sheet_row.items()
+                for gmail_id in row_matches.get(sheet_row, [])
+            }
+            message_statuses.update({gmail_id: by_gmail_id[gmail_id] for gmail_id in found})
+
+            # Messages without a sheet row yet can't be queued here. If their
+            # append already read the old status, the writer queues a
+            # correction once the row is known (queue_status_corrections).
+            sheet_writes = dict(by_sheet_row)
+            sheet_writes.update({
+                sheet_row: by_gmail_id[gmail_id] for gmail_id, sheet_row in found.items() if sheet_row is not None
+            })
+
+            if message_statuses:
+                conn.execute(
+                    """
+                    UPDATE gmail_messages SET status = changes.status
+                    FROM (
+                        SELECT unnest(json_transform(?::JSON, '[{"gmail_id": "VARCHAR", "status": "VARCHAR"}]'), recursive := true)
+                    ) AS changes
+                    WHERE gmail_messages.gmail_id = changes.gmail_id
+                    """,
+                    [json.dumps([{"gmail_id": key, "status": value} for key, value in message_statuses.items()])]
+                )
+                refresh_lead_stats_days(lead_days_for_messages(message_statuses))
+
+            if sheet_writes:
+                conn.execute(
+                    """
+                    INSERT INTO sheet_status_outbox (sheet_row, status)
+                    SELECT unnest(json_transform(?::JSON, '[{"sheet_row": "INTEGER", "status": "VARCHAR"}]'), recursive := true)
+                    ON CONFLICT (sheet_row) DO UPDATE SET status = excluded.status, queued_at = now()
+                    """,
+                    [json.dumps([{"sheet_row": key, "status": value} for key, value in sheet_writes.items()])]
+                )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    if sheet_writes:
+        sheet_writes_pending.set()
+    return found, row_matches
+
+
+def _validate_row_number(row_number) -> int:
+    if isinstance(row_number, bool) or not isinstance(row_number, int) or row_number < 1:
+        raise ValueError("row_number must be a positive integer")
+    return row_number
 
-    stripped = value.strip()
-    if not stripped:
-        return None
 
-    for fmt in DATE_FORMATS:
+def update_lead_status(row_number: int, status: str) -> None:
+    """Update the status of the lead on sheet row `row_number`.
+
+    DuckDB is updated now; the sheet write is queued for
+    service/sheetWriterService.py, which sends repeated changes to the same
+    row once, with the latest status. Prefer update_lead_status_by_gmail_id:
+    a row number goes stale when rows are inserted or moved in the sheet.
+    """
+    row_number = _validate_row_number(row_number)
+    _apply_status_changes({}, {row_number: _normalize_status(status)})
+
+
+def update_lead_status_by_gmail_id(gmail_id: str, status: str) -> int | None:
+    """Update the status of a lead by Gmail message id.
+
+    The sheet row comes from gmail_messages.sheet_row, recorded from the
+    append response, so no sheet read is needed. Returns that row (None
+    while the message hasn't been appended yet). Raises LookupError for
+    an unknown gmail_id.
+    """
+    normalized_status = _normalize_status(status)
+    if not gmail_id:
+        raise ValueError("gmail_id is required")
+
+    found, _ = _apply_status_changes({gmail_id: normalized_status}, {})
+    if gmail_id not in found:
+        raise LookupError(f"Unknown gmail_id: {gmail_id}")
+    return found[gmail_id]
+
+
+def update_lead_statuses(items: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Apply many status changes in one DuckDB transaction.
+
+    Each item has a `status` and a `gmail_id` or `row_number`. Invalid items
+    are reported and skipped; the rest are applied together and reach the
+    sheet in the writer's next batchUpdate. When an item repeats, the last
+    one wins. Returns one result per item, in order.
+    """
+    results: list[dict[str, Any]] = []
+    by_gmail_id: dict[str, str] = {}
+    by_sheet_row: dict[int, str] = {}
+
+    for item in items:
+        gmail_id = item.get("gmail_id")
+        row_number = item.get("row_number")
+        result = {"gmail_id": gmail_id, "row_number": row_number, "status": item.get("status"), "ok": False}
+        results.append(result)
         try:
-            return datetime.strptime(stripped, fmt)
-        except ValueError:
+            status = _normalize_status(item.get("status"))
+            if gmail_id:
+                by_gmail_id[gmail_id] = status
+            elif row_number is not None:
+                by_sheet_row[_validate_row_number(row_number)] = status
+            else:
+                raise ValueError("gmail_id or row_number is required")
+        except ValueError as exc:
+            result["error"] = str(exc)
             continue
+        result["status"] = status
 
-    try:
-        normalized = stripped.replace("Z", "+00:00") if stripped.endswith("Z") else stripped
-        return datetime.fromisoformat(normalized)
-    except ValueError:
-        return None
+    found, row_matches = _apply_status_changes(by_gmail_id, by_sheet_row)
+
+    for result in results:
+        if "error" in result:
+            continue
+        if result["gmail_id"]:
+            if result["gmail_id"] not in found:
+                result["error"] = f"Unknown gmail_id: {result['gmail_id']}"
+                continue
+            result["row_number"] = found[result["gmail_id"]]
+        else:
+            matched = row_matches.get(result["row_number"], [])
+            result["gmail_id"] = matched[0] if len(matched) == 1 else None
+        result["ok"] = True
+
+    return results
+
+
+def queue_status_corrections(appended_statuses: dict[str, str]) -> int:
+    """Queue sheet writes for appended messages whose status changed since their row was read.
+
+    Called after mark_messages_synced: a status update that landed between
+    reading the row and recording its sheet_row saw no sheet row and was not
+    queued, so the sheet still shows the appended value. Returns the number
+    of rows queued.
+    """
+    if not appended_statuses:
+        return 0
+
+    payload = json.dumps([{"gmail_id": key, "status": value} for key, value in appended_statuses.items()])
+    with db_lock:
+        # Read and queue under one lock hold so the queued value is current.
+        corrections = conn.execute(
+            """
+            SELECT m.sheet_row, m.status
+            FROM gmail_messages m
+            JOIN (
+                SELECT unnest(json_transform(?::JSON, '[{"gmail_id": "VARCHAR", "status": "VARCHAR"}]'), recursive := true)
+            ) AS appended ON m.gmail_id = appended.gmail_id
+            WHERE m.sheet_row IS NOT NULL
+                AND m.status IS NOT NULL
+                AND m.status <> appended.status
+            """,
+            [payload]
+        ).fetchall()
+        if corrections:
+            conn.execute(
+                """
+                INSERT INTO sheet_status_outbox (sheet_row, status)
+                SELECT unnest(json_transform(?::JSON, '[{"sheet_row": "INTEGER", "status": "VARCHAR"}]'), recursive := true)
+                ON CONFLICT (sheet_row) DO UPDATE SET status = excluded.status, queued_at = now()
+                """,
+                [json.dumps([{"sheet_row": row, "status": status} for row, status in corrections])]
+            )
+
+    if corrections:
+        sheet_writes_pending.set()
+    return len(corrections)
+
+
+def pending_status_updates() -> dict[int, str]:
+    """Queued status writes as {sheet_row: status}."""
+    with db_lock:
+        rows = conn.execute("SELECT sheet_row, status FROM sheet_status_outbox ORDER BY sheet_row").fetchall()
+    return dict(rows)
+
+
+def clear_status_updates(applied: dict[int, str]) -> None:
+    """Drop written updates, keeping rows whose status changed again meanwhile."""
+    if not applied:
+        return
 
+    payload = json.dumps([{"sheet_row": row, "status": status} for row, status in applied.items()])
+    with db_lock:
+        conn.execute(
+            """
+            DELETE FROM sheet_status_outbox
+            USING (
+                SELECT unnest(json_transform(?::JSON, '[{"sheet_row": "INTEGER", "status": "VARCHAR"}]'), recursive := true)
+            ) AS applied
+            WHERE sheet_status_outbox.sheet_row = applied.sheet_row
+                AND sheet_status_outbox.status = applied.status
+            """,
+            [payload]
+        )
 
-def _generate_month_buckets() -> list[datetime]:
-    buckets: list[datetime] = []
-    current = datetime.utcnow().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    for _ in range(12):
-        buckets.append(current)
-        month = current.month - 1
-        year = current.year
-        if month == 0:
-            month = 12
-            year -= 1
-        current = datetime(year, month, 1)
-    return list(reversed(buckets))
-
-
-def _is_qualified(lead: dict[str, str]) -> bool:
-    return bool(lead.get("phone") or lead.get("website") or lead.get("company"))
-
-
-def build_leads_payload(limit: int | None = 120) -> dict[str, Any]:
-    leads = fetch_sheet_rows(limit)
-    now = datetime.utcnow()
-    active_cutoff = now - timedelta(days=30)
-
-    total = len(leads)
-    qualified_total = 0
-    waiting_total = 0
-    active_total = 0
-
-    month_totals: dict[tuple[int, int], dict[str, int]] = defaultdict(lambda: {"total": 0, "qualified": 0})
-    week_totals = [0, 0, 0, 0]
-    week_qualified = [0, 0, 0, 0]
-
-    for lead in leads:
-        lead_dt = _parse_datetime(lead.get("received_at"))
-        qualified = _is_qualified(lead)
-        if qualified:
-            qualified_total += 1
-
-        if (lead.get("status") or "waiting").lower() == "waiting" and not qualified:
-            waiting_total += 1
-
-        if lead_dt:
-            if lead_dt >= active_cutoff:
-                active_total += 1
-
-            key = (lead_dt.year, lead_dt.month)
-            month_totals[key]["total"] += 1
-            if qualified:
-                month_totals[key]["qualified"] += 1
-
-            diff_days = (now - lead_dt).days
-            if diff_days < 0:
-                diff_days = 0
-            week_index = diff_days // 7
-            if week_index < 4:
-                slot = 3 - week_index
-                week_totals[slot] += 1
-                if qualified:
-                    week_qualified[slot] += 1
-
-    month_buckets = _generate_month_buckets()
-    line_chart = []
-    for bucket in month_buckets:
-        key = (bucket.year, bucket.month)
-        bucket_totals = month_totals.get(key, {"total": 0, "qualified": 0})
-        line_chart.append({
-            "name": MONTH_LABELS[bucket.month - 1],
-            "pv": bucket_totals["total"],
-            "uv": bucket_totals["qualified"],
-        })
-
-    quarter_chart = line_chart[-3:] if line_chart else []
-
-    month_chart = [
-        {"name": label, "pv": week_totals[idx], "uv": week_qualified[idx]}
-        for idx, label in enumerate(WEEK_LABELS)
-    ]
-
-    percentage = 0
-    if total:
-        percentage = int(round((qualified_total / total) * 100))
-
-    pie_chart = [
-        {"value": percentage},
-        {"value": max(0, 100 - percentage)},
-    ] if total else [{"value": 0}, {"value": 100}]
-
-    stats = {
-        "active": active_total,
-        "completed": total,
-        "percentage": percentage,
-        "qualified": qualified_total,
-        "waiting": waiting_total,
-    }
 
-    return {
-        "leads": leads,
-        "stats": stats,
-        "line": line_chart,
-        "quarter": quarter_chart,
-        "month": month_chart,
-        "pie": pie_chart,
-        "generated_at": now.isoformat(),
+def write_statuses_to_sheet(updates: dict[int, str], service=None) -> None:
+    """Write {sheet_row: status} to the status column in one values().batchUpdate call."""
+    if not updates:
+        return
+
+    service = service or _get_sheet_service()
+
+    body = {
+        "valueInputOption": "RAW",
+        "data": [
+            {"range": f"A{row_number}", "values": [[status]]}
+            for row_number, status in sorted(updates.items())
+        ],
     }
+
+    service.spreadsheets().values().batchUpdate(
+        spreadsheetId=os.getenv("SPREADSHEET_ID"),
+        body=body,
+    ).execute()
+
+
+def backfill_sheet_rows() -> int:
+    """Fill gmail_messages.sheet_row for rows synced before it was tracked.
+
+    Reads the sheet once and matches rows on (email, subject, received_at).
+    Returns the number of messages updated.
+    """
+    with db_lock:
+        missing = conn.execute(
+            f"""
+            SELECT gmail_id, {select_message_columns(["email", "subject", "received_at"])}
+            FROM gmail_messages
+            WHERE synced_at IS NOT NULL AND sheet_row IS NULL
+            """
+        ).fetchall()
+    if not missing:
+        return 0
+
+    rows_by_key: dict[tuple[str, str, str], int] = {}
+    for lead in fetch_sheet_rows(limit=None):
+        key = (lead.get("email") or "", lead.get("subject") or "", lead.get("received_at") or "")
+        rows_by_key.setdefault(key, lead["sheet_row"])
+
+    updates = []
+    for gmail_id, email, subject, received_at in missing:
+        row_number = rows_by_key.get((email or "", subject or "", received_at or ""))
+        if row_number is not None:
+            updates.append([row_number, gmail_id])
+
+    if updates:
+        with db_lock:
+            conn.executemany("UPDATE gmail_messages SET sheet_row = ? WHERE gmail_id = ?", updates)
+
+    return len(updates)
@@ -0,0 +1,122 @@
+import os
+import random
+import threading
+import time
+from typing import Any, Callable
+
+from googleapiclient.errors import HttpError
+
+from service.gmailService import get_unsynced_message_rows, mark_messages_synced
+from service.sheetService import (
+    _get_sheet_service,
+    append_to_sheet,
+    clear_status_updates,
+    pending_status_updates,
+    queue_status_corrections,
+    sheet_writes_pending,
+    write_statuses_to_sheet,
+)
+
+SHEETS_FLUSH_INTERVAL_SECONDS = float(os.getenv("SHEETS_FLUSH_INTERVAL_SECONDS", "5"))
+SHEETS_APPEND_BATCH_ROWS = int(os.getenv("SHEETS_APPEND_BATCH_ROWS", "500"))
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+SHEETS_BACKOFF_BASE_SECONDS = float(os.getenv("SHEETS_BACKOFF_BASE_SECONDS", "1"))
+SHEETS_BACKOFF_MAX_SECONDS = float(os.getenv("SHEETS_BACKOFF_MAX_SECONDS", "64"))
+
+# Status writes are idempotent, so they are also retried on server errors.
+# Appends only retry 429, which guarantees nothing was written.
+_RATE_LIMITED = {429}
+_RETRYABLE_FOR_UPDATES = {429, 500, 502, 503, 504}
+
+# Only one flush talks to the sheet at a time, so rows are never appended twice.
+_flush_lock = threading.Lock()
+_writer_thread: threading.Thread | None = None
+
+
+def _backoff_delay(attempt: int) -> float:
+    delay = min(SHEETS_BACKOFF_MAX_SECONDS, SHEETS_BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _with_backoff(call: Callable[[], Any], retry_statuses: set[int]) -> Any:
+    """Run a Sheets call, sleeping with exponential backoff and jitter on retryable HTTP errors."""
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except HttpError as exc:
+            status = getattr(exc.resp, "status", None)
+            if status not in retry_statuses or attempt >= SHEETS_MAX_RETRIES:
+                raise
+            delay = _backoff_delay(attempt)
+            print(f"[SHEETS] HTTP {status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def flush_sheet_writes() -> dict[str, int]:
+    """Write everything queued for the sheet: unsynced message rows, then status changes."""
+    with _flush_lock:
+        sheet_writes_pending.clear()
+        service = None
+
+        appended = 0
+        while True:
+            staged_rows = get_unsynced_message_rows(SHEETS_APPEND_BATCH_ROWS)
+            if not staged_rows:
+                break
+
+            service = service or _get_sheet_service()
+            row_values = [values for _, values in staged_rows]
+            first_sheet_row = _with_backoff(lambda: append_to_sheet(row_values, service), _RATE_LIMITED)
+            mark_messages_synced([gmail_id for gmail_id, _ in staged_rows], first_sheet_row)
+            # Status is the first column; statuses changed after the read above
+            # were not in the append and had no row to queue against yet.
+            queue_status_corrections({gmail_id: values[0] for gmail_id, values in staged_rows})
+            appended += len(staged_rows)
+
+            if len(staged_rows) < SHEETS_APPEND_BATCH_ROWS:
+                break
+
+        updates = pending_status_updates()
+        if updates:
+            service = service or _get_sheet_service()
+            _with_backoff(lambda: write_statuses_to_sheet(updates, service), _RETRYABLE_FOR_UPDATES)
+            clear_status_updates(updates)
+
+    return {"appended": appended, "statuses": len(updates)}
+
+
+def request_sheet_flush() -> None:
+    """Wake the writer so queued rows go out without waiting for the next interval."""
+    sheet_writes_pending.set()
+
+
+def _writer_loop() -> None:
+    failures = 0
+    while True:
+        if failures:
+            # Don't let new writes cut a backoff short.
+            time.sleep(min(SHEETS_BACKOFF_MAX_SECONDS, SHEETS_FLUSH_INTERVAL_SECONDS * (2 ** failures)))
+        else:
+            sheet_writes_pending.wait(timeout=SHEETS_FLUSH_INTERVAL_SECONDS)
+
+        try:
+            result = flush_sheet_writes()
+            failures = 0
+            if result["appended"] or result["statuses"]:
+                print(f"[SHEETS] appended {result['appended']} rows, wrote {result['statuses']} statuses")
+        except Exception as exc:
+            # Everything stays queued in DuckDB; try again after a longer pause.
+            failures += 1
+            print(f"[SHEETS ERROR] flush failed: {exc}")
+
+
+def start_sheet_writer() -> None:
+    """Start the background writer thread (idempotent)."""
+    global _writer_thread
+    if _writer_thread is not None and _writer_thread.is_alive():
+        return
+
+    _writer_thread = threading.Thread(target=_writer_loop, name="sheet-writer", daemon=True)
+    _writer_thread.start()
@@ -1,23 +1,72 @@
-from service.gmailService import (
-    fetch_new_gmail_data,
-    get_unsynced_message_rows,
-    mark_messages_synced,
-)
-from service.sheetService import append_to_sheet
+import threading
+
+from service.gmailService import fetch_new_gmail_data, get_sync_state, set_sync_state
+from service.sheetService import backfill_sheet_rows
+from service.sheetWriterService import request_sheet_flush
+
+_SHEET_ROWS_BACKFILLED_KEY = "sheet_rows_backfilled"
+
+
+class SyncInProgressError(RuntimeError):
+    """Raised when a sync is requested while another one is still running."""
+
+
+# Single-flight guard shared by the auto-sync timer and POST /gmail/sync.
+_sync_lock = threading.Lock()
+
+
+def is_sync_running() -> bool:
+    return _sync_lock.locked()
+
+
+def claim_sync() -> None:
+    """Take the single-flight lock or raise SyncInProgressError.
+
+    The caller owns the claim until it hands it to run_claimed_sync, which
+    may run on another thread, or gives it back with release_sync.
+    """
+    if not _sync_lock.acquire(blocking=False):
+        raise SyncInProgressError("Gmail sync is already running")
+
+
+def release_sync() -> None:
+    _sync_lock.release()
+
+
+def run_claimed_sync(limit: int | None = None) -> int:
+    """Run a sync under a claim taken by claim_sync, releasing it when done."""
+    try:
+        return _sync_gmail_to_sheets(limit)
+    finally:
+        release_sync()
 
 
 def sync_gmail_to_sheets(limit: int | None = None) -> int:
-    """Fetch new Gmail messages, stage them in DuckDB, then sync unsynced rows to Sheets."""
-    fetch_new_gmail_data()
+    """Fetch new Gmail messages and stage them in DuckDB; returns how many were saved.
+
+    Staged rows are appended to the sheet by the write-behind writer.
+    """
+    claim_sync()
+    return run_claimed_sync(limit)
+
+
+def _backfill_sheet_rows_once() -> None:
+    if get_sync_state(_SHEET_ROWS_BACKFILLED_KEY):
+        return
+
+    try:
+        count = backfill_sheet_rows()
+    except Exception as exc:
+        print(f"[SYNC] sheet row backfill failed: {exc}")
+        return
 
-    staged_rows = get_unsynced_message_rows(limit)
-    if not staged_rows:
-        return 0
+    print(f"[SYNC] backfilled sheet rows for {count} messages")
+    set_sync_state(_SHEET_ROWS_BACKFILLED_KEY, "1")
 
-    row_values = [values for _, values in staged_rows]
-    append_to_sheet(row_values)
 
-    gmail_ids = [gmail_id for gmail_id, _ in staged_rows]
-    mark_messages_synced(gmail_ids)
+def _sync_gmail_to_sheets(limit: int | None) -> int:
+    _backfill_sheet_rows_once()
+    saved_rows = fetch_new_gmail_data() if limit is None else fetch_new_gmail_data(limit=limit)
 
-    return len(row_values)
+    request_sheet_flush()
+    return len(saved_rows)
@@ -1,4 +1,4 @@
-from db import conn
+from db import conn, db_lock
 from hashPswd import hash_password, verify_password
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
@@ -17,27 +17,29 @@ except ValueError:
     ACCESS_TOKEN_EXPIRE_HOURS = 2
 
 def register_user(user):
-    exists = conn.execute(
-        "SELECT 1 FROM users WHERE username = ? OR email = ?",
-        [user.username, user.email]
-    ).fetchone()
-
-    if exists:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already exists"
-        )
-
     hashed_pwd = hash_password(user.password)
 
-    next_id = conn.execute(
-        "SELECT COALESCE(MAX(id), 0) + 1 FROM users"
-    ).fetchone()[0]
-
-    conn.execute(
-        "INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)",
-        [next_id, user.username, user.email, hashed_pwd]
-    )
+    # Check, id allocation and insert must not interleave with another registration.
+    with db_lock:
+        exists = conn.execute(
+            "SELECT 1 FROM users WHERE username = ? OR email = ?",
+            [user.username, user.email]
+        ).fetchone()
+
+        if exists:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Username already exists"
+            )
+
+        next_id = conn.execute(
+            "SELECT COALESCE(MAX(id), 0) + 1 FROM users"
+        ).fetchone()[0]
+
+        conn.execute(
+            "INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, ?)",
+            [next_id, user.username, user.email, hashed_pwd]
+        )
 
     return {"msg": "User registered successfully"}
 
@@ -53,10 +55,11 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
 def login_user(user):
     username = user.username or user.email
 
-    row = conn.execute(
-        "SELECT username, password FROM users WHERE username = ? OR email = ?",
-        [username, user.email or username]
-    ).fetchone()
+    with db_lock:
+        row = conn.execute(
+            "SELECT username, password FROM users WHERE username = ? OR email = ?",
+            [username, user.email or username]
+        ).fetchone()
 
     if not row:
         raise HTTPException(
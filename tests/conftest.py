@@ -1,3 +1,4 @@
+import os
 import sys
 from pathlib import Path
 
@@ -5,3 +6,8 @@ from pathlib import Path
 ROOT = Path(__file__).resolve().parents[1]
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
+
+# Keep tests away from the real database file and let the OpenAI client
+# construct without credentials (all completions are faked in tests).
+os.environ.setdefault("DUCKDB_PATH", ":memory:")
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
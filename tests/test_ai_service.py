@@ -1,7 +1,18 @@
+import asyncio
 import json
 import os
 import types
 
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def _clear_analysis_cache():
+    # Cached analyses live in the shared DuckDB connection and outlive module reloads.
+    from db import conn
+
+    conn.execute("DELETE FROM cache_entries WHERE namespace = 'email_analysis'")
+
 
 def _install_fake_openai_client(ai_service_module, base_json_obj, final_json_obj):
     """Monkeypatch ai_service_module.client.chat.completions.create with a 2-call queue."""
@@ -38,8 +49,7 @@ def test_analyze_email_without_company_search(monkeypatch):
 
     importlib.reload(ai_service)
 
-    base_json_obj = {"company": None, "website": None}
-    final_json_obj = {
+    base_json_obj = {
         "email": "john@example.com",
         "first_name": "John",
         "last_name": "Doe",
@@ -54,11 +64,14 @@ def test_analyze_email_without_company_search(monkeypatch):
         "website": None,
     }
 
-    _install_fake_openai_client(ai_service, base_json_obj, final_json_obj)
+    fake = _install_fake_openai_client(ai_service, base_json_obj, {})
 
     out = ai_service.analyze_email(subject="Hi", body="Hello", sender="john@example.com")
     assert out["full_name"] == "John Doe"
     assert out["company_summary"] is None
+    # Nothing to enrich with, so the Step-1 JSON is returned without a second call.
+    assert fake.calls == 1
+    assert ai_service.get_analysis_path_stats()["fast"] == 1
 
 
 def test_analyze_email_with_tool_call(monkeypatch):
@@ -101,6 +114,186 @@ def test_analyze_email_with_tool_call(monkeypatch):
     assert out["company_summary"] == "IT services company."
 
 
+def _completion(content):
+    return types.SimpleNamespace(
+        choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))]
+    )
+
+
+def test_analyze_email_async_uses_async_client(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "false")
+
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    payloads = [{"full_name": "Jane Roe", "company": "Acme"}]
+
+    class _FakeAsyncCompletions:
+        async def create(self, **kwargs):
+            return _completion(json.dumps(payloads.pop(0)))
+
+    ai_service.async_client.chat.completions = _FakeAsyncCompletions()
+
+    out = asyncio.run(ai_service.analyze_email_async(subject="Hi", body="Hello", sender="jane@acme.io"))
+    assert out["full_name"] == "Jane Roe"
+    assert out["company"] == "Acme"
+    assert payloads == []
+
+
+def test_generate_email_replies_async_runs_variants_concurrently(monkeypatch):
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    monkeypatch.setattr(ai_service, "get_reply_prompts", lambda: {})
+    in_flight = {"current": 0, "max": 0}
+
+    class _FakeAsyncCompletions:
+        async def create(self, **kwargs):
+            in_flight["current"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["current"])
+            await asyncio.sleep(0.01)
+            in_flight["current"] -= 1
+            return _completion("Reply for " + kwargs["messages"][1]["content"].split("\n")[3])
+
+    ai_service.async_client.chat.completions = _FakeAsyncCompletions()
+
+    replies = asyncio.run(ai_service.generate_email_replies_async(
+        lead={"full_name": "Jane Roe"},
+        email={"subject": "Pricing"},
+        prompt_overrides={"follow_up": "Thank [NAME]", "recap": "Recap [TOPIC_DISCUSSED]"},
+    ))
+
+    assert replies == {"follow_up": "Reply for Thank Jane Roe", "recap": "Reply for Recap Pricing"}
+    assert in_flight["max"] == 2
+
+
+def test_enrichment_runs_lookups_concurrently_under_deadline(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "true")
+
+    import importlib
+    import time
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    monkeypatch.setattr(ai_service, "ENRICHMENT_DEADLINE_SECONDS", 0.5)
+
+    def slow(value, delay):
+        def _tool(*args):
+            time.sleep(delay)
+            return value
+        return _tool
+
+    monkeypatch.setattr(ai_service, "fetch_website_tool", slow("Title: Acme", 0.2))
+    monkeypatch.setattr(ai_service, "search_company_tool", slow("Acme overview", 0.2))
+    monkeypatch.setattr(ai_service, "search_person_insights", slow([{"snippet": "late"}], 2))
+
+    started = time.monotonic()
+    context, person, _, complete = ai_service._run_enrichment(
+        {"company": "Acme", "website": "acme.io", "full_name": "Jane Roe"}, None, None
+    )
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 1.0
+    assert "[WEBSITE]\nTitle: Acme" in context
+    assert "[DDG_SEARCH]\nAcme overview" in context
+    assert person == []
+    # The person lookup missed the deadline.
+    assert complete is False
+
+
+def test_search_company_tool_queries_variants_concurrently(monkeypatch):
+    import importlib
+    import threading
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    barrier = threading.Barrier(4, timeout=2)
+
+    class _FakeDDGS:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def text(self, query, max_results):
+            # Only passes if all four variants are in flight at once.
+            barrier.wait()
+            return [{"title": query, "body": "", "href": "https://acme.io/" + query.split()[-1]}]
+
+    monkeypatch.setattr(ai_service, "DDGS", _FakeDDGS)
+    ai_service._company_search_cache.clear()
+
+    out = ai_service.search_company_tool("Acme")
+
+    assert out.startswith('1. "Acme" company overview (acme.io)')
+    assert len(ai_service._company_search_results("Acme")) == 4
+
+
+class _FakeResponse:
+    def __init__(self, status_code, chunks=(), headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._chunks = list(chunks)
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size):
+        for chunk in self._chunks:
+            self.chunks_read += 1
+            yield chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _FakeSession:
+    def __init__(self, responses):
+        self._responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, **kwargs):
+        self.requests.append({"url": url, "headers": dict(headers or {}), **kwargs})
+        return self._responses.pop(0)
+
+
+def test_fetch_website_tool_stops_at_head_and_revalidates(monkeypatch):
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    ai_service._website_meta_cache.clear()
+
+    first = _FakeResponse(
+        200,
+        chunks=[
+            b"<html><head><title>Acme Corp</title>",
+            b'<meta name="description" content="Industrial widgets"></HEAD>',
+            b"<body>" + b"x" * 10000,
+            b"never read",
+        ],
+        headers={"Content-Type": "text/html; charset=utf-8", "ETag": '"v1"'},
+    )
+    revalidated = _FakeResponse(304, headers={"ETag": '"v1"'})
+    session = _FakeSession([first, revalidated])
+    monkeypatch.setattr(ai_service, "_website_session", session)
+
+    summary = ai_service.fetch_website_tool("https://acme.io")
+    assert summary == "Title: Acme Corp\nMeta description: Industrial widgets"
+    assert first.chunks_read == 2
+    assert session.requests[0]["stream"] is True
+
+    assert ai_service.fetch_website_tool("https://acme.io") == summary
+    assert session.requests[1]["headers"] == {"If-None-Match": '"v1"'}
+
+
 def test_company_candidate_from_domain(monkeypatch):
     monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "false")
 
@@ -111,3 +304,333 @@ def test_company_candidate_from_domain(monkeypatch):
 
     assert ai_service._company_candidate_from_sender_email("a@nova-poshta.ua") == "Nova Poshta"
     assert ai_service._company_candidate_from_sender_email("a@gmail.com") is None
+
+
+def test_analyze_emails_batch_packs_chunk_and_retries_bad_items(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "false")
+    monkeypatch.setenv("AI_BATCH_MAX_EMAILS", "3")
+    monkeypatch.setenv("AI_FINAL_PASS_MODE", "always")
+
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    calls = []
+
+    class _FakeChatCompletions:
+        def create(self, **kwargs):
+            system = kwargs["messages"][0]["content"]
+            if system == ai_service._BATCH_ANALYSIS_SYSTEM_PROMPT:
+                calls.append("batch_base")
+                # "b" is missing and "c" is malformed: both are retried alone.
+                payload = {"a": {"full_name": "Ann"}, "c": "not an object"}
+            elif system == ai_service._BATCH_FINAL_SYSTEM_PROMPT:
+                calls.append("batch_final")
+                payload = {"results": {key: {"full_name": key.upper()} for key in ("a", "b", "c")}}
+            elif system == ai_service._ANALYSIS_SYSTEM_PROMPT:
+                calls.append("single_base")
+                payload = {"full_name": None}
+            else:
+                calls.append("single_final")
+                payload = {"full_name": "D"}
+            return _completion(json.dumps(payload))
+
+    ai_service.client.chat.completions = _FakeChatCompletions()
+
+    emails = [
+        {"id": key, "subject": "Hi", "body": "Hello", "sender": f"{key}@example.com"}
+        for key in ("a", "b", "c", "d")
+    ]
+    out = ai_service.analyze_emails_batch(emails)
+
+    assert {key: value["full_name"] for key, value in out.items()} == {"a": "A", "b": "B", "c": "C", "d": "D"}
+    assert out["a"]["email"] == "a@example.com"
+    # Two chunks (3 + 1 emails); the single-email chunk misses the batch and retries alone.
+    assert calls.count("batch_base") == 2
+    assert calls.count("batch_final") == 2
+    assert calls.count("single_base") == 3
+    assert calls.count("single_final") == 1
+
+
+def test_merge_mode_folds_enrichment_without_second_call(monkeypatch):
+    monkeypatch.setenv("AI_FINAL_PASS_MODE", "merge")
+
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    person = [
+        {"title": "Ivan - LinkedIn", "snippet": "Engineer", "url": "https://ua.linkedin.com/in/ivan"},
+        {"title": "Blog", "snippet": "Posts", "url": "https://blog.example.com/ivan"},
+    ]
+    company = [{"title": "SoftServe", "snippet": "IT services company.", "url": "https://softserve.com"}]
+    monkeypatch.setattr(
+        ai_service,
+        "_run_enrichment",
+        lambda base_data, company_candidate, website_candidate: ("[DDG_SEARCH]\n...", person, company, True),
+    )
+
+    base_json_obj = {"full_name": "Ivan", "company": "SoftServe", "website": "softserve.com", "person_links": None}
+    fake = _install_fake_openai_client(ai_service, base_json_obj, {})
+
+    out = ai_service.analyze_email(subject="Hello", body="", sender="hr@softserve.com")
+
+    assert fake.calls == 1
+    assert out["company_summary"] == "IT services company."
+    assert out["website"] == "https://softserve.com"
+    assert out["person_links"] == ["https://ua.linkedin.com/in/ivan"]
+    assert out["company_insights"] == company
+    assert ai_service.get_analysis_path_stats() == {"fast": 0, "merged": 1, "final_llm": 0}
+
+
+def test_analyze_email_memoizes_by_content(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "false")
+
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+
+    fake = _install_fake_openai_client(ai_service, {"full_name": "Ann Lee"}, {})
+
+    first = ai_service.analyze_email(subject="Order", body="Hello,\n  need 5 units", sender="Ann@acme.io")
+    # Same content with different whitespace and sender case is a cache hit.
+    second = ai_service.analyze_email(subject="Order", body="Hello, need 5 units\n", sender="ann@acme.io")
+    assert second == first
+    assert fake.calls == 1
+
+    ai_service.analyze_email(subject="Order", body="Hello, need 5 units", sender="ann@acme.io", use_cache=False)
+    assert fake.calls == 2
+
+    ai_service.analyze_emails_batch([{"id": "m1", "subject": "Order", "body": "Hello, need 5 units", "sender": "ann@acme.io"}])
+    assert fake.calls == 2
+
+
+def test_prepare_body_strips_quotes_and_keeps_signature_within_budget(monkeypatch):
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    monkeypatch.setattr(ai_service, "AI_BODY_TOKEN_BUDGET", 60)
+
+    body = (
+        "Hi team,\n\n   We need   500 units.\n"
+        + "Details about the order and delivery. " * 40
+        + "\n\n-- \nIvan Petrenko\n+380 67 123 4567\n\n"
+        "On Mon, 3 Mar 2025 at 10:00, Bob <bob@example.com>\nwrote:\n> old thread\n> more\n"
+    )
+    out = ai_service._prepare_body(body)
+
+    assert out.startswith("Hi team,\n\nWe need 500 units.")
+    assert out.endswith("Ivan Petrenko\n+380 67 123 4567")
+    assert "[...]" in out and "old thread" not in out
+    assert ai_service._count_tokens(out) <= 62
+
+    stats = ai_service.get_body_trim_stats()
+    assert stats["emails"] == 1
+    assert stats["tokens_saved"] == stats["tokens_in"] - stats["tokens_out"] > 0
+
+
+def test_stream_email_replies_interleaves_variants(monkeypatch):
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    monkeypatch.setattr(ai_service, "get_reply_prompts", lambda: {})
+
+    def _chunk(text):
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=types.SimpleNamespace(content=text))])
+
+    class _FakeStream:
+        def __init__(self, pieces):
+            self.pieces = pieces
+
+        async def __aiter__(self):
+            for piece in self.pieces:
+                await asyncio.sleep(0.01)
+                yield _chunk(piece)
+
+        async def close(self):
+            pass
+
+    class _FakeAsyncCompletions:
+        async def create(self, **kwargs):
+            assert kwargs["stream"] is True
+            topic = kwargs["messages"][1]["content"].split("\n")[3]
+            return _FakeStream([topic, " and", " more"])
+
+    ai_service.async_client.chat.completions = _FakeAsyncCompletions()
+
+    async def _collect():
+        return [event async for event in ai_service.stream_email_replies(
+            lead={"full_name": "Jane Roe"},
+            email={"subject": "Pricing"},
+            prompt_overrides={"follow_up": "Thank [NAME]", "recap": "Recap [TOPIC_DISCUSSED]"},
+        )]
+
+    events = asyncio.run(_collect())
+
+    kinds = [event["event"] for event in events]
+    # Both variants stream before either finishes.
+    assert kinds[:2] == ["delta", "delta"]
+    assert {events[0]["variant"], events[1]["variant"]} == {"follow_up", "recap"}
+    done = {event["variant"]: event["text"] for event in events if event["event"] == "done"}
+    assert done == {"follow_up": "Thank Jane Roe and more", "recap": "Recap Pricing and more"}
+    assert kinds.count("delta") == 6
+
+
+def test_reply_prompts_use_stored_keys_and_compiled_templates(monkeypatch):
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    monkeypatch.setattr(
+        ai_service,
+        "get_reply_prompts",
+        lambda: {"reply_prompt_follow_up": "Thanks [NAME] re [TOPIC DISCUSSED] [UNKNOWN]", "reply_prompt_recap": ""},
+    )
+
+    messages = ai_service._prepare_reply_messages({"full_name": "Jane Roe"}, {"subject": "Pricing"}, None, None)
+
+    assert "Thanks Jane Roe re Pricing [UNKNOWN]" in messages["follow_up"][1]["content"]
+    assert messages["recap"] is None
+    assert ai_service._compile_template.cache_info().currsize == 1
+
+    ai_service._prepare_reply_messages({"full_name": "Ann"}, None, None, None)
+    assert ai_service._compile_template.cache_info().hits >= 1
+
+    ai_service._compile_template.cache_clear()
+
+
+def test_empty_search_results_skip_the_final_call(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "true")
+
+    import importlib
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    monkeypatch.setattr(ai_service, "search_company_tool", lambda name: ai_service._NO_SEARCH_RESULTS_TEXT)
+    monkeypatch.setattr(ai_service, "fetch_website_tool", lambda url: f"{ai_service._WEBSITE_ERROR_PREFIX} timed out")
+    monkeypatch.setattr(ai_service, "search_person_insights", lambda name, company=None: [])
+
+    base_json_obj = {"full_name": "Ivan", "company": "Acme", "website": "acme.io"}
+    fake = _install_fake_openai_client(ai_service, base_json_obj, {})
+
+    out = ai_service.analyze_email(subject="Hello", body="", sender="ivan@acme.io")
+
+    assert out["company"] == "Acme"
+    assert fake.calls == 1
+    assert ai_service.get_analysis_path_stats()["fast"] == 1
+
+
+def test_degraded_analyses_are_not_cached_for_the_full_ttl(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "true")
+
+    import importlib
+    import service.aiService as ai_service
+    from db import conn
+
+    importlib.reload(ai_service)
+
+    class _NotJsonCompletions:
+        calls = 0
+
+        def create(self, **kwargs):
+            self.calls += 1
+            return _completion("not json")
+
+    fake = _NotJsonCompletions()
+    ai_service.client.chat.completions = fake
+
+    # An unparseable completion is not cached, so the same email is retried.
+    ai_service.analyze_email(subject="Hi", body="Hello", sender="ann@example.com")
+    ai_service.analyze_email(subject="Hi", body="Hello", sender="ann@example.com")
+    assert fake.calls == 2
+
+    # A lookup that timed out only earns the short negative TTL.
+    monkeypatch.setattr(ai_service, "search_company_tool", lambda name: ai_service._SEARCH_TIMEOUT_TEXT)
+    monkeypatch.setattr(ai_service, "search_person_insights", lambda name, company=None: [])
+    _install_fake_openai_client(ai_service, {"full_name": "Bob", "company": "Acme"}, {})
+
+    ai_service.analyze_email(subject="Hi", body="Hello", sender="bob@acme.io")
+
+    rows = conn.execute(
+        "SELECT is_negative FROM cache_entries WHERE namespace = 'email_analysis'"
+    ).fetchall()
+    assert rows == [(True,)]
+
+
+def test_batch_enrichment_completes_when_lookups_queue(monkeypatch):
+    monkeypatch.setenv("COMPANY_SEARCH_ENABLED", "true")
+    monkeypatch.setenv("AI_BATCH_MAX_EMAILS", "10")
+    monkeypatch.setenv("AI_FINAL_PASS_MODE", "merge")
+
+    import importlib
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    import service.aiService as ai_service
+
+    importlib.reload(ai_service)
+    # 30 lookups on 3 workers queue for far longer than one lookup's budget.
+    monkeypatch.setattr(ai_service, "_enrichment_executor", ThreadPoolExecutor(max_workers=3))
+    monkeypatch.setattr(ai_service, "ENRICHMENT_DEADLINE_SECONDS", 0.3)
+
+    def slow(value):
+        def _tool(*args):
+            time.sleep(0.05)
+            return value
+        return _tool
+
+    monkeypatch.setattr(ai_service, "fetch_website_tool", slow("Title: Acme"))
+    monkeypatch.setattr(ai_service, "search_company_tool", slow("Acme overview"))
+    monkeypatch.setattr(ai_service, "search_person_insights", slow([{"snippet": "CTO at Acme", "url": ""}]))
+
+    ids = [f"e{idx}" for idx in range(10)]
+
+    class _FakeChatCompletions:
+        def create(self, **kwargs):
+            payload = {
+                email_id: {"full_name": f"Person {email_id}", "company": "Acme", "website": "acme.io"}
+                for email_id in ids
+            }
+            return _completion(json.dumps(payload))
+
+    ai_service.client.chat.completions = _FakeChatCompletions()
+
+    results = ai_service._analyze_email_chunk([
+        {"id": email_id, "subject": "Hi", "body": "Hello", "sender": f"{email_id}@acme.io"} for email_id in ids
+    ])
+
+    assert sorted(results) == ids
+    assert {quality for _, quality in results.values()} == {"complete"}
+    assert all(result["person_insights"] for result, _ in results.values())
+
+
+def test_token_encoding_is_loaded_once_under_concurrency(monkeypatch):
+    import threading
+    import time
+    import service.aiService as ai_service
+
+    loads = []
+
+    def slow_encoding_for_model(model):
+        loads.append(model)
+        time.sleep(0.05)
+        return types.SimpleNamespace(encode=lambda text: text.split())
+
+    monkeypatch.setattr(ai_service, "tiktoken", types.SimpleNamespace(encoding_for_model=slow_encoding_for_model))
+    monkeypatch.setattr(ai_service, "_token_encoding", None)
+    monkeypatch.setattr(ai_service, "_token_encoding_loaded", False)
+
+    counts = []
+    threads = [threading.Thread(target=lambda: counts.append(ai_service._count_tokens("a b c"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert len(loads) == 1
+    assert counts == [3] * 8
+
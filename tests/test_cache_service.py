@@ -0,0 +1,83 @@
+import pytest
+
+
+@pytest.fixture
+def cache_module():
+    import service.cacheService as cache_service
+
+    cache_service.conn.execute("DELETE FROM cache_entries")
+    return cache_service
+
+
+def test_cache_survives_a_new_instance(cache_module):
+    cache = cache_module.PersistentTTLCache("test_persist", ttl_seconds=60, negative_ttl_seconds=1)
+    cache.set("acme", {"context": "Acme overview", "results": [{"url": "https://acme.io"}]})
+
+    reloaded = cache_module.PersistentTTLCache("test_persist", ttl_seconds=60, negative_ttl_seconds=1)
+
+    assert reloaded.get("acme") == {"context": "Acme overview", "results": [{"url": "https://acme.io"}]}
+    assert reloaded.stats()["db_hits"] == 1
+    assert reloaded.get("acme") is not None
+    assert reloaded.stats()["hits"] == 1
+
+
+def test_negative_entries_expire_sooner(cache_module, monkeypatch):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(cache_module.time, "time", lambda: clock["now"])
+
+    cache = cache_module.PersistentTTLCache("test_ttl", ttl_seconds=600, negative_ttl_seconds=30)
+    cache.set("ok", "Acme overview")
+    cache.set("failed", "Search timeout.", negative=True)
+
+    clock["now"] += 60
+
+    assert cache.get("ok") == "Acme overview"
+    assert cache.get("failed") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_memory_front_is_lru_bounded(cache_module):
+    cache = cache_module.PersistentTTLCache(
+        "test_lru", ttl_seconds=60, negative_ttl_seconds=1, memory_max_entries=2
+    )
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    stats = cache.stats()
+    assert stats["memory_entries"] == 2
+    assert stats["evictions"] == 1
+    # "b" was least recently used; it is still served from DuckDB.
+    assert cache.get("b") == 2
+    assert cache.stats()["db_hits"] == 1
+
+
+def test_prune_trims_rows_over_the_limit(cache_module):
+    cache = cache_module.PersistentTTLCache(
+        "test_prune", ttl_seconds=60, negative_ttl_seconds=1, db_max_entries=2
+    )
+    for idx in range(4):
+        cache.set(f"k{idx}", idx)
+
+    cache.prune()
+
+    count = cache_module.conn.execute(
+        "SELECT count(*) FROM cache_entries WHERE namespace = 'test_prune'"
+    ).fetchone()[0]
+    assert count == 2
+
+
+def test_memory_hits_count_negatives_and_return_copies(cache_module):
+    cache = cache_module.PersistentTTLCache("test_copies", ttl_seconds=60, negative_ttl_seconds=30)
+    cache.set("failed", {"context": "Search timeout.", "results": []}, negative=True)
+    cache.set("ok", {"results": [{"url": "https://acme.io"}]})
+
+    assert cache.get("failed") is not None
+    cache.get("ok")["results"].append({"url": "https://evil.example"})
+
+    assert cache.get("ok") == {"results": [{"url": "https://acme.io"}]}
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["negative_hits"] == 1
+
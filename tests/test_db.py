@@ -0,0 +1,65 @@
+import db
+
+
+def test_migrate_received_at_converts_legacy_text():
+    conn = db.conn
+    conn.execute("DELETE FROM gmail_messages")
+    conn.execute(
+        "ALTER TABLE gmail_messages ALTER received_at SET DATA TYPE VARCHAR USING CAST(received_at AS VARCHAR)"
+    )
+    conn.execute(
+        """
+        INSERT INTO gmail_messages (gmail_id, received_at) VALUES
+            ('a', '2025-06-10 09:00:00'),
+            ('b', '10.06.2025 09:30:00'),
+            ('c', '06/11/2025'),
+            ('d', '2025-06-12T09:00:00+02:00'),
+            ('e', 'garbage')
+        """
+    )
+
+    db._migrate_received_at()
+    db._migrate_received_at()
+
+    assert conn.execute(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'gmail_messages' AND column_name = 'received_at'"
+    ).fetchone()[0] == "TIMESTAMP WITH TIME ZONE"
+    rows = conn.execute(
+        f"SELECT gmail_id, {db.select_message_columns(['received_at'])} FROM gmail_messages ORDER BY gmail_id"
+    ).fetchall()
+    assert rows == [
+        ("a", "2025-06-10 09:00:00"),
+        ("b", "2025-06-10 09:30:00"),
+        ("c", "2025-06-11 00:00:00"),
+        ("d", "2025-06-12 07:00:00"),
+        ("e", None),
+    ]
+    conn.execute("DELETE FROM gmail_messages")
+
+
+def test_migrate_json_columns_converts_legacy_text():
+    conn = db.conn
+    conn.execute("DELETE FROM gmail_messages")
+    for column in db.MESSAGE_JSON_SCHEMAS:
+        conn.execute(f"ALTER TABLE gmail_messages ALTER {column} SET DATA TYPE VARCHAR")
+    conn.execute(
+        """
+        INSERT INTO gmail_messages (gmail_id, person_links, person_insights, company_insights) VALUES
+            ('a', '["https://a.io", "https://b.io"]', '[{"title": "T", "snippet": "", "url": "https://t.io"}]', '[]'),
+            ('b', 'https://a.io; https://b.io;', 'garbage', NULL)
+        """
+    )
+
+    db._migrate_json_columns()
+    db._migrate_json_columns()
+
+    rows = conn.execute(
+        f"SELECT gmail_id, {db.select_message_columns(list(db.MESSAGE_JSON_SCHEMAS), decode_json=True)} "
+        "FROM gmail_messages ORDER BY gmail_id"
+    ).fetchall()
+    assert rows == [
+        ("a", ["https://a.io", "https://b.io"], [{"title": "T", "snippet": "", "url": "https://t.io"}], []),
+        ("b", ["https://a.io", "https://b.io"], None, None),
+    ]
+    conn.execute("DELETE FROM gmail_messages")
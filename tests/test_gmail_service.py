@@ -0,0 +1,436 @@
+import base64
+import types
+
+import pytest
+
+
+class _Request:
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self):
+        if isinstance(self._result, Exception):
+            raise self._result
+        return self._result
+
+
+class _FakeMessages:
+    def __init__(self, messages, page_size=None):
+        self._messages = messages
+        self._page_size = page_size
+
+    def list(self, pageToken=None, **kwargs):
+        ids = list(self._messages)
+        if self._page_size is None:
+            return _Request({"messages": [{"id": msg_id} for msg_id in ids]})
+
+        start = int(pageToken or 0)
+        page = ids[start:start + self._page_size]
+        response = {"messages": [{"id": msg_id} for msg_id in page]}
+        if start + self._page_size < len(ids):
+            response["nextPageToken"] = str(start + self._page_size)
+        return _Request(response)
+
+    def get(self, *, id, **kwargs):
+        return _Request(self._messages[id])
+
+
+class _FakeBatch:
+    def __init__(self, callback, log):
+        self._callback = callback
+        self._requests = []
+        self._log = log
+
+    def add(self, request, request_id):
+        self._requests.append((request_id, request))
+
+    def execute(self):
+        self._log.append([request_id for request_id, _ in self._requests])
+        for request_id, request in self._requests:
+            try:
+                self._callback(request_id, request.execute(), None)
+            except Exception as exc:
+                self._callback(request_id, None, exc)
+
+
+class _FakeHistory:
+    def __init__(self, added_ids, history_id, expired=False):
+        self._added_ids = added_ids
+        self._history_id = history_id
+        self._expired = expired
+        self.calls = []
+
+    def list(self, **kwargs):
+        self.calls.append(kwargs)
+        if self._expired:
+            from googleapiclient.errors import HttpError
+
+            return _Request(HttpError(types.SimpleNamespace(status=404, reason="Not Found"), b""))
+        return _Request({
+            "history": [{"messagesAdded": [{"message": {"id": msg_id}}]} for msg_id in self._added_ids],
+            "historyId": self._history_id,
+        })
+
+
+def _fake_gmail_service(messages, batch_log=None, history=None, page_size=None, profile_history_id="100"):
+    fake_messages = _FakeMessages(messages, page_size)
+    users = types.SimpleNamespace(
+        messages=lambda: fake_messages,
+        history=lambda: history,
+        getProfile=lambda userId: _Request({"historyId": profile_history_id}),
+    )
+    log = batch_log if batch_log is not None else []
+    return types.SimpleNamespace(
+        users=lambda: users,
+        new_batch_http_request=lambda callback: _FakeBatch(callback, log),
+    )
+
+
+def _gmail_message(sender, subject, body):
+    return {
+        "payload": {
+            "headers": [
+                {"name": "From", "value": sender},
+                {"name": "Subject", "value": subject},
+                {"name": "Date", "value": "Mon, 03 Mar 2025 10:15:00 +0000"},
+            ],
+            "body": {"data": base64.urlsafe_b64encode(body.encode("utf-8")).decode("ascii")},
+        }
+    }
+
+
+@pytest.fixture
+def gmail_service_module(monkeypatch):
+    import service.gmailService as gmail_service
+
+    gmail_service.conn.execute("DELETE FROM gmail_messages")
+    gmail_service.conn.execute("DELETE FROM processed_emails")
+    gmail_service.conn.execute("DELETE FROM sync_state")
+    gmail_service._processed_ids.clear()
+    return gmail_service
+
+
+def test_fetch_new_gmail_data_isolates_failures(gmail_service_module, monkeypatch):
+    messages = {
+        "m1": _gmail_message("Ann <ann@acme.io>", "Hello", "First"),
+        "m2": _gmail_message("Bob <bob@acme.io>", "Broken", "Second"),
+        "m3": _gmail_message("Cid <cid@acme.io>", "Again", "Third"),
+    }
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages))
+
+    def fake_analyze(subject, body, sender):
+        if subject == "Broken":
+            raise RuntimeError("model unavailable")
+        return {"full_name": sender.split("@")[0].title(), "company": "Acme"}
+
+    monkeypatch.setattr(gmail_service_module, "analyze_email", fake_analyze)
+
+    rows = gmail_service_module.fetch_new_gmail_data(workers=3)
+
+    assert [row[5] for row in rows] == ["Hello", "Again"]
+    assert gmail_service_module.is_processed("m1")
+    assert not gmail_service_module.is_processed("m2")
+    assert gmail_service_module.is_processed("m3")
+
+    stored = gmail_service_module.conn.execute(
+        "SELECT gmail_id, strftime(received_at, '%Y-%m-%d %H:%M:%S') FROM gmail_messages ORDER BY gmail_id"
+    ).fetchall()
+    assert stored == [("m1", "2025-03-03 10:15:00"), ("m3", "2025-03-03 10:15:00")]
+
+
+def test_fetch_new_gmail_data_skips_processed(gmail_service_module, monkeypatch):
+    messages = {"m1": _gmail_message("ann@acme.io", "Hello", "First")}
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages))
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    gmail_service_module.mark_as_processed("m1")
+
+    assert gmail_service_module.fetch_new_gmail_data() == []
+
+
+def test_fetch_new_gmail_data_batches_message_gets(gmail_service_module, monkeypatch):
+    messages = {
+        f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body")
+        for idx in range(5)
+    }
+    flaky = {"m3": RuntimeError("rate limited")}
+    batch_log = []
+
+    class _FlakyMessages(_FakeMessages):
+        def get(self, *, id, **kwargs):
+            if id in flaky:
+                return _Request(flaky.pop(id))
+            return super().get(id=id, **kwargs)
+
+    service = _fake_gmail_service(messages, batch_log)
+    flaky_messages = _FlakyMessages(messages)
+    service.users().messages = lambda: flaky_messages
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: service)
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    gmail_service_module.mark_as_processed("m0")
+
+    rows = gmail_service_module.fetch_new_gmail_data(fetch_mode="batch", batch_size=2)
+
+    assert batch_log == [["m1", "m2"], ["m3", "m4"]]
+    # m3 failed inside its batch and was re-fetched individually.
+    assert [row[5] for row in rows] == ["Subject 1", "Subject 2", "Subject 3", "Subject 4"]
+
+
+def test_full_scan_follows_page_tokens_and_stores_history_id(gmail_service_module, monkeypatch):
+    messages = {
+        f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body")
+        for idx in range(5)
+    }
+    service = _fake_gmail_service(messages, page_size=2, profile_history_id="555")
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: service)
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    rows = gmail_service_module.fetch_new_gmail_data(limit=2, fetch_mode="single")
+
+    assert len(rows) == 5
+    assert gmail_service_module.get_sync_state("gmail_history_id") == "555"
+
+
+def test_history_sync_lists_only_added_messages(gmail_service_module, monkeypatch):
+    messages = {
+        "old": _gmail_message("old@acme.io", "Old", "Body"),
+        "new": _gmail_message("new@acme.io", "New", "Body"),
+    }
+    history = _FakeHistory(["new"], history_id="200")
+    service = _fake_gmail_service(messages, history=history)
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: service)
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    gmail_service_module.set_sync_state("gmail_history_id", "150")
+
+    rows = gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+
+    assert [row[5] for row in rows] == ["New"]
+    assert history.calls[0]["startHistoryId"] == "150"
+    assert gmail_service_module.get_sync_state("gmail_history_id") == "200"
+
+
+def test_expired_history_id_falls_back_to_full_scan(gmail_service_module, monkeypatch):
+    messages = {"m1": _gmail_message("ann@acme.io", "Hello", "Body")}
+    history = _FakeHistory([], history_id=None, expired=True)
+    service = _fake_gmail_service(messages, history=history, profile_history_id="900")
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: service)
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    gmail_service_module.set_sync_state("gmail_history_id", "1")
+
+    rows = gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+
+    assert [row[5] for row in rows] == ["Hello"]
+    assert gmail_service_module.get_sync_state("gmail_history_id") == "900"
+
+
+def test_filter_unprocessed_and_bulk_mark(gmail_service_module):
+    gmail_service_module.mark_many_as_processed(["a", "b", "b"])
+
+    assert gmail_service_module.filter_unprocessed(["c", "a", "d", "b", "c"]) == ["c", "d"]
+    assert gmail_service_module.conn.execute("SELECT count(*) FROM processed_emails").fetchone()[0] == 2
+
+
+def test_warm_cache_answers_without_database(gmail_service_module, monkeypatch):
+    gmail_service_module.conn.execute("INSERT INTO processed_emails (gmail_id) VALUES ('x'), ('y')")
+    assert gmail_service_module.warm_processed_ids_cache() == 2
+
+    class _NoQueries:
+        def execute(self, *args, **kwargs):
+            raise AssertionError("cache hit should not query DuckDB")
+
+    monkeypatch.setattr(gmail_service_module, "conn", _NoQueries())
+
+    assert gmail_service_module.filter_unprocessed(["x", "y"]) == []
+
+
+def test_store_message_batch_upserts_and_keeps_sync_state(gmail_service_module):
+    columns = gmail_service_module._MESSAGE_VALUE_COLUMNS
+
+    def values(subject, phone=None):
+        row = ["" for _ in columns]
+        row[columns.index("subject")] = subject
+        row[columns.index("phone")] = phone
+        return row
+
+    gmail_service_module._store_message_batch([("a", values("First")), ("b", values("Second"))])
+    gmail_service_module.mark_messages_synced(["a"])
+
+    gmail_service_module._store_message_batch([
+        ("a", values("First v2", phone=380501234567)),
+        ("c", values("Third")),
+        ("c", values("Third v2")),
+    ])
+
+    stored = gmail_service_module.conn.execute(
+        "SELECT gmail_id, subject, phone, synced_at IS NOT NULL FROM gmail_messages ORDER BY gmail_id"
+    ).fetchall()
+    assert stored == [
+        ("a", "First v2", "380501234567", True),
+        ("b", "Second", None, False),
+        ("c", "Third v2", None, False),
+    ]
+
+
+def test_mark_messages_synced_records_sheet_rows(gmail_service_module):
+    row = ["" for _ in gmail_service_module._MESSAGE_VALUE_COLUMNS]
+    gmail_service_module._store_message_batch([("a", row), ("b", row), ("c", row)])
+
+    gmail_service_module.mark_messages_synced(["a", "c"], first_sheet_row=10)
+
+    stored = gmail_service_module.conn.execute(
+        "SELECT gmail_id, sheet_row, synced_at IS NOT NULL FROM gmail_messages ORDER BY gmail_id"
+    ).fetchall()
+    assert stored == [("a", 10, True), ("b", None, False), ("c", 11, True)]
+
+
+def test_parse_received_at_normalizes_to_iso(gmail_service_module):
+    assert gmail_service_module._parse_received_at("Mon, 03 Mar 2025 10:15:00 +0200") == "2025-03-03T10:15:00+02:00"
+    assert gmail_service_module._parse_received_at("Mon, 03 Mar 2025 10:15:00 -0000") == "2025-03-03T10:15:00+00:00"
+    assert gmail_service_module._parse_received_at("not a date") is None
+    assert gmail_service_module._parse_received_at("") is None
+
+
+def test_fetch_new_gmail_data_batch_analysis(gmail_service_module, monkeypatch):
+    messages = {
+        f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body")
+        for idx in range(5)
+    }
+    batches = []
+
+    def fake_analyze_batch(emails):
+        batches.append([email["id"] for email in emails])
+        # m2 fails analysis and is left for the next sync.
+        return {email["id"]: {"company": "Acme"} for email in emails if email["id"] != "m2"}
+
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages))
+    monkeypatch.setattr(gmail_service_module, "analyze_emails_batch", fake_analyze_batch)
+    monkeypatch.setattr(gmail_service_module, "AI_BATCH_MAX_EMAILS", 2)
+
+    rows = gmail_service_module.fetch_new_gmail_data(analysis_mode="batch")
+
+    assert sorted(batches) == [["m0", "m1"], ["m2", "m3"], ["m4"]]
+    assert [row[5] for row in rows] == ["Subject 0", "Subject 1", "Subject 3", "Subject 4"]
+    assert not gmail_service_module.is_processed("m2")
+    assert gmail_service_module.is_processed("m3")
+    assert gmail_service_module.conn.execute("SELECT count(*) FROM gmail_messages").fetchone()[0] == 4
+
+
+def test_per_row_stores_refresh_the_rollup_once_per_sync(gmail_service_module, monkeypatch):
+    import service.leadStatsService as lead_stats
+
+    gmail_service_module.conn.execute("DELETE FROM lead_stats_daily")
+    messages = {f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body") for idx in range(3)}
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages))
+    monkeypatch.setattr(gmail_service_module, "analyze_email", lambda **kwargs: {})
+
+    refreshes = []
+    real_refresh = gmail_service_module.refresh_lead_stats_days
+    monkeypatch.setattr(
+        gmail_service_module,
+        "refresh_lead_stats_days",
+        lambda days: (refreshes.append(days), real_refresh(days)),
+    )
+
+    gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+
+    assert len(refreshes) == 1
+    assert gmail_service_module.conn.execute(
+        "SELECT sum(total) FROM lead_stats_daily"
+    ).fetchone()[0] == 3
+    assert lead_stats.verify_lead_stats() == []
+
+
+def test_sync_reuses_worker_threads_across_calls(gmail_service_module, monkeypatch):
+    import threading
+
+    messages = {f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body") for idx in range(4)}
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages))
+
+    threads = []
+
+    def fake_analyze(**kwargs):
+        threads.append(threading.current_thread())
+        return {}
+
+    monkeypatch.setattr(gmail_service_module, "analyze_email", fake_analyze)
+
+    gmail_service_module.fetch_new_gmail_data(workers=2, fetch_mode="single", sync_mode="full")
+    first_threads = set(threads)
+    threads.clear()
+    gmail_service_module.conn.execute("DELETE FROM processed_emails")
+    gmail_service_module._processed_ids.clear()
+    gmail_service_module.fetch_new_gmail_data(workers=2, fetch_mode="single", sync_mode="full")
+
+    assert set(threads) <= first_threads
+    assert gmail_service_module._get_sync_executor(2) is gmail_service_module._get_sync_executor(2)
+
+
+def test_deleted_and_persistently_failing_messages_leave_the_retry_list(gmail_service_module, monkeypatch):
+    from googleapiclient.errors import HttpError
+
+    messages = {
+        "gone": HttpError(types.SimpleNamespace(status=404, reason="Not Found"), b""),
+        "poison": _gmail_message("bad@acme.io", "Broken", "Body"),
+    }
+    history = _FakeHistory(["gone", "poison"], history_id="200")
+    monkeypatch.setattr(gmail_service_module, "get_gmail_service", lambda: _fake_gmail_service(messages, history=history))
+    monkeypatch.setattr(gmail_service_module, "GMAIL_RETRY_MAX_ATTEMPTS", 3)
+
+    def fake_analyze(**kwargs):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(gmail_service_module, "analyze_email", fake_analyze)
+
+    gmail_service_module.set_sync_state("gmail_history_id", "150")
+
+    gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+
+    assert gmail_service_module.is_processed("gone")
+    assert gmail_service_module._load_retry_attempts() == {"poison": 1}
+
+    history._added_ids = []
+    gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+    assert gmail_service_module._load_retry_attempts() == {"poison": 2}
+
+    gmail_service_module.fetch_new_gmail_data(fetch_mode="single")
+    assert gmail_service_module._load_retry_attempts() == {}
+    assert not gmail_service_module.is_processed("poison")
+
+
+def test_throttled_batch_items_are_rebatched_with_backoff(gmail_service_module, monkeypatch):
+    from googleapiclient.errors import HttpError
+
+    messages = {
+        f"m{idx}": _gmail_message(f"user{idx}@acme.io", f"Subject {idx}", "Body")
+        for idx in range(3)
+    }
+    throttled = {
+        "m1": [HttpError(types.SimpleNamespace(status=429, reason="Too Many Requests"), b"")] * 2,
+        "m2": [HttpError(types.SimpleNamespace(status=503, reason="Backend Error"), b"")],
+    }
+    single_gets = []
+    batch_log = []
+
+    class _ThrottledMessages(_FakeMessages):
+        def get(self, *, id, **kwargs):
+            if throttled.get(id):
+                return _Request(throttled[id].pop())
+            return super().get(id=id, **kwargs)
+
+    service = _fake_gmail_service(messages, batch_log)
+    throttled_messages = _ThrottledMessages(messages)
+    service.users().messages = lambda: throttled_messages
+    sleeps = []
+    monkeypatch.setattr(gmail_service_module.time, "sleep", sleeps.append)
+    monkeypatch.setattr(gmail_service_module, "_fetch_message", lambda msg_id: single_gets.append(msg_id))
+
+    fetched = gmail_service_module._fetch_messages_batch(service, list(messages))
+
+    assert sorted(fetched) == ["m0", "m1", "m2"]
+    assert batch_log == [["m0", "m1", "m2"], ["m1", "m2"], ["m1"]]
+    assert len(sleeps) == 2 and sleeps[1] > sleeps[0]
+    assert single_gets == []
+
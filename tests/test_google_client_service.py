@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+
+def _write_token(path, expiry, token="access-token", mtime=None):
+    path.write_text(json.dumps({
+        "token": token,
+        "refresh_token": "refresh-token",
+        "client_id": "client",
+        "client_secret": "secret",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "expiry": expiry.strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }), encoding="utf-8")
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def google_clients(monkeypatch, tmp_path):
+    import service.googleClientService as google_clients
+
+    token_file = tmp_path / "token.json"
+    monkeypatch.setattr(google_clients, "TOKEN_FILE", token_file)
+    monkeypatch.setattr(google_clients, "_credentials", None)
+    monkeypatch.setattr(google_clients, "_credentials_mtime", None)
+    monkeypatch.setattr(google_clients, "_thread_state", threading.local())
+
+    builds = []
+    monkeypatch.setattr(
+        google_clients, "build_from_document",
+        lambda document, credentials: builds.append(credentials) or object(),
+    )
+
+    refreshes = []
+
+    def fake_refresh(self, request):
+        refreshes.append(self.token)
+        self.token = f"refreshed-{len(refreshes)}"
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(google_clients.Credentials, "refresh", fake_refresh)
+    return google_clients, token_file, builds, refreshes
+
+
+def test_service_is_built_once_per_thread(google_clients):
+    google_clients, token_file, builds, refreshes = google_clients
+    _write_token(token_file, datetime.utcnow() + timedelta(hours=1))
+
+    first = google_clients.get_google_service("gmail", "v1")
+    assert google_clients.get_google_service("gmail", "v1") is first
+    assert google_clients.get_google_service("sheets", "v4") is not first
+
+    other = []
+    worker = threading.Thread(target=lambda: other.append(google_clients.get_google_service("gmail", "v1")))
+    worker.start()
+    worker.join()
+
+    assert other[0] is not first
+    assert len(builds) == 3
+    # Every service shares the one Credentials object.
+    assert all(creds is builds[0] for creds in builds)
+    assert refreshes == []
+
+
+def test_discovery_documents_are_parsed_once(google_clients):
+    google_clients, *_ = google_clients
+
+    document = google_clients._discovery_document("gmail", "v1")
+    assert document["name"] == "gmail"
+    assert google_clients._discovery_document("gmail", "v1") is document
+
+
+def test_token_is_refreshed_before_it_expires(google_clients):
+    google_clients, token_file, _, refreshes = google_clients
+    _write_token(token_file, datetime.utcnow() + timedelta(seconds=30))
+
+    creds = google_clients.get_credentials()
+
+    assert refreshes == ["access-token"]
+    assert creds.token == "refreshed-1"
+    assert json.loads(token_file.read_text(encoding="utf-8"))["token"] == "refreshed-1"
+
+    google_clients.get_credentials()
+    assert len(refreshes) == 1
+
+
+def test_rewritten_token_file_rebuilds_services(google_clients):
+    google_clients, token_file, builds, _ = google_clients
+    _write_token(token_file, datetime.utcnow() + timedelta(hours=1), mtime=1_000_000)
+    first = google_clients.get_google_service("gmail", "v1")
+
+    _write_token(token_file, datetime.utcnow() + timedelta(hours=1), token="new-token", mtime=2_000_000)
+    second = google_clients.get_google_service("gmail", "v1")
+
+    assert second is not first
+    assert builds[-1].token == "new-token"
+
+
+def test_missing_token_file_raises(google_clients):
+    google_clients, *_ = google_clients
+
+    with pytest.raises(FileNotFoundError):
+        google_clients.get_google_service("gmail", "v1")
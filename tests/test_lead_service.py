@@ -0,0 +1,221 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import service.leadStatsService as lead_stats
+
+
+@pytest.fixture
+def lead_service_module():
+    import service.leadService as lead_service
+
+    lead_service.conn.execute("DELETE FROM gmail_messages")
+    lead_service.conn.execute("DELETE FROM lead_stats_daily")
+    return lead_service
+
+
+def _insert_lead(conn, gmail_id, created_at, sheet_row=None, **fields):
+    values = {
+        "status": "waiting",
+        "email": f"{gmail_id}@acme.io",
+        "subject": f"Subject {gmail_id}",
+        "received_at": created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "person_links": json.dumps(["https://linkedin.com/in/" + gmail_id]),
+        "person_insights": "[]",
+        "company_insights": json.dumps([{"title": "Acme", "snippet": "", "url": "https://acme.io"}]),
+        **fields,
+    }
+    columns = ["gmail_id", "created_at", "sheet_row", *values]
+    conn.execute(
+        f"INSERT INTO gmail_messages ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+        [gmail_id, created_at, sheet_row, *values.values()],
+    )
+    lead_stats.refresh_lead_stats_days(lead_stats.lead_days_for_messages([gmail_id]))
+
+
+def test_fetch_lead_rows_pages_newest_first(lead_service_module):
+    base = datetime(2025, 3, 1, 12, 0, 0)
+    for idx in range(5):
+        _insert_lead(lead_service_module.conn, f"m{idx}", base + timedelta(minutes=idx), sheet_row=idx + 2)
+
+    first_page, cursor = lead_service_module.fetch_lead_rows(limit=2)
+    assert [lead["gmail_id"] for lead in first_page] == ["m4", "m3"]
+    assert first_page[0]["sheet_row"] == 6
+    assert first_page[0]["person_links"] == ["https://linkedin.com/in/m4"]
+    assert first_page[0]["company_insights"][0]["url"] == "https://acme.io"
+    assert first_page[0]["phone"] == ""
+
+    second_page, cursor = lead_service_module.fetch_lead_rows(limit=2, cursor=cursor)
+    assert [lead["gmail_id"] for lead in second_page] == ["m2", "m1"]
+
+    last_page, cursor = lead_service_module.fetch_lead_rows(limit=2, cursor=cursor)
+    assert [lead["gmail_id"] for lead in last_page] == ["m0"]
+    assert cursor is None
+
+
+def test_build_leads_payload_reads_duckdb(lead_service_module):
+    _insert_lead(lead_service_module.conn, "m1", datetime.utcnow(), sheet_row=2, phone="+380501112233")
+
+    payload = lead_service_module.build_leads_payload(limit=10)
+
+    assert [lead["gmail_id"] for lead in payload["leads"]] == ["m1"]
+    assert payload["next_cursor"] is None
+    assert payload["stats"]["qualified"] == 1
+    assert set(payload) == {"leads", "next_cursor", "stats", "line", "quarter", "month", "pie", "generated_at"}
+
+
+def _reference_stats(leads, now):
+    """The per-lead Python aggregation build_leads_payload used before the SQL version."""
+    month_totals = {}
+    week_totals, week_qualified = [0, 0, 0, 0], [0, 0, 0, 0]
+    qualified_total = waiting_total = active_total = 0
+    for lead_dt, status, qualified in leads:
+        qualified_total += qualified
+        if status == "waiting" and not qualified:
+            waiting_total += 1
+        if lead_dt >= now - timedelta(days=30):
+            active_total += 1
+        bucket = month_totals.setdefault((lead_dt.year, lead_dt.month), [0, 0])
+        bucket[0] += 1
+        bucket[1] += qualified
+        week_index = max((now - lead_dt).days, 0) // 7
+        if week_index < 4:
+            week_totals[3 - week_index] += 1
+            week_qualified[3 - week_index] += qualified
+    return month_totals, week_totals, week_qualified, qualified_total, waiting_total, active_total
+
+
+def test_compute_lead_stats_matches_python_reference(lead_service_module):
+    now = datetime(2025, 6, 15, 10, 30, 0)
+    offsets = [0, 0.4, 6.9, 7.0, 13.5, 20, 27.99, 28, 29.5, 31, 45, 90, 200, 364, 400, -2]
+    leads = []
+    for idx, days in enumerate(offsets):
+        lead_dt = (now - timedelta(days=days)).replace(microsecond=0)
+        qualified = idx % 3 == 0
+        status = "confirmed" if idx % 4 == 0 else "waiting"
+        leads.append((lead_dt, status, qualified))
+        # Ingestion writes ISO 8601 with an offset; manual rows may omit it.
+        fmt = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S+00:00"][idx % 2]
+        _insert_lead(
+            lead_service_module.conn, f"m{idx}", lead_dt,
+            received_at=lead_dt.strftime(fmt),
+            status=status,
+            company="Acme" if qualified else "",
+        )
+
+    result = lead_service_module.compute_lead_stats(now)
+    month_totals, week_totals, week_qualified, qualified_total, waiting_total, active_total = _reference_stats(leads, now)
+
+    assert result["stats"] == {
+        "active": active_total,
+        "completed": len(leads),
+        "percentage": int(round(qualified_total / len(leads) * 100)),
+        "qualified": qualified_total,
+        "waiting": waiting_total,
+    }
+    assert [point["pv"] for point in result["month"]] == week_totals
+    assert [point["uv"] for point in result["month"]] == week_qualified
+    assert [point["name"] for point in result["line"]][-1] == "JUN"
+    for point, bucket in zip(result["line"], lead_service_module._generate_month_buckets(now)):
+        assert [point["pv"], point["uv"]] == month_totals.get((bucket.year, bucket.month), [0, 0])
+    assert result["quarter"] == result["line"][-3:]
+
+
+def test_invalid_cursor_is_rejected(lead_service_module):
+    with pytest.raises(ValueError):
+        lead_service_module.fetch_lead_rows(limit=2, cursor="not-a-cursor")
+
+
+def test_update_lead_status_writes_through_to_duckdb(lead_service_module):
+    import service.sheetService as sheet_service
+
+    lead_service_module.conn.execute("DELETE FROM sheet_status_outbox")
+    _insert_lead(lead_service_module.conn, "m1", datetime.utcnow(), sheet_row=7)
+
+    sheet_service.update_lead_status(7, "Confirmed")
+
+    leads, _ = lead_service_module.fetch_lead_rows(limit=1)
+    assert leads[0]["status"] == "confirmed"
+    assert sheet_service.pending_status_updates() == {7: "confirmed"}
+
+
+def test_first_row_of_range():
+    import service.sheetService as sheet_service
+
+    assert sheet_service._first_row_of_range("Sheet1!A12:T14") == 12
+    assert sheet_service._first_row_of_range("'Leads 2025'!A3:T3") == 3
+    assert sheet_service._first_row_of_range(None) is None
+
+
+def test_rollup_stats_match_live_stats_on_whole_days(lead_service_module):
+    now = datetime(2025, 6, 15, 10, 30, 0)
+    for idx, days in enumerate([0, 1, 6, 7, 13, 27, 28, 30, 31, 45, 200, 400]):
+        _insert_lead(
+            lead_service_module.conn, f"m{idx}", now - timedelta(days=days),
+            status="confirmed" if idx % 4 == 0 else "waiting",
+            company="Acme" if idx % 3 == 0 else "",
+        )
+    _insert_lead(lead_service_module.conn, "undated", now, received_at=None)
+
+    assert lead_service_module.compute_rollup_lead_stats(now) == lead_service_module.compute_lead_stats(now)
+    assert lead_stats.verify_lead_stats() == []
+
+
+def test_rollup_follows_upserts_and_status_changes(lead_service_module):
+    import service.gmailService as gmail_service
+    import service.sheetService as sheet_service
+
+    values = dict(zip(gmail_service._MESSAGE_VALUE_COLUMNS, [""] * len(gmail_service._MESSAGE_VALUE_COLUMNS)))
+    values.update(status="waiting", received_at="2025-06-10 09:00:00")
+    gmail_service._store_message_batch([
+        ("a", list(values.values())),
+        ("b", list({**values, "company": "Acme"}.values())),
+    ])
+    assert lead_service_module.conn.execute(
+        "SELECT day, total, qualified, waiting FROM lead_stats_daily"
+    ).fetchall() == [(datetime(2025, 6, 10).date(), 2, 1, 1)]
+
+    # Moving "a" to another day must shrink the old day's row.
+    gmail_service._store_message_batch([("a", list({**values, "received_at": "2025-06-12 09:00:00"}.values()))])
+    lead_service_module.conn.execute("UPDATE gmail_messages SET sheet_row = 5 WHERE gmail_id = 'a'")
+
+    sheet_service.update_lead_status(5, "confirmed")
+
+    assert lead_service_module.conn.execute(
+        "SELECT day, total, qualified, waiting FROM lead_stats_daily ORDER BY day"
+    ).fetchall() == [(datetime(2025, 6, 10).date(), 1, 1, 0), (datetime(2025, 6, 12).date(), 1, 0, 0)]
+    assert lead_stats.verify_lead_stats() == []
+
+
+def test_rebuild_lead_stats_repairs_drift(lead_service_module):
+    _insert_lead(lead_service_module.conn, "m1", datetime(2025, 6, 1, 8, 0, 0))
+    lead_service_module.conn.execute("UPDATE lead_stats_daily SET total = 99")
+
+    assert len(lead_stats.verify_lead_stats()) == 1
+    assert lead_stats.rebuild_lead_stats() == 1
+    assert lead_stats.verify_lead_stats() == []
+
+
+def test_json_columns_round_trip_as_structures(lead_service_module):
+    import service.gmailService as gmail_service
+
+    values = dict(zip(gmail_service._MESSAGE_VALUE_COLUMNS, [""] * len(gmail_service._MESSAGE_VALUE_COLUMNS)))
+    values.update(
+        received_at="2025-06-10T09:00:00+00:00",
+        person_links=["https://linkedin.com/in/ann"],
+        person_insights=[{"title": "Ann", "snippet": "CTO", "url": "https://ann.dev", "rank": 1}],
+        company_insights={"not": "a list"},
+    )
+    gmail_service._store_message_batch([("m1", list(values.values()))])
+
+    leads, _ = lead_service_module.fetch_lead_rows(limit=1)
+    assert leads[0]["person_links"] == ["https://linkedin.com/in/ann"]
+    assert leads[0]["person_insights"] == [{"title": "Ann", "snippet": "CTO", "url": "https://ann.dev"}]
+    assert leads[0]["company_insights"] == []
+
+    # The sheet still receives JSON text.
+    (_, row), = gmail_service.get_unsynced_message_rows()
+    columns = dict(zip(gmail_service._MESSAGE_VALUE_COLUMNS, row))
+    assert json.loads(columns["person_links"]) == ["https://linkedin.com/in/ann"]
+    assert columns["company_insights"] == ""
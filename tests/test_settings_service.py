@@ -0,0 +1,38 @@
+import pytest
+
+
+class _NoQueries:
+    def execute(self, *args, **kwargs):
+        raise AssertionError("settings should be served from memory")
+
+
+@pytest.fixture
+def settings_service():
+    import service.settingsService as settings_service
+
+    settings_service.conn.execute("DELETE FROM app_settings WHERE key LIKE 'test_%'")
+    settings_service.reload_settings()
+    yield settings_service
+    settings_service.conn.execute("DELETE FROM app_settings WHERE key LIKE 'test_%'")
+    settings_service.reload_settings()
+
+
+def test_settings_are_served_from_memory_after_first_read(settings_service, monkeypatch):
+    prompts = settings_service.get_reply_prompts()
+    assert "reply_prompt_follow_up" in prompts
+
+    real_conn = settings_service.conn
+    monkeypatch.setattr(settings_service, "conn", _NoQueries())
+    assert settings_service.get_reply_prompts() == prompts
+
+    monkeypatch.setattr(settings_service, "conn", real_conn)
+    updated = []
+    settings_service.on_setting_updated(updated.append)
+    settings_service.update_reply_prompt("test_prompt", "Hi [NAME]")
+
+    # Write-through: memory and DuckDB both see the new value.
+    monkeypatch.setattr(settings_service, "conn", _NoQueries())
+    assert settings_service.get_reply_prompts()["test_prompt"] == "Hi [NAME]"
+    monkeypatch.setattr(settings_service, "conn", real_conn)
+    assert real_conn.execute("SELECT value FROM app_settings WHERE key = 'test_prompt'").fetchone() == ("Hi [NAME]",)
+    assert updated == ["test_prompt"]
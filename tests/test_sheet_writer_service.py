@@ -0,0 +1,220 @@
+import types
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+
+class _FakeValues:
+    def __init__(self, fail_statuses=()):
+        self.fail_statuses = list(fail_statuses)
+        self.appends = []
+        self.batch_updates = []
+        self.next_row = 2
+
+    def _call(self, record, response):
+        def execute():
+            if self.fail_statuses:
+                raise HttpError(httplib2.Response({"status": self.fail_statuses.pop(0)}), b"rate limited")
+            record()
+            return response()
+        return types.SimpleNamespace(execute=execute)
+
+    def append(self, **kwargs):
+        def response():
+            first = self.next_row
+            self.next_row += len(kwargs["body"]["values"])
+            return {"updates": {"updatedRange": f"Sheet1!A{first}:T{self.next_row - 1}"}}
+        return self._call(lambda: self.appends.append(kwargs), response)
+
+    def batchUpdate(self, **kwargs):
+        return self._call(lambda: self.batch_updates.append(kwargs), dict)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    import service.sheetWriterService as sheet_writer
+    from db import conn
+
+    conn.execute("DELETE FROM gmail_messages")
+    conn.execute("DELETE FROM sheet_status_outbox")
+
+    values = _FakeValues()
+    service = types.SimpleNamespace(spreadsheets=lambda: types.SimpleNamespace(values=lambda: values))
+    monkeypatch.setattr(sheet_writer, "_get_sheet_service", lambda: service)
+    sleeps = []
+    monkeypatch.setattr(sheet_writer.time, "sleep", sleeps.append)
+    return sheet_writer, conn, values, sleeps
+
+
+def _stage_messages(count):
+    import service.gmailService as gmail_service
+
+    empty = [""] * len(gmail_service._MESSAGE_VALUE_COLUMNS)
+    gmail_service._store_message_batch([(f"m{idx}", ["waiting", *empty[1:]]) for idx in range(count)])
+
+
+def test_flush_appends_staged_rows_and_records_sheet_rows(writer):
+    sheet_writer, conn, values, _ = writer
+    _stage_messages(3)
+
+    assert sheet_writer.flush_sheet_writes() == {"appended": 3, "statuses": 0}
+
+    assert len(values.appends) == 1
+    assert conn.execute(
+        "SELECT count(*) FROM gmail_messages WHERE synced_at IS NOT NULL AND sheet_row BETWEEN 2 AND 4"
+    ).fetchone()[0] == 3
+    assert sheet_writer.flush_sheet_writes() == {"appended": 0, "statuses": 0}
+
+
+def test_status_changes_coalesce_into_one_batch_update(writer):
+    import service.sheetService as sheet_service
+
+    sheet_writer, _, values, _ = writer
+
+    sheet_service.update_lead_status(7, "confirmed")
+    sheet_service.update_lead_status(7, "rejected")
+    sheet_service.update_lead_status(9, "snoozed")
+    assert sheet_service.sheet_writes_pending.is_set()
+
+    assert sheet_writer.flush_sheet_writes() == {"appended": 0, "statuses": 2}
+
+    assert len(values.batch_updates) == 1
+    assert values.batch_updates[0]["body"]["data"] == [
+        {"range": "A7", "values": [["rejected"]]},
+        {"range": "A9", "values": [["snoozed"]]},
+    ]
+    assert sheet_service.pending_status_updates() == {}
+
+
+def test_rate_limited_writes_back_off_and_retry(writer):
+    import service.sheetService as sheet_service
+
+    sheet_writer, _, values, sleeps = writer
+    values.fail_statuses = [429, 429]
+
+    sheet_service.update_lead_status(3, "confirmed")
+    sheet_writer.flush_sheet_writes()
+
+    # Exponential backoff from SHEETS_BACKOFF_BASE_SECONDS (1s) with jitter in [0.5, 1].
+    assert 0.5 <= sleeps[0] <= 1 and 1 <= sleeps[1] <= 2
+    assert len(values.batch_updates) == 1
+    assert sheet_service.pending_status_updates() == {}
+
+
+def test_failed_status_write_stays_queued(writer, monkeypatch):
+    import service.sheetService as sheet_service
+
+    sheet_writer, _, values, _ = writer
+    monkeypatch.setattr(sheet_writer, "SHEETS_MAX_RETRIES", 1)
+    values.fail_statuses = [429, 429]
+
+    sheet_service.update_lead_status(3, "confirmed")
+    with pytest.raises(HttpError):
+        sheet_writer.flush_sheet_writes()
+
+    assert sheet_service.pending_status_updates() == {3: "confirmed"}
+
+
+def test_appends_are_not_retried_on_server_errors(writer):
+    sheet_writer, conn, values, sleeps = writer
+    values.fail_statuses = [503]
+    _stage_messages(1)
+
+    with pytest.raises(HttpError):
+        sheet_writer.flush_sheet_writes()
+
+    assert sleeps == []
+    assert conn.execute("SELECT count(*) FROM gmail_messages WHERE synced_at IS NULL").fetchone()[0] == 1
+
+
+def test_status_by_gmail_id_targets_the_recorded_sheet_row(writer):
+    import service.sheetService as sheet_service
+
+    sheet_writer, conn, values, _ = writer
+    _stage_messages(2)
+    conn.execute("UPDATE gmail_messages SET sheet_row = 12 WHERE gmail_id = 'm1'")
+
+    assert sheet_service.update_lead_status_by_gmail_id("m1", "Confirmed") == 12
+    # m0 has not been appended yet: no sheet write, the append will carry the status.
+    assert sheet_service.update_lead_status_by_gmail_id("m0", "rejected") is None
+    assert sheet_service.pending_status_updates() == {12: "confirmed"}
+    assert conn.execute("SELECT status FROM gmail_messages ORDER BY gmail_id").fetchall() == [
+        ("rejected",), ("confirmed",),
+    ]
+
+    sheet_writer.flush_sheet_writes()
+    assert values.batch_updates[0]["body"]["data"] == [{"range": "A12", "values": [["confirmed"]]}]
+    assert values.appends[0]["body"]["values"][0][0] == "rejected"
+
+
+def test_status_by_unknown_gmail_id_is_rejected(writer):
+    import service.sheetService as sheet_service
+
+    with pytest.raises(LookupError):
+        sheet_service.update_lead_status_by_gmail_id("missing", "confirmed")
+    with pytest.raises(ValueError):
+        sheet_service.update_lead_status_by_gmail_id("missing", "maybe")
+    assert sheet_service.pending_status_updates() == {}
+
+
+def test_bulk_status_update_reports_per_item_and_sends_one_batch(writer):
+    import service.sheetService as sheet_service
+
+    sheet_writer, conn, values, _ = writer
+    _stage_messages(3)
+    conn.execute("UPDATE gmail_messages SET sheet_row = 10 + CAST(substr(gmail_id, 2) AS INTEGER)")
+
+    results = sheet_service.update_lead_statuses([
+        {"gmail_id": "m0", "status": "confirmed"},
+        {"gmail_id": "m1", "status": "maybe"},
+        {"gmail_id": "missing", "status": "rejected"},
+        {"row_number": 12, "status": "Snoozed"},
+        {"row_number": 40, "status": "new"},
+        {"status": "new"},
+        {"gmail_id": "m0", "status": "rejected"},
+    ])
+
+    assert [result["ok"] for result in results] == [True, False, False, True, True, False, True]
+    assert results[0]["row_number"] == 10
+    assert results[1]["error"] == "Unsupported status value"
+    assert results[2]["error"] == "Unknown gmail_id: missing"
+    assert results[3]["gmail_id"] == "m2" and results[3]["status"] == "snoozed"
+    assert results[4]["gmail_id"] is None
+
+    assert conn.execute("SELECT gmail_id, status FROM gmail_messages ORDER BY gmail_id").fetchall() == [
+        ("m0", "rejected"), ("m1", "waiting"), ("m2", "snoozed"),
+    ]
+
+    sheet_writer.flush_sheet_writes()
+    assert len(values.batch_updates) == 1
+    assert values.batch_updates[0]["body"]["data"] == [
+        {"range": "A10", "values": [["rejected"]]},
+        {"range": "A12", "values": [["snoozed"]]},
+        {"range": "A40", "values": [["new"]]},
+    ]
+
+
+def test_status_change_during_append_is_corrected(writer, monkeypatch):
+    import service.sheetService as sheet_service
+
+    sheet_writer, conn, values, _ = writer
+    _stage_messages(2)
+
+    real_read = sheet_writer.get_unsynced_message_rows
+
+    def read_then_update(limit):
+        rows = real_read(limit)
+        # Lands after the row was read but before its sheet_row is recorded.
+        sheet_service.update_lead_status_by_gmail_id("m1", "confirmed")
+        return rows
+
+    monkeypatch.setattr(sheet_writer, "get_unsynced_message_rows", read_then_update)
+
+    assert sheet_writer.flush_sheet_writes() == {"appended": 2, "statuses": 1}
+
+    assert values.appends[0]["body"]["values"][1][0] == "waiting"
+    sheet_row = conn.execute("SELECT sheet_row FROM gmail_messages WHERE gmail_id = 'm1'").fetchone()[0]
+    assert values.batch_updates[0]["body"]["data"] == [{"range": f"A{sheet_row}", "values": [["confirmed"]]}]
+    assert sheet_service.pending_status_updates() == {}
+
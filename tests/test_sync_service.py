@@ -0,0 +1,81 @@
+import asyncio
+import threading
+
+import pytest
+
+
+def test_sync_is_single_flight(monkeypatch):
+    import service.autosyncService as autosync_service
+    import service.syncService as sync_service
+
+    started = threading.Event()
+    release = threading.Event()
+    fetches = []
+
+    def slow_fetch():
+        fetches.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return []
+
+    monkeypatch.setattr(sync_service, "fetch_new_gmail_data", slow_fetch)
+    monkeypatch.setattr(sync_service, "request_sheet_flush", lambda: None)
+
+    worker = threading.Thread(target=sync_service.sync_gmail_to_sheets)
+    worker.start()
+    assert started.wait(timeout=5)
+
+    with pytest.raises(sync_service.SyncInProgressError):
+        sync_service.sync_gmail_to_sheets()
+
+    release.set()
+    worker.join(timeout=5)
+    assert sync_service.sync_gmail_to_sheets() == 0
+
+    # Two POST /sync requests at once, while the first is still queued
+    # behind other work: the second is refused, not queued after it.
+    release.clear()
+    fetches.clear()
+    executor_busy = threading.Event()
+    autosync_service._sync_executor.submit(executor_busy.wait, 5)
+
+    async def two_requests():
+        first = asyncio.ensure_future(autosync_service.run_sync())
+        second = asyncio.ensure_future(autosync_service.run_sync())
+        with pytest.raises(sync_service.SyncInProgressError):
+            await second
+        executor_busy.set()
+        release.set()
+        return await first
+
+    assert asyncio.run(two_requests()) == 0
+    assert len(fetches) == 1
+    assert not sync_service.is_sync_running()
+
+
+def test_run_sync_runs_off_the_event_loop(monkeypatch):
+    import service.autosyncService as autosync_service
+    import service.syncService as sync_service
+
+    loop_threads = []
+
+    def fake_sync(limit=None):
+        loop_threads.append(threading.current_thread().name)
+        return 3
+
+    monkeypatch.setattr(sync_service, "_sync_gmail_to_sheets", fake_sync)
+
+    assert asyncio.run(autosync_service.run_sync()) == 3
+    assert loop_threads[0].startswith("gmail-sync-loop")
+
+
+def test_next_sync_interval_adapts_within_bounds(monkeypatch):
+    import service.autosyncService as autosync_service
+
+    monkeypatch.setattr(autosync_service, "AUTO_SYNC_MIN_INTERVAL_SECONDS", 15)
+    monkeypatch.setattr(autosync_service, "AUTO_SYNC_MAX_INTERVAL_SECONDS", 300)
+
+    assert autosync_service.next_sync_interval(60, saved=4) == 30
+    assert autosync_service.next_sync_interval(20, saved=1) == 15
+    assert autosync_service.next_sync_interval(60, saved=0) == 90
+    assert autosync_service.next_sync_interval(250, saved=0) == 300